@@ -13,9 +13,23 @@ from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_huggingface import HuggingFacePipeline, HuggingFaceEndpoint, ChatHuggingFace
 from langchain_core.messages import SystemMessage, AIMessage, HumanMessage, ToolMessage
 
+from api_metrics import METRICS, sidebar_lines
+from api_scheduler import SCHEDULER
+from calendar_desktop_api import add_event, get_calendar_tasks
+from intent_router import ROUTER, RouteMetrics, describe, timed
+from llm_cache import CACHE_PATH, LLMResponseCache
+from llm_history import HistoryManager, TokenCounter
+from llm_stream import StreamedResponse
+from tool_executor import ToolExecutor
+
 load_dotenv()
 
 model = os.getenv('LLM_MODEL', 'HuggingFaceH4/zephyr-7b-beta')
+# LLM_BACKEND=local - модель в этом процессе, вывод ограничен JSON-схемой ToolCallOrResponse
+backend = os.getenv('LLM_BACKEND', 'endpoint')
+max_new_tokens = 1024
+# LLM_STREAM=0 - ждать весь JSON и показывать ответ целиком
+stream_responses = os.getenv('LLM_STREAM', '1') == '1'
 
 
 def test_func(test_func_arg):
@@ -38,30 +52,94 @@ def test_func(test_func_arg):
         return f"Exception when calling TEST FUNC: {e}"
  
 
+available_tools = {
+    "test_func": test_func,
+    "add_event": add_event,
+    "get_calendar_tasks": get_calendar_tasks,
+}
+
+
 @st.cache_resource
 def get_local_model():
+    if backend == "local":
+        return HuggingFacePipeline.from_model_id(
+            model_id=model,
+            task="text-generation",
+            pipeline_kwargs={
+                "max_new_tokens": max_new_tokens,
+                "do_sample": False,
+                "return_full_text": False,
+            },
+        )
+
     return HuggingFaceEndpoint(
         repo_id=model,
         task="text-generation",
-        max_new_tokens=1024,
+        max_new_tokens=max_new_tokens,
         do_sample=False
     )
 
-    # return HuggingFacePipeline.from_model_id(
-    #     model_id=model,
-    #     task="text-generation",
-    #     pipeline_kwargs={
-    #         "max_new_tokens": 1024,
-    #         "top_k": 50,
-    #         "temperature": 0.4
-    #     },
-    # )
 
-llm = get_local_model()     
+@st.cache_resource
+def get_tool_call_processor(tool_names):
+    # import here: torch is only needed for the local pipeline
+    from json_constraint import ToolCallLogitsProcessor
+
+    return ToolCallLogitsProcessor(llm.pipeline.tokenizer, tool_names, max_new_tokens=max_new_tokens)
+
+
+def generation_kwargs():
+    """
+    Call-time arguments of the local pipeline: every reply parses as
+    ToolCallOrResponse on the first try. The processor keeps the state of
+    one generation, so each call gets a fresh one.
+    """
+    if backend != "local":
+        return {}
+    from transformers import LogitsProcessorList
+
+    processor = get_tool_call_processor(tuple(available_tools)).fresh()
+    return {"pipeline_kwargs": {"logits_processor": LogitsProcessorList([processor])}}
+
+
+llm = get_local_model()
+
+# инструменты без побочных эффектов: ответ с их вызовом можно брать из кэша
+idempotent_tools = ["get_calendar_tasks"]
+
+
+@st.cache_resource
+def get_response_cache():
+    return LLMResponseCache(path=CACHE_PATH, idempotent_tools=idempotent_tools)
+
+
+response_cache = get_response_cache()
+
+
+@st.cache_resource
+def get_tool_executor():
+    # независимые вызовы инструментов из одного ответа выполняются параллельно
+    return ToolExecutor(available_tools)
+
+
+tool_executor = get_tool_executor()
+
+
+@st.cache_resource
+def get_history_manager():
+    # токены считаются токенизатором той же модели, что отвечает
+    return HistoryManager(TokenCounter.from_pretrained(model))
 
-available_tools = {
-    "test_func": test_func
-}
+
+history = get_history_manager()
+
+
+@st.cache_resource
+def get_route_metrics():
+    return RouteMetrics()
+
+
+route_metrics = get_route_metrics()
 
 tool_descriptions = [f"{name}:\n{func.__doc__}\n\n" for name, func in available_tools.items()]
 
@@ -93,48 +171,163 @@ Any message that starts with "Thought:" is you thinking to yourself. This isn't
 Don't repeat an action. If a thought tells you that you already took an action for a user, don't do it again.
 """       
 
-def prompt_ai(messages, nested_calls=0, invoked_tools=[]):
+def tool_thought(tool_call, tool_output):
+    tool_name = tool_call["name"].lower()
+    return AIMessage(content=f"Thought: - I called {tool_name} with args {tool_call['args']} and got back: {tool_output}.")
+
+
+def collect_tool_calls(pending, messages, invoked_tools):
+    """
+    Waits for submitted tool calls and adds their results to the messages
+    as Thoughts, in the order the model asked for them. A call cancelled
+    before it started is taken back out of invoked_tools, so the model may
+    ask for it again. An exception of a tool becomes its "Error: ..." Thought,
+    so the calls after it still get theirs.
+    """
+    for item in pending:
+        try:
+            output = tool_executor.result(item)
+        except Exception as e:
+            output = f"Error: {e}"
+        messages.append(tool_thought(item.tool_call, output))
+        if not item.started and str(item.tool_call) in invoked_tools:
+            invoked_tools.remove(str(item.tool_call))
+
+
+def stream_ai(prompt, messages, invoked_tools, dispatched):
+    """
+    Streams the reply into the current chat container; tool calls are
+    started as soon as their JSON object is closed, before the model finishes.
+    """
+    pending = []
+
+    def on_tool_call(tool_call):
+        if str(tool_call) not in invoked_tools and tool_call["name"].lower() in available_tools:
+            pending.append(tool_executor.submit(tool_call))
+            invoked_tools.append(str(tool_call))
+            dispatched.append(str(tool_call))
+
+    chat = ChatHuggingFace(llm=llm)
+    chunks = (chunk.content for chunk in chat.stream(prompt, **generation_kwargs()))
+    streamed = StreamedResponse(chunks, on_tool_call)
+    try:
+        st.write_stream(streamed)
+    finally:
+        collect_tool_calls(pending, messages, invoked_tools)
+    print(f"Time to first token: {streamed.ttft}, total: {streamed.elapsed}")
+    return streamed.response
+
+
+def prompt_ai(messages, nested_calls=0, invoked_tools=[], stream=False):
     if nested_calls > 3:
         raise Exception("Failsafe - AI is failing too much!")
 
     # First, prompt the AI with the latest user message
     parser = JsonOutputParser(pydantic_object=ToolCallOrResponse)
-    chatbot = ChatHuggingFace(llm=llm) | parser
-    
-    try:
-        ai_response = chatbot.invoke(messages)
-    except Exception as e:
-        st.error(f"Error invoking AI: {e}")
-        return prompt_ai(messages, nested_calls + 1)
+    chatbot = ChatHuggingFace(llm=llm).bind(**generation_kwargs()) | parser
+    # tool calls already run while the reply was streaming
+    dispatched = []
+
+    # the history within the token budget: system prompt, tool schema, recent turns
+    prompt = history.compact(messages, tool_text)
+    print(f"Prompt: {history.report}")
+
+    cache_key = response_cache.key(prompt, tool_text, model)
+    ai_response = response_cache.get(cache_key)
+    if ai_response is None:
+        try:
+            if stream:
+                ai_response = stream_ai(prompt, messages, invoked_tools, dispatched)
+            else:
+                ai_response = chatbot.invoke(prompt)
+        except Exception as e:
+            st.error(f"Error invoking AI: {e}")
+            # вызванные до ошибки инструменты уже в invoked_tools
+            return prompt_ai(messages, nested_calls + 1, invoked_tools, stream)
+        response_cache.put(cache_key, ai_response)
+    elif stream and ai_response["content"]:
+        st.markdown(ai_response["content"])
 
     print(f"AI Response: {ai_response}")
 
     # Second, see if the AI decided it needs to invoke a tool
     has_tool_calls = len(ai_response["tool_calls"]) > 0
     if has_tool_calls:
-        # Next, for each tool the AI wanted to call, call it and add the tool result to the list of messages
+        # Next, pick the tool calls to run: up to the first one that was already made or doesn't exist
+        tool_calls = []
+        stop_response = None
         for tool_call in ai_response["tool_calls"]:
-            if str(tool_call) not in invoked_tools:
-                tool_name = tool_call["name"].lower()
-                selected_tool = available_tools.get(tool_name)
-                if selected_tool:
-                    tool_output = selected_tool(**tool_call["args"])
-                    messages.append(AIMessage(content=f"Thought: - I called {tool_name} with args {tool_call['args']} and got back: {tool_output}."))
-                    invoked_tools.append(str(tool_call))
-                else:
-                    st.error(f"Tool {tool_name} not found.")
-                    return {"content": f"Tool {tool_name} not found.", "tool_calls": []}
-            else:
-                return ai_response
+            if str(tool_call) in dispatched:
+                continue
+            if str(tool_call) in invoked_tools:
+                stop_response = ai_response
+                break
+            tool_name = tool_call["name"].lower()
+            if tool_name not in available_tools:
+                st.error(f"Tool {tool_name} not found.")
+                stop_response = {"content": f"Tool {tool_name} not found.", "tool_calls": []}
+                break
+            tool_calls.append(tool_call)
+            invoked_tools.append(str(tool_call))
+
+        # Run them in parallel and add the tool results to the list of messages
+        collect_tool_calls([tool_executor.submit(tool_call) for tool_call in tool_calls], messages,
+                           invoked_tools)
+        if stop_response is not None:
+            return stop_response
 
         # Prompt the AI again now that the result of calling the tool(s) has been added to the chat history
-        return prompt_ai(messages, nested_calls + 1, invoked_tools)
+        return prompt_ai(messages, nested_calls + 1, invoked_tools, stream)
 
     return ai_response
 
 
+def answer(messages, prompt):
+    """
+    Formulaic commands ("add meeting tomorrow at 15", "покажи задачи") are
+    parsed by the intent router and run without the model; the rest goes
+    to prompt_ai.
+    """
+    intent = ROUTER.route(prompt)
+    if intent is None:
+        with timed(route_metrics, "llm"):
+            ai_response = prompt_ai(messages, stream=stream_responses)
+        if not stream_responses:
+            st.markdown(ai_response['content'])
+        return ai_response
+
+    with timed(route_metrics, "router"):
+        outputs = []
+        for item in [tool_executor.submit(tool_call) for tool_call in intent.tool_calls]:
+            try:
+                outputs.append(tool_executor.result(item))
+            except Exception as e:
+                outputs.append(f"Error: {e}")
+        for tool_call, tool_output in zip(intent.tool_calls, outputs):
+            messages.append(tool_thought(tool_call, tool_output))
+        ai_response = {"tool_calls": intent.tool_calls, "content": describe(intent, outputs)}
+    print(f"Routed: {intent}")
+    st.markdown(ai_response['content'])
+    return ai_response
+
+
 def main():
     st.title("Chatbot")
+    stats = response_cache.stats
+    st.sidebar.caption(f"Response cache: {stats['hits']} hits, {stats['misses']} misses, "
+                       f"{stats['skipped']} skipped, hit rate {response_cache.hit_rate():.0%}")
+    if history.report:
+        st.sidebar.caption(f"Last prompt: {history.report['prompt_tokens']} tokens, "
+                           f"{history.report['messages']} messages, "
+                           f"{history.report['dropped']} dropped")
+    paths = route_metrics.summary()
+    st.sidebar.caption(f"Router hit rate {route_metrics.hit_rate():.0%}: " + ", ".join(
+        f"{path} {stats['count']} x {stats['mean_ms'] or 0:.0f} ms" for path, stats in paths.items()))
+    with st.sidebar.expander("Google API"):
+        for line in sidebar_lines(METRICS.snapshot()):
+            st.caption(line)
+        st.caption(f"queue: {SCHEDULER.depth()}, throttled {SCHEDULER.stats['throttled']}, "
+                   f"retries {SCHEDULER.stats['retries']}")
 
     # Initialize chat history
     if "messages" not in st.session_state:
@@ -160,8 +353,7 @@ def main():
 
         # Display assistant response in chat message container
         with st.chat_message("assistant"):
-            ai_response = prompt_ai(st.session_state.messages)
-            st.markdown(ai_response['content'])
+            ai_response = answer(st.session_state.messages, prompt)
         
         st.session_state.messages.append(AIMessage(content=ai_response['content']))
 
@@ -0,0 +1,362 @@
+import bisect
+import contextlib
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from googleapiclient.http import HttpRequest
+
+
+# границы корзин гистограммы задержек, секунды (как у клиентов Prometheus)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram; quantiles are the upper bound of the bucket
+    they fall into, like histogram_quantile() without interpolation.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # последняя корзина - +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, share: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = share * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "sum_s": self.sum,
+            "mean_ms": self.sum / self.count * 1e3 if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1e3,
+            "p95_ms": self.quantile(0.95) * 1e3,
+            "max_ms": self.max * 1e3,
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+        }
+
+
+def transport_method(uri: str, method: str) -> str:
+    """
+    Name of a round trip no HttpRequest is behind: "calendar.batch" and
+    "tasks.batch" for batch calls, "<HTTP method> <path>" otherwise.
+    """
+    parts = urlsplit(uri)
+    segments = parts.path.strip("/").split("/")
+    if segments[0] == "batch":
+        # calendar: /batch/calendar/v3, tasks: tasks.googleapis.com/batch
+        service = segments[1] if len(segments) > 1 else parts.hostname.split(".")[0]
+        return f"{service}.batch"
+    return f"{method} {parts.path}"
+
+
+class ApiMetrics:
+    """
+    Per-method metrics of Google API calls: call and request counts, HTTP
+    statuses, latency histogram, response bytes and retries, plus hit/miss
+    counts of the caches in front of the API.
+
+    A call is one HttpRequest.execute(): InstrumentedHttpRequest opens it,
+    InstrumentedHttp adds every round trip made inside it, so retries are
+    round trips after the first. Round trips outside a call (batch
+    requests) are recorded as calls of their own; requests counts the
+    API requests inside, i.e. the quota they use.
+
+    Every finished call is passed to the sinks (LogSink, ...);
+    snapshot() and prometheus_text() read the totals.
+
+    Example call:
+
+    service_calendar = build("calendar", "v3", http=InstrumentedHttp(PooledHttp(creds)),
+                             requestBuilder=InstrumentedHttpRequest)
+    METRICS.add_sink(LogSink())
+    print(METRICS.snapshot()["methods"]["calendar.events.list"])
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sinks = []
+        self._watched = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self._caches = {}
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self._sinks.remove(sink)
+
+    @contextlib.contextmanager
+    def call(self, method: str):
+        """
+        One API call; round trips made by this thread inside the block
+        are added to it.
+        """
+        state = {"method": method, "status": None, "requests": 1, "round_trips": 0,
+                 "response_bytes": 0, "error": None}
+        previous = getattr(self._local, "call", None)
+        self._local.call = state
+        start = time.perf_counter()
+        try:
+            yield state
+        except Exception as error:
+            state["error"] = type(error).__name__
+            raise
+        finally:
+            self._local.call = previous
+            state["latency"] = time.perf_counter() - start
+            self.record(state)
+
+    def round_trip(self, uri: str, method: str, status: int, response_bytes: int,
+                   latency: float, requests: int = 1):
+        state = getattr(self._local, "call", None)
+        if state is None:
+            self.record({"method": transport_method(uri, method), "status": status,
+                         "requests": requests, "round_trips": 1, "response_bytes": response_bytes,
+                         "latency": latency, "error": None if status else "TransportError"})
+            return
+        state["round_trips"] += 1
+        state["status"] = status
+        state["response_bytes"] += response_bytes
+
+    def record(self, call: dict):
+        call["retries"] = max(call["round_trips"] - 1, 0)
+        # 0 - ответа не было (сеть, таймаут)
+        status = call["status"] or 0
+        with self._lock:
+            stats = self._methods.get(call["method"])
+            if stats is None:
+                stats = self._methods[call["method"]] = {
+                    "calls": 0, "requests": 0, "errors": 0, "retries": 0,
+                    "response_bytes": 0, "statuses": {}, "latency": Histogram(self.buckets),
+                }
+            stats["calls"] += 1
+            stats["requests"] += call["requests"]
+            stats["errors"] += status >= 400 or status == 0
+            stats["retries"] += call["retries"]
+            stats["response_bytes"] += call["response_bytes"]
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["latency"].observe(call["latency"])
+        for sink in self._sinks:
+            sink.record(call)
+
+    def cache_lookup(self, cache: str, hit: bool):
+        with self._lock:
+            stats = self._caches.setdefault(cache, {"hits": 0, "misses": 0})
+            stats["hits" if hit else "misses"] += 1
+
+    def watch_cache(self, name: str, cache):
+        """
+        Reports a cache that keeps its own stats dict, like ServiceRegistry
+        with service_/settings_ counters: every *hits and *misses key is
+        summed, so the keys must not overlap (a disk_hits counted inside
+        hits would be counted twice).
+        """
+        self._watched[name] = cache
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            methods = {
+                method: {**{key: value for key, value in stats.items() if key != "latency"},
+                         "statuses": dict(stats["statuses"]),
+                         "latency": stats["latency"].snapshot()}
+                for method, stats in self._methods.items()
+            }
+            caches = {name: dict(stats) for name, stats in self._caches.items()}
+        for name, cache in self._watched.items():
+            stats = dict(cache.stats)
+            caches[name] = {
+                "hits": sum(value for key, value in stats.items() if key.endswith("hits")),
+                "misses": sum(value for key, value in stats.items() if key.endswith("misses")),
+            }
+        for stats in caches.values():
+            total = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return {"methods": methods, "caches": caches}
+
+
+class InstrumentedHttp:
+    """
+    Transport wrapper (PooledHttp, httplib2.Http, FakeGoogleHttp) that
+    reports every round trip to metrics. Other attributes, credentials
+    included, are the wrapped transport's.
+    """
+
+    def __init__(self, http, metrics: ApiMetrics = None):
+        self.http = http
+        self.metrics = metrics or METRICS
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        start = time.perf_counter()
+        status = 0
+        content = b""
+        try:
+            response, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+            status = response.status
+            return response, content
+        finally:
+            requests = 1
+            if body and transport_method(uri, method).endswith(".batch"):
+                requests = (body.encode() if isinstance(body, str) else body).count(b"Content-ID:")
+            self.metrics.round_trip(uri, method, status, len(content or b""),
+                                    time.perf_counter() - start, requests)
+
+
+class InstrumentedHttpRequest(HttpRequest):
+    """
+    requestBuilder for build()/build_from_document(): every execute() is
+    one call of ApiMetrics named by the discovery method id
+    ("calendar.events.list", "tasks.tasklists.list", ...).
+    """
+
+    def execute(self, http=None, num_retries=0):
+        metrics = getattr(http or self.http, "metrics", None) or METRICS
+        with metrics.call(self.methodId or transport_method(self.uri, self.method)):
+            return super().execute(http=http, num_retries=num_retries)
+
+
+class LogSink:
+    """
+    One log line per call:
+    google_api calendar.events.list status=200 latency_ms=84.1 bytes=5120 retries=0
+    """
+
+    def __init__(self, logger: logging.Logger = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger("google_api")
+        self.level = level
+
+    def record(self, call: dict):
+        self.logger.log(self.level, "google_api %s status=%s latency_ms=%.1f bytes=%d retries=%d%s",
+                        call["method"], call["status"] or 0, call["latency"] * 1e3,
+                        call["response_bytes"], call["retries"],
+                        f" error={call['error']}" if call["error"] else "")
+
+
+def _labels(**labels):
+    text = ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels.items())
+    return "{" + text + "}"
+
+
+_CACHE_RESULTS = {"hits": "hit", "misses": "miss"}
+
+
+def prometheus_text(metrics: ApiMetrics = None) -> str:
+    """
+    The snapshot in the Prometheus text exposition format.
+    """
+    snapshot = (metrics or METRICS).snapshot()
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    methods = snapshot["methods"]
+    family("google_api_calls_total", "counter", "API calls by method and final HTTP status")
+    for method, stats in methods.items():
+        for status, count in stats["statuses"].items():
+            lines.append(f"google_api_calls_total{_labels(method=method, status=status)} {count}")
+    for name, key, help_text in (
+            ("google_api_requests_total", "requests", "API requests, batch parts counted one by one"),
+            ("google_api_retries_total", "retries", "Round trips repeated inside one call"),
+            ("google_api_response_bytes_total", "response_bytes", "Response body bytes")):
+        family(name, "counter", help_text)
+        for method, stats in methods.items():
+            lines.append(f"{name}{_labels(method=method)} {stats[key]}")
+    family("google_api_call_duration_seconds", "histogram", "API call latency, retries included")
+    for method, stats in methods.items():
+        cumulative = 0
+        for bound, count in stats["latency"]["buckets"].items():
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"google_api_call_duration_seconds_bucket{_labels(method=method, le=le)} "
+                         f"{cumulative}")
+        lines.append(f"google_api_call_duration_seconds_sum{_labels(method=method)} "
+                     f"{stats['latency']['sum_s']:.6f}")
+        lines.append(f"google_api_call_duration_seconds_count{_labels(method=method)} {stats['calls']}")
+    family("google_api_cache_lookups_total", "counter", "Lookups of caches in front of the API")
+    for cache, stats in snapshot["caches"].items():
+        for key, result in _CACHE_RESULTS.items():
+            lines.append(f"google_api_cache_lookups_total{_labels(cache=cache, result=result)} "
+                         f"{stats[key]}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_prometheus(metrics: ApiMetrics = None, host: str = "0.0.0.0", port: int = 9464):
+    """
+    Serves prometheus_text() on http://host:port/metrics from a daemon
+    thread. Returns the server.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            content = prometheus_text(metrics).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def sidebar_lines(snapshot: dict, limit: int = 8):
+    """
+    Short lines for a Streamlit sidebar: the busiest methods and the caches.
+    """
+    methods = sorted(snapshot["methods"].items(), key=lambda item: -item[1]["calls"])
+    lines = [
+        f"{method}: {stats['calls']} x {stats['latency']['mean_ms']:.0f} ms "
+        f"(p95 {stats['latency']['p95_ms']:.0f}), {stats['response_bytes'] / 1024:.0f} KB, "
+        f"{stats['errors']} errors, {stats['retries']} retries"
+        for method, stats in methods[:limit]
+    ]
+    lines += [f"cache {name}: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%})" for name, stats in snapshot["caches"].items()]
+    return lines
+
+
+METRICS = ApiMetrics()
+# GOOGLE_API_LOG=1 - строка в лог на каждый вызов, GOOGLE_METRICS_PORT - /metrics для Prometheus
+if os.getenv("GOOGLE_API_LOG"):
+    METRICS.add_sink(LogSink())
+if os.getenv("GOOGLE_METRICS_PORT"):
+    serve_prometheus(METRICS, port=int(os.getenv("GOOGLE_METRICS_PORT")))
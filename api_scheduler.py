@@ -0,0 +1,317 @@
+import bisect
+import contextlib
+import email.utils
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+
+
+# квоты Calendar API по умолчанию: 600 запросов в минуту на пользователя,
+# 10 000 в минуту на проект; держимся чуть ниже
+USER_QPS = float(os.getenv("GOOGLE_USER_QPS", "9"))
+PROJECT_QPS = float(os.getenv("GOOGLE_PROJECT_QPS", "150"))
+# запас на всплеск: один batch из 50 частей проходит без ожидания
+BURST = int(os.getenv("GOOGLE_QUOTA_BURST", "50"))
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 64.0
+
+INTERACTIVE = 0
+WRITE = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", WRITE: "write", BULK: "bulk"}
+
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+_BATCH_PART_STATUS = re.compile(rb"^HTTP/1\.1 (\d{3})", re.M)
+_BATCH_PART_METHOD = re.compile(rb"^([A-Z]+) \S+ HTTP/1\.1", re.M)
+
+
+def backoff_delay(attempt: int, base: float = BASE_BACKOFF, cap: float = MAX_BACKOFF) -> float:
+    """
+    Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)].
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(headers) -> float:
+    """
+    Seconds from a Retry-After header (delta-seconds or HTTP date), 0 if absent.
+    """
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        date = email.utils.parsedate_to_datetime(value)
+        return max(date.timestamp() - time.time(), 0.0)
+
+
+def error_reason(content) -> str:
+    """
+    errors[0].reason of a Google error body, "" if there is none.
+    """
+    try:
+        error = json.loads(content)["error"]
+        return (error.get("errors") or [{}])[0].get("reason", "") or error.get("status", "")
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return ""
+
+
+def is_rate_limited(status: int, content) -> bool:
+    if status == 429:
+        return True
+    return status == 403 and error_reason(content) in RATE_LIMIT_REASONS
+
+
+class TokenBucket:
+    """
+    Token bucket with an adaptive rate: slow_down() halves it (once per
+    pause, answers to requests already in flight don't halve it again) and
+    blocks the bucket for a while, speed_up() wins back max_rate / 50 per
+    successful request. A request may cost more than is left; it waits for
+    min(cost, capacity) tokens and leaves the bucket in debt, so a 50-part
+    batch is not starved by single requests.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait(self, cost: float, now: float) -> float:
+        """
+        Seconds until cost can be taken, 0 if it can be now.
+        """
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        missing = min(cost, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, cost: float):
+        self.tokens -= cost
+
+    def slow_down(self, now: float, pause: float):
+        self._refill(now)
+        if now >= self.blocked_until:
+            self.rate = max(self.rate / 2, self.max_rate / 16)
+        self.tokens = min(self.tokens, 0.0)
+        self.blocked_until = max(self.blocked_until, now + pause)
+
+    def speed_up(self, requests: int = 1):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 50 * requests)
+
+
+class RequestScheduler:
+    """
+    Admission control for Calendar/Tasks requests shared by every service
+    of the process: a token bucket per user (credential_key) and one for
+    the project, waiters served by priority - INTERACTIVE reads, then
+    single WRITEs, then BULK batches - and, within one priority, in
+    arrival order. A waiter whose own user bucket is empty does not hold
+    up other users.
+
+    ScheduledHttp calls acquire() before every round trip and reports rate
+    limit answers with throttle(), which halves the bucket rate and blocks
+    it for Retry-After or a jittered backoff; successes restore the rate
+    step by step, so a bulk import settles just under the quota instead of
+    retrying into a storm of 429s.
+
+    Example call:
+
+    service = build("calendar", "v3", http=ScheduledHttp(PooledHttp(creds), user="anna"))
+    with SCHEDULER.priority(BULK):
+        service.events().list(calendarId="primary").execute()
+    print(SCHEDULER.depth())
+    """
+
+    def __init__(self, user_qps: float = USER_QPS, project_qps: float = PROJECT_QPS,
+                 burst: int = BURST, max_retries: int = MAX_RETRIES):
+        self.user_qps = user_qps
+        self.burst = burst
+        self.max_retries = max_retries
+        self.project = TokenBucket(project_qps, max(burst, project_qps))
+        self._users = {}
+        self._waiting = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.stats = {"requests": 0, "throttled": 0, "retries": 0, "gave_up": 0, "wait_s": 0.0}
+
+    def _bucket(self, user):
+        bucket = self._users.get(user)
+        if bucket is None:
+            bucket = self._users[user] = TokenBucket(self.user_qps, self.burst)
+        return bucket
+
+    @contextlib.contextmanager
+    def priority(self, priority: int):
+        """
+        Requests this thread makes inside the block get priority,
+        whatever their HTTP method.
+        """
+        previous = getattr(self._local, "priority", None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def current_priority(self):
+        return getattr(self._local, "priority", None)
+
+    def _turn(self, ticket, now: float):
+        # None - впереди есть готовый запрос, ждём его notify
+        for waiting in self._waiting:
+            _, _, user, cost = waiting
+            wait = max(self._bucket(user).wait(cost, now), self.project.wait(cost, now))
+            if waiting is ticket:
+                return wait
+            if wait == 0:
+                return None
+        return 0.0
+
+    def acquire(self, user, priority: int = INTERACTIVE, cost: int = 1) -> float:
+        """
+        Blocks until the request may go. Returns the seconds waited.
+        """
+        ticket = (priority, next(self._order), user, cost)
+        start = time.monotonic()
+        with self._cond:
+            bisect.insort(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._turn(ticket, now)
+                    if wait == 0:
+                        self._bucket(user).take(cost)
+                        self.project.take(cost)
+                        break
+                    self._cond.wait(wait if wait is not None else 0.05)
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self.stats["requests"] += 1
+            self.stats["wait_s"] += waited
+        return waited
+
+    def throttle(self, user, reason: str = "", pause: float = 0.0):
+        """
+        A rate-limit answer: userRateLimitExceeded slows the user's bucket,
+        anything else the project's.
+        """
+        with self._cond:
+            self.stats["throttled"] += 1
+            bucket = self._bucket(user) if reason == "userRateLimitExceeded" else self.project
+            bucket.slow_down(time.monotonic(), pause)
+            self._cond.notify_all()
+
+    def count(self, stat: str):
+        with self._cond:
+            self.stats[stat] += 1
+
+    def succeeded(self, user, requests: int = 1):
+        with self._cond:
+            self._bucket(user).speed_up(requests)
+            self.project.speed_up(requests)
+
+    def depth(self) -> dict:
+        """
+        Requests waiting for their turn, per priority.
+        """
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, _, _ in self._waiting:
+                depth[PRIORITY_NAMES[priority]] += 1
+            return depth
+
+    def rates(self) -> dict:
+        with self._cond:
+            return {"project": self.project.rate,
+                    **{str(user): bucket.rate for user, bucket in self._users.items()}}
+
+
+class ScheduledHttp:
+    """
+    Transport wrapper that sends every round trip through a
+    RequestScheduler on behalf of user. GETs are INTERACTIVE, other
+    methods WRITE, unless the thread set SCHEDULER.priority(...). A batch
+    costs one token per part; it is INTERACTIVE if every part is a GET
+    (load_task_lists), BULK otherwise.
+
+    Rate-limit answers (429, 403 rateLimitExceeded/userRateLimitExceeded)
+    throttle the scheduler and are retried after Retry-After or a
+    jittered exponential backoff, at most max_retries times; 5xx answers
+    are retried the same way for GETs only, a repeated insert could
+    create a duplicate. Rate-limited parts of a batch throttle the
+    scheduler too; google_batch.execute_batch resends them.
+    """
+
+    def __init__(self, http, scheduler: RequestScheduler = None, user=None):
+        self.http = http
+        self.scheduler = scheduler or SCHEDULER
+        self.user = user
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        scheduler = self.scheduler
+        batch = bool(re.match(r"https?://[^/]+/batch(/|$)", uri))
+        parts = (body.encode() if isinstance(body, str) else body or b"") if batch else b""
+        priority = scheduler.current_priority()
+        if priority is None:
+            if batch:
+                methods = set(_BATCH_PART_METHOD.findall(parts))
+                priority = INTERACTIVE if methods == {b"GET"} else BULK
+            else:
+                priority = INTERACTIVE if method == "GET" else WRITE
+        cost = max(parts.count(b"Content-ID:"), 1)
+        for attempt in range(scheduler.max_retries + 1):
+            scheduler.acquire(self.user, priority, cost)
+            response, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+            status = response.status
+            if is_rate_limited(status, content):
+                pause = max(retry_after(response), backoff_delay(attempt))
+                scheduler.throttle(self.user, error_reason(content), pause)
+            elif status >= 500 and method == "GET":
+                time.sleep(max(retry_after(response), backoff_delay(attempt)))
+            else:
+                if batch and status < 400:
+                    statuses = _BATCH_PART_STATUS.findall(content or b"")
+                    scheduler.succeeded(self.user, sum(part.startswith(b"2") for part in statuses))
+                    if self._batch_rate_limited(statuses, content):
+                        scheduler.throttle(self.user, self._batch_reason(content), backoff_delay(0))
+                elif status < 400:
+                    scheduler.succeeded(self.user)
+                return response, content
+            if attempt < scheduler.max_retries:
+                scheduler.count("retries")
+        scheduler.count("gave_up")
+        return response, content
+
+    @staticmethod
+    def _batch_reason(content) -> str:
+        return "userRateLimitExceeded" if b"userRateLimitExceeded" in content else ""
+
+    @staticmethod
+    def _batch_rate_limited(statuses, content) -> bool:
+        if b"429" in statuses:
+            return True
+        return b"403" in statuses and re.search(rb"[rR]ateLimitExceeded|quotaExceeded", content) is not None
+
+
+SCHEDULER = RequestScheduler()
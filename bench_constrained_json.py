@@ -0,0 +1,105 @@
+"""
+Parse failures and end-to-end latency of ToolCallOrResponse replies:
+free generation + JsonOutputParser (what prompt_ai does, up to 3 retries)
+vs generation constrained by json_constraint.ToolCallLogitsProcessor.
+
+Runs the model locally with transformers; greedy decoding like the
+endpoint, so a failed prompt fails the same way on every retry, exactly
+as in prompt_ai.
+
+python bench_constrained_json.py [model] [max_new_tokens]
+"""
+import statistics
+import sys
+import time
+
+import torch
+from langchain_core.output_parsers import JsonOutputParser
+from transformers import AutoModelForCausalLM, AutoTokenizer, LogitsProcessorList
+
+from json_constraint import ToolCallLogitsProcessor
+
+
+TOOLS = ["test_func", "add_event", "get_calendar_tasks"]
+MAX_ATTEMPTS = 4
+
+SYSTEM = """You always respond with a JSON object that has two required keys.
+tool_calls: list of {"name": str, "args": dict}, empty if you don't need to invoke a tool
+content: str, response to the user if a tool doesn't need to be invoked
+Don't start your answers with "Here is the JSON response", just give the JSON.
+The tools you have access to are: test_func(test_func_arg), add_event(summary, date, duration),
+get_calendar_tasks(n_events)."""
+
+PROMPTS = [
+    "Print 'today is a good day' to the console",
+    "Add a meeting with Anna tomorrow at 10 for an hour",
+    "What do I have planned this week?",
+    "Hi! How are you?",
+    "Добавь встречу с командой в пятницу в 15:00",
+    "Покажи мои задачи",
+    "Print hello and then show my next 5 events",
+    "Thanks, that's all",
+]
+
+
+def render(tokenizer, prompt):
+    messages = [{"role": "system", "content": SYSTEM}, {"role": "user", "content": prompt}]
+    if tokenizer.chat_template:
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    return f"{SYSTEM}\nUser: {prompt}\nAssistant: "
+
+
+def generate(model, tokenizer, text, max_new_tokens, processor=None):
+    processors = LogitsProcessorList([processor.fresh()]) if processor is not None else None
+    inputs = tokenizer(text, return_tensors="pt").to(model.device)
+    with torch.no_grad():
+        output = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                logits_processor=processors,
+                                pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id)
+    return tokenizer.decode(output[0, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+
+
+def run(name, model, tokenizer, max_new_tokens, processor=None):
+    parser = JsonOutputParser()
+    first_try_failures = 0
+    failures = 0
+    latencies = []
+    for prompt in PROMPTS:
+        text = render(tokenizer, prompt)
+        start = time.perf_counter()
+        for attempt in range(MAX_ATTEMPTS):
+            reply = generate(model, tokenizer, text, max_new_tokens, processor)
+            try:
+                parsed = parser.parse(reply)
+                if not isinstance(parsed, dict) or "tool_calls" not in parsed:
+                    raise ValueError("not a ToolCallOrResponse")
+                break
+            except Exception:
+                if attempt == 0:
+                    first_try_failures += 1
+        else:
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+    print(f"{name:<26} first-try parse failures {first_try_failures}/{len(PROMPTS)}   "
+          f"failed after retries {failures}/{len(PROMPTS)}   "
+          f"e2e mean {statistics.mean(latencies):>6.2f} s   max {max(latencies):>6.2f} s")
+
+
+def main(model_id="HuggingFaceH4/zephyr-7b-beta", max_new_tokens=256):
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype="auto", device_map="auto")
+    print(f"{model_id}, {len(PROMPTS)} prompts, max_new_tokens {max_new_tokens}")
+
+    run("free + JsonOutputParser", model, tokenizer, max_new_tokens)
+
+    start = time.perf_counter()
+    processor = ToolCallLogitsProcessor(tokenizer, TOOLS, max_new_tokens=max_new_tokens)
+    print(f"processor setup {time.perf_counter() - start:.2f} s")
+    run("schema-constrained", model, tokenizer, max_new_tokens, processor)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:3]
+    if len(args) > 1:
+        args[1] = int(args[1])
+    main(*args)
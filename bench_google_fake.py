@@ -0,0 +1,180 @@
+"""
+Round trips, API requests, bytes and wall time of the Google calls the
+apps make, against fake_google instead of the network.
+
+Every dataset size gets its own FakeGoogleData; calendar_desktop_api runs
+unchanged with its SERVICES registry built on FakeGoogleHttp. latency_ms
+is slept once per round trip (a batch is one), error_rate answers that
+share of round trips with 503. Bytes are request and response bodies,
+without HTTP headers. These runs bypass the quota scheduler; the last
+table is a bulk import against a fake per-user quota of QUOTA_QPS,
+without the scheduler, with one paced under the quota and with an
+adaptive one that starts above it.
+
+python bench_google_fake.py [latency_ms] [sizes] [error_rate]
+python bench_google_fake.py 30 10,1000,100000
+python bench_google_fake.py --json results.json 0 1000
+"""
+import asyncio
+import contextlib
+import datetime as dt
+import io
+import json
+import sys
+import time
+
+import calendar_desktop_api
+from calendar_async import AsyncGoogleClient
+from calendar_class import CALENDAR_IMPRINT
+from calendar_fetch import iter_events, load_task_lists
+from api_scheduler import RequestScheduler
+from calendar_sync import CalendarSync
+from fake_google import FakeGoogleData, FakeGoogleHttp, serve
+from google_services import ServiceRegistry
+
+
+INSERTS = 100
+CHANGED = 200
+QUOTA_QPS = 20
+QUOTA_WINDOW = 5.0
+IMPORT_EVENTS = 300
+# события с месяца назад на год вперёд, чтобы "ближайшие" были всегда
+NOW = dt.datetime.now(dt.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+class OfflineCredentials:
+    # у фейкового сервера нет авторизации
+    def before_request(self, request, method, url, headers):
+        pass
+
+
+def insert_args(count):
+    first = NOW.replace(tzinfo=None) + dt.timedelta(days=1)
+    return [{"summary": f"Bench {i}", "date": first + dt.timedelta(hours=i), "duration": 30}
+            for i in range(count)]
+
+
+def operations(data, http, registry, base_url):
+    calendar = registry.calendar(None)
+    tasks = registry.tasks(None)
+    offline = CALENDAR_IMPRINT(timezone=data.timezone)
+    calendar_sync = CalendarSync(calendar, offline)
+
+    client = AsyncGoogleClient(OfflineCredentials(), calendar_url=f"{base_url}/calendar/v3",
+                               tasks_url=f"{base_url}/tasks/v1")
+
+    def incremental_sync():
+        data.modify_events(CHANGED)
+        return calendar_sync.sync()
+
+    def expired_sync():
+        data.modify_events(CHANGED)
+        data.expire_sync_tokens()
+        return calendar_sync.sync()
+
+    return [
+        ("settings.get timezone (cold)", lambda: registry.timezone(None)),
+        ("get_calendar_tasks(10)", lambda: calendar_desktop_api.get_calendar_tasks(10)),
+        ("AsyncGoogleClient.get_calendar_tasks", lambda: asyncio.run(client.get_calendar_tasks(10))),
+        (f"add_event x{INSERTS}",
+         lambda: [calendar_desktop_api.add_event(**args) for args in insert_args(INSERTS)]),
+        (f"add_events({INSERTS}) batch", lambda: calendar_desktop_api.add_events(insert_args(INSERTS))),
+        ("load_task_lists", lambda: load_task_lists(tasks)),
+        ("iter_events, no prefetch",
+         lambda: sum(1 for _ in iter_events(calendar, time_min=NOW.isoformat(), prefetch=False))),
+        ("iter_events, prefetch",
+         lambda: sum(1 for _ in iter_events(calendar, time_min=NOW.isoformat(), prefetch=True))),
+        ("CalendarSync full", calendar_sync.sync),
+        (f"CalendarSync incremental ({CHANGED} changed)", incremental_sync),
+        ("CalendarSync after 410", expired_sync),
+    ]
+
+
+def run_dataset(size, latency, error_rate):
+    start = time.perf_counter()
+    data = FakeGoogleData(n_events=size, n_task_lists=3, tasks_per_list=50,
+                          start=NOW - dt.timedelta(days=30))
+    print(f"\n{size} events, {len(data.task_lists)} task lists, "
+          f"built in {time.perf_counter() - start:.2f} s")
+    http = FakeGoogleHttp(data, latency=latency, error_rate=error_rate)
+    registry = ServiceRegistry(http_factory=lambda credentials: http, scheduler=None)
+    calendar_desktop_api.SERVICES = registry
+    calendar_desktop_api.get_or_create_token = lambda user="default": None
+    server = serve(http)
+
+    rows = []
+    print(f"{'operation':<40} {'trips':>6} {'requests':>8} {'KB sent':>8} {'KB recv':>9} "
+          f"{'wall ms':>9}")
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    for name, operation in operations(data, http, registry, base_url):
+        http.reset_stats()
+        error = None
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                operation()
+        except Exception as exception:
+            error = f"{type(exception).__name__}: {exception}"
+        elapsed = time.perf_counter() - start
+        stats = http.stats
+        rows.append({"events": size, "operation": name, "round_trips": stats["round_trips"],
+                     "requests": stats["requests"], "bytes_sent": stats["bytes_sent"],
+                     "bytes_received": stats["bytes_received"], "errors": stats["errors"],
+                     "wall_ms": elapsed * 1e3, "failed": error})
+        print(f"{name:<40} {stats['round_trips']:>6} {stats['requests']:>8} "
+              f"{stats['bytes_sent'] / 1024:>8.1f} {stats['bytes_received'] / 1024:>9.1f} "
+              f"{elapsed * 1e3:>9.1f}" + (f"   failed: {error[:60]}" if error else ""))
+    server.shutdown()
+    server.server_close()
+    return rows
+
+
+def run_quota(latency):
+    print(f"\nbulk import of {IMPORT_EVENTS} events, quota {QUOTA_QPS} requests/s "
+          f"over {QUOTA_WINDOW:.0f} s")
+    print(f"{'scheduler':<40} {'trips':>6} {'rejected':>8} {'failed':>8} {'wall ms':>9}")
+    rows = []
+    for name, scheduler in (("none", None),
+                            (f"{QUOTA_QPS * 0.45:g} qps", RequestScheduler(user_qps=QUOTA_QPS * 0.45)),
+                            (f"adaptive from {QUOTA_QPS * 2} qps", RequestScheduler(user_qps=QUOTA_QPS * 2))):
+        http = FakeGoogleHttp(FakeGoogleData(n_events=10), latency=latency, rate_limit=QUOTA_QPS,
+                              quota_window=QUOTA_WINDOW)
+        registry = ServiceRegistry(http_factory=lambda credentials: http, scheduler=scheduler)
+        calendar_desktop_api.SERVICES = registry
+        registry.timezone(None)
+        http.reset_stats()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = calendar_desktop_api.add_events(insert_args(IMPORT_EVENTS))
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for _, error in results if error is not None)
+        rejected = http.stats["operations"].get("rate_limited", 0)
+        rows.append({"operation": f"bulk import, scheduler {name}", "round_trips": http.stats["round_trips"],
+                     "rate_limited": rejected, "failed": failed, "wall_ms": elapsed * 1e3})
+        print(f"{name:<40} {http.stats['round_trips']:>6} {rejected:>8} {failed:>8} {elapsed * 1e3:>9.1f}")
+    return rows
+
+
+def main(latency_ms=0.0, sizes="10,1000,100000", error_rate=0.0, json_path=None):
+    print(f"latency {latency_ms} ms per round trip, error rate {error_rate:.0%}")
+    rows = []
+    for size in sizes.split(","):
+        rows.extend(run_dataset(int(size), latency_ms / 1e3, error_rate))
+    rows.extend(run_quota(latency_ms / 1e3))
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(rows, file, indent=2)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    json_path = None
+    if "--json" in args:
+        index = args.index("--json")
+        json_path = args[index + 1]
+        del args[index:index + 2]
+    if args:
+        args[0] = float(args[0])
+    if len(args) > 2:
+        args[2] = float(args[2])
+    main(*args[:3], json_path=json_path)
@@ -0,0 +1,146 @@
+"""
+TLS handshakes and latency: fresh httplib2 transport per call (what build()
+per operation does) vs the shared PooledHttp pool.
+
+A local HTTPS server with a throwaway self-signed certificate (made with
+the openssl CLI) plays the API in a separate process; it counts accepted
+TCP connections, i.e. TLS handshakes. Loopback has no network delay, so
+rtt_ms emulates one: every request waits one round trip, every new
+connection two more (TCP + TLS 1.3 handshake). Several threads play
+concurrent Streamlit sessions.
+
+python bench_http_pool.py [threads] [requests_per_thread] [rtt_ms]
+"""
+import json
+import multiprocessing
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+
+from http_pool import PooledHttp, create_session
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rtt = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        # новое соединение: TCP + TLS рукопожатие
+        time.sleep(2 * self.rtt)
+        super().setup()
+
+    def do_GET(self):
+        time.sleep(self.rtt)
+        body = json.dumps({"kind": "calendar#setting", "id": "timezone", "value": "UTC"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    connections = None
+
+    def get_request(self):
+        request = super().get_request()
+        with self.connections.get_lock():
+            self.connections.value += 1
+        return request
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True)
+    return cert, key
+
+
+def serve(cert, key, rtt, connections, port):
+    FakeApiHandler.rtt = rtt
+    CountingServer.connections = connections
+    server = CountingServer(("127.0.0.1", 0), FakeApiHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    port.value = server.server_port
+    server.serve_forever()
+
+
+def start_server(cert, key, rtt):
+    # отдельный процесс: сервер не делит GIL с измеряемым клиентом
+    connections = multiprocessing.Value("i", 0)
+    port = multiprocessing.Value("i", 0)
+    process = multiprocessing.Process(target=serve, args=(cert, key, rtt, connections, port),
+                                      daemon=True)
+    process.start()
+    while not port.value:
+        time.sleep(0.01)
+    return process, connections, port.value
+
+
+def run(name, connections, make_http, url, threads, per_thread):
+    connections.value = 0
+    latencies = []
+    lock = threading.Lock()
+
+    def session_worker(_):
+        for _ in range(per_thread):
+            http = make_http()
+            start = time.perf_counter()
+            resp, content = http.request(url, "GET")
+            elapsed = time.perf_counter() - start
+            assert resp.status == 200, resp.status
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(session_worker, range(threads)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    print(f"{name:<28} handshakes {connections.value:>5}   wall {wall:>7.3f} s   "
+          f"mean {statistics.mean(latencies) * 1e3:>7.2f} ms   "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1e3:>7.2f} ms")
+
+
+def main(threads=8, per_thread=50, rtt_ms=20):
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        process, connections, port = start_server(cert, key, rtt_ms / 1000)
+        url = f"https://127.0.0.1:{port}/calendar/v3/users/me/settings/timezone"
+        print(f"{threads} threads x {per_thread} requests, emulated RTT {rtt_ms} ms")
+
+        run("httplib2.Http per call", connections,
+            lambda: httplib2.Http(ca_certs=cert), url, threads, per_thread)
+
+        session = create_session(pool_size=threads)
+        session.verify = cert
+        # иначе REQUESTS_CA_BUNDLE из окружения перекрывает session.verify
+        session.trust_env = False
+        run("PooledHttp (shared pool)", connections,
+            lambda: PooledHttp(session=session), url, threads, per_thread)
+        session.close()
+        process.terminate()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:4]]
+    main(*args)
@@ -0,0 +1,92 @@
+"""
+Per-object memory and construction time of EVENT_IMPRINT / TASK_IMPRINT.
+
+"legacy" reproduces the old __dict__-based classes: every object gets its
+own copy of every default (nested dicts included) before the API fields are
+written over them.
+
+python bench_imprint.py [n_objects]
+"""
+import pickle
+import sys
+import time
+import tracemalloc
+
+from calendar_class import EVENT_IMPRINT, TASK_IMPRINT
+
+
+class LegacyImprint:
+    def __init__(self, data: dict, defaults_blob: bytes):
+        for key, value in pickle.loads(defaults_blob).items():
+            setattr(self, key, value)
+        for key, value in data.items():
+            setattr(self, key, value)
+
+
+def event_data(i):
+    # типичный ответ events().list для обычной встречи
+    return {
+        "kind": "calendar#event",
+        "etag": f'"33{i:011d}"',
+        "id": f"evt{i:08d}",
+        "status": "confirmed",
+        "htmlLink": f"https://www.google.com/calendar/event?eid=evt{i:08d}",
+        "created": "2024-07-01T10:00:00.000Z",
+        "updated": "2024-07-01T10:00:00.000Z",
+        "summary": f"Meeting {i}",
+        "creator": {"email": "user@example.com", "self": True},
+        "organizer": {"email": "user@example.com", "self": True},
+        "start": {"dateTime": "2024-07-05T15:00:00+07:00", "timeZone": "Asia/Novosibirsk"},
+        "end": {"dateTime": "2024-07-05T16:00:00+07:00", "timeZone": "Asia/Novosibirsk"},
+        "iCalUID": f"evt{i:08d}@google.com",
+        "sequence": 0,
+        "reminders": {"useDefault": True},
+        "eventType": "default",
+    }
+
+
+def task_data(i):
+    return {
+        "kind": "tasks#task",
+        "id": f"task{i:08d}",
+        "etag": f'"{i}"',
+        "title": f"Task {i}",
+        "updated": "2024-07-01T10:00:00.000Z",
+        "selfLink": f"https://www.googleapis.com/tasks/v1/lists/x/tasks/task{i:08d}",
+        "position": f"{i:020d}",
+        "status": "needsAction",
+        "links": [],
+        "webViewLink": f"https://tasks.google.com/task/task{i:08d}",
+    }
+
+
+def measure(name, build, payloads):
+    # время и память меряются отдельно: tracemalloc сильно замедляет аллокации
+    start = time.perf_counter()
+    objects = [build(data) for data in payloads]
+    elapsed = time.perf_counter() - start
+    del objects
+    tracemalloc.start()
+    objects = [build(data) for data in payloads]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n = len(objects)
+    print(f"{name:<16} {size / n:>10.0f} B/obj {elapsed / n * 1e6:>10.2f} us/obj "
+          f"{size / 2 ** 20:>9.1f} MiB total")
+
+
+def main(n=100_000):
+    events = [event_data(i) for i in range(n)]
+    tasks = [task_data(i) for i in range(n)]
+    event_defaults = pickle.dumps(EVENT_IMPRINT._defaults)
+    task_defaults = pickle.dumps(TASK_IMPRINT._defaults)
+
+    print(f"{n} objects, memory excludes the input dicts")
+    measure("EVENT legacy", lambda d: LegacyImprint(d, event_defaults), events)
+    measure("EVENT_IMPRINT", EVENT_IMPRINT, events)
+    measure("TASK legacy", lambda d: LegacyImprint(d, task_defaults), tasks)
+    measure("TASK_IMPRINT", TASK_IMPRINT, tasks)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
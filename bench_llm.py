@@ -0,0 +1,146 @@
+"""
+Calendar-command benchmark for LLM backends: time to first token,
+tokens/s, end-to-end latency, ToolCallOrResponse parse rate, right-tool
+rate and peak RSS. The stub picks tools with the intent router, so its
+right-tool rate is n/a.
+
+Each backend runs in its own process, so peak RSS is that backend's own.
+Tokens are the streamed pieces; endpoints and TextIteratorStreamer send
+one per token. The stub backend needs no network or weights:
+
+python bench_llm.py stub stub:5
+python bench_llm.py hf-endpoint:HuggingFaceH4/zephyr-7b-beta local:HuggingFaceH4/zephyr-7b-beta
+python bench_llm.py --json results.json stub
+"""
+import json
+import multiprocessing
+import resource
+import statistics
+import sys
+import time
+
+from llm_backends import make_backend
+from llm_stream import ToolCallOrResponseParser
+
+
+SYSTEM = """You manage the user's Google Calendar and Tasks. Reply with one JSON object only:
+{"tool_calls": [{"name": <tool>, "args": {...}}], "content": <reply to the user>}
+tool_calls is empty when no tool is needed. Tools:
+add_event(summary, description, location, date, duration) - date is ISO local time, duration in minutes
+get_calendar_tasks(n_events) - upcoming events and all tasks"""
+
+# (команда, ожидаемый инструмент или None)
+CORPUS = [
+    ("add meeting tomorrow at 15 for an hour", "add_event"),
+    ("Add a call with Bob on monday at 3pm for 30 minutes", "add_event"),
+    ("schedule dentist july 25 at 9:30", "add_event"),
+    ("book a table review at noon", "add_event"),
+    ("what's next", "get_calendar_tasks"),
+    ("list my tasks", "get_calendar_tasks"),
+    ("show my next 5 events", "get_calendar_tasks"),
+    ("what do I have this week?", "get_calendar_tasks"),
+    ("Добавь встречу с Анной завтра в 10 на полчаса", "add_event"),
+    ("запланируй созвон в пятницу в 3 часа дня на полтора часа", "add_event"),
+    ("добавь встречу 25 июля в 18:00 в офисе", "add_event"),
+    ("Создай событие стоматолог 12.08 в 9", "add_event"),
+    ("Покажи мои задачи", "get_calendar_tasks"),
+    ("что дальше?", "get_calendar_tasks"),
+    ("какие у меня планы", "get_calendar_tasks"),
+    ("Hi! How are you?", None),
+    ("Спасибо, это всё", None),
+]
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[max(int(len(ordered) * share) - 1, 0)]
+
+
+def run_command(backend, command):
+    messages = [{"role": "system", "content": SYSTEM}, {"role": "user", "content": command}]
+    parser = ToolCallOrResponseParser()
+    tokens = 0
+    ttft = None
+    start = time.perf_counter()
+    for piece in backend.stream(messages):
+        if ttft is None:
+            ttft = time.perf_counter() - start
+        tokens += 1
+        parser.feed(piece)
+    elapsed = time.perf_counter() - start
+    try:
+        response = parser.result()
+    except ValueError:
+        response = None
+    return {"ttft": ttft or elapsed, "elapsed": elapsed, "tokens": tokens, "response": response}
+
+
+def run_backend(spec, results):
+    backend = make_backend(spec)
+    rows = []
+    try:
+        for command, expected in CORPUS:
+            row = run_command(backend, command)
+            response = row.pop("response")
+            row["parsed"] = response is not None
+            names = [call.get("name") for call in response["tool_calls"]] if response else []
+            row["right_tool"] = response is not None and (names[:1] == [expected] if expected else not names)
+            rows.append(row)
+    finally:
+        backend.close()
+    # ru_maxrss в килобайтах на Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put(summarize(spec, rows, peak_rss, backend.picks_tools))
+
+
+def summarize(spec, rows, peak_rss, picks_tools=True):
+    rates = [(row["tokens"] - 1) / (row["elapsed"] - row["ttft"])
+             for row in rows if row["tokens"] > 1 and row["elapsed"] > row["ttft"]]
+    return {
+        "backend": spec,
+        "commands": len(rows),
+        "ttft_mean_ms": statistics.mean(row["ttft"] for row in rows) * 1e3,
+        "ttft_p95_ms": percentile([row["ttft"] for row in rows], 0.95) * 1e3,
+        "tokens_per_s": statistics.mean(rates) if rates else 0.0,
+        "e2e_mean_ms": statistics.mean(row["elapsed"] for row in rows) * 1e3,
+        "e2e_p95_ms": percentile([row["elapsed"] for row in rows], 0.95) * 1e3,
+        "parse_rate": sum(row["parsed"] for row in rows) / len(rows),
+        "right_tool_rate": sum(row["right_tool"] for row in rows) / len(rows) if picks_tools else None,
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def main(specs, json_path=None):
+    summaries = []
+    for spec in specs:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_backend, args=(spec, results))
+        process.start()
+        process.join()
+        if process.exitcode:
+            print(f"{spec}: failed with exit code {process.exitcode}")
+            continue
+        summaries.append(results.get())
+
+    print(f"{len(CORPUS)} commands per backend")
+    print(f"{'backend':<44} {'TTFT ms':>8} {'p95':>8} {'tok/s':>7} {'e2e ms':>8} {'p95':>8} "
+          f"{'parsed':>7} {'tool ok':>7} {'RSS MB':>7}")
+    for summary in summaries:
+        right_tool = summary["right_tool_rate"]
+        right_tool = f"{right_tool:>7.0%}" if right_tool is not None else f"{'n/a':>7}"
+        print(f"{summary['backend']:<44} {summary['ttft_mean_ms']:>8.1f} {summary['ttft_p95_ms']:>8.1f} "
+              f"{summary['tokens_per_s']:>7.1f} {summary['e2e_mean_ms']:>8.1f} {summary['e2e_p95_ms']:>8.1f} "
+              f"{summary['parse_rate']:>7.0%} {right_tool} {summary['peak_rss_mb']:>7.0f}")
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(summaries, file, indent=2)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    json_path = None
+    if "--json" in args:
+        index = args.index("--json")
+        json_path = args[index + 1]
+        del args[index:index + 2]
+    main(args or ["stub"], json_path)
@@ -1,11 +1,17 @@
 import datetime as dt
+import uuid
 import pytz
 import streamlit as st
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import streamlit_qs as stqs
+from api_metrics import METRICS, InstrumentedHttp, InstrumentedHttpRequest, sidebar_lines
+from api_scheduler import SCHEDULER, ScheduledHttp
 from calendar_class import CALENDAR_IMPRINT, EVENT_IMPRINT, TASK_IMPRINT
+from calendar_fetch import load_task_lists
+from google_services import credential_key
+from http_pool import PooledHttp
 
 # OAuth 2.0 setup
 CLIENT_SECRETS_FILE = "oauth-web-app.json"
@@ -14,6 +20,11 @@ SCOPES = ["https://www.googleapis.com/auth/calendar", "https://www.googleapis.co
 # REDIRECT_URI = 'https://calendar-tasks.streamlit.app'  # Обновите этот URL на ваш реальный адрес
 REDIRECT_URI = 'http://localhost:8501'
 
+# сколько секунд данные пользователя живут между перезапусками main()
+CACHE_TTL = 300
+# верхняя граница number_input: события грузятся один раз и режутся
+MAX_EVENTS = 10
+
 def create_flow():
     flow = Flow.from_client_secrets_file(
         CLIENT_SECRETS_FILE,
@@ -22,39 +33,74 @@ def create_flow():
     )
     return flow
 
-def get_service(credentials):
-    service_calendar = build('calendar', 'v3', credentials=credentials)
-    service_tasks = build('tasks', 'v1', credentials=credentials)
+@st.cache_resource
+def _data_generations():
+    # user -> поколение, общее для всех сессий пользователя: событие,
+    # добавленное в одной вкладке, сбрасывает данные и в остальных
+    return {}
+
+def data_generation(user):
+    return _data_generations().get(user, 0)
+
+def invalidate_user_data(user):
+    # новое поколение = новые ключи st.cache_data для этого пользователя,
+    # старые записи просто доживают свой TTL
+    generations = _data_generations()
+    generations[user] = generations.get(user, 0) + 1
+
+@st.cache_resource(max_entries=100)
+def _build_services(user, _credentials):
+    # httplib2 не потокобезопасен, сессии Streamlit работают в разных потоках:
+    # запросы идут через общий пул соединений с учётными данными пользователя,
+    # квоту пользователя и проекта делит общий планировщик
+    http = ScheduledHttp(InstrumentedHttp(PooledHttp(_credentials)), user=user)
+    service_calendar = build('calendar', 'v3', http=http, requestBuilder=InstrumentedHttpRequest)
+    service_tasks = build('tasks', 'v1', http=http, requestBuilder=InstrumentedHttpRequest)
     return service_calendar, service_tasks
 
-def get_calendar_tasks(service_calendar, service_tasks, n_events=3):
-    try:
-        google_timezone = service_calendar.settings().get(setting='timezone').execute()
-        local_tz = pytz.timezone(google_timezone['value'])
-        now = dt.datetime.now(local_tz).isoformat()
-        
-        events_result = (
-            service_calendar.events()
-            .list(
-                calendarId="primary",
-                timeMin=now,
-                maxResults=n_events,
-                singleEvents=True,
-                orderBy="startTime",
-            )
-            .execute()
+def get_service(credentials):
+    return _build_services(credential_key(credentials), credentials)
+
+def cached(name, function, *args):
+    # st.cache_data-функции возвращают (значение, _call_id вызова, который их выполнил):
+    # при попадании из кеша приходит id одного из прошлых вызовов
+    call_id = uuid.uuid4().hex
+    result, filled_by = function(*args, _call_id=call_id)
+    METRICS.cache_lookup(name, hit=filled_by != call_id)
+    return result
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=1000, show_spinner=False)
+def _timezone(user, _service_calendar, _call_id=None):
+    return _service_calendar.settings().get(setting='timezone').execute()['value'], _call_id
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=1000, show_spinner=False)
+def _upcoming_events(user, generation, _service_calendar, _call_id=None):
+    local_tz = pytz.timezone(cached("timezone", _timezone, user, _service_calendar))
+    now = dt.datetime.now(local_tz).isoformat()
+    events_result = (
+        _service_calendar.events()
+        .list(
+            calendarId="primary",
+            timeMin=now,
+            maxResults=MAX_EVENTS,
+            singleEvents=True,
+            orderBy="startTime",
         )
-        events = events_result.get("items", [])
-        
-        task_lists = []
-        results = service_tasks.tasklists().list(maxResults=10).execute()
-        items = results.get("items", [])
+        .execute()
+    )
+    return events_result.get("items", []), _call_id
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=1000, show_spinner=False)
+def _task_lists(user, generation, _service_tasks, _call_id=None):
+    return load_task_lists(_service_tasks), _call_id
 
-        for item in items:
-            result_one_list = service_tasks.tasks().list(
-                tasklist=item['id']).execute()
-            tasks_one_list = result_one_list.get('items', [])
-            task_lists.append({"title": item["title"], "tasks": tasks_one_list})
+def get_calendar_tasks(service_calendar, service_tasks, n_events=3):
+    user = st.session_state.get("user_key")
+    generation = data_generation(user)
+    try:
+        # всегда MAX_EVENTS событий: смена n_events берёт срез из кеша
+        events = cached("events", _upcoming_events, user, generation, service_calendar)[:n_events]
+        task_lists = cached("task_lists", _task_lists, user, generation, service_tasks)
 
         return events, task_lists
 
@@ -68,27 +114,29 @@ def add_event(service_calendar, date=None):
         tomorrow = now + dt.timedelta(days=1)
         date = dt.datetime(tomorrow.year, tomorrow.month, tomorrow.day, 15, 0, 0)
         
-    google_timezone = service_calendar.settings().get(setting='timezone').execute()
+    user = st.session_state.get("user_key")
     start_time = date.isoformat()
     end_time = (date + dt.timedelta(hours=1)).isoformat()
     
-    event = {
-        'summary': 'Google I/O 2015',
-        'description': 'A chance to hear more about Google\'s developer products.',
-        'location': 'somewhere',
-        'colorId': 1,
-        'start': {
-            'dateTime': start_time,
-            'timeZone': google_timezone['value'],
-        },
-        'end': {
-            'dateTime': end_time,
-            'timeZone': google_timezone['value'],
-        },
-    }
     try:
+        google_timezone = {'value': cached("timezone", _timezone, user, service_calendar)}
+        event = {
+            'summary': 'Google I/O 2015',
+            'description': 'A chance to hear more about Google\'s developer products.',
+            'location': 'somewhere',
+            'colorId': 1,
+            'start': {
+                'dateTime': start_time,
+                'timeZone': google_timezone['value'],
+            },
+            'end': {
+                'dateTime': end_time,
+                'timeZone': google_timezone['value'],
+            },
+        }
         event = service_calendar.events().insert(calendarId='primary', body=event).execute()
         st.success(f'Event created: {event.get("htmlLink")}')
+        invalidate_user_data(user)
     except HttpError as error:
         st.error(f"An error occurred: {error}")
 
@@ -114,6 +162,7 @@ def main():
     else:
         credentials = st.session_state.credentials
         st.write('Authorization successful!')
+        st.session_state.user_key = credential_key(credentials)
 
         service_calendar, service_tasks = get_service(credentials)
 
@@ -122,7 +171,7 @@ def main():
 
         if choice == "View Events and Tasks":
             st.subheader("View Events and Tasks")
-            n_events = st.number_input("Number of events to retrieve", min_value=1, max_value=10, value=3)
+            n_events = st.number_input("Number of events to retrieve", min_value=1, max_value=MAX_EVENTS, value=3)
             events, task_lists = get_calendar_tasks(service_calendar, service_tasks, n_events)
 
             st.header("Upcoming Events")
@@ -148,5 +197,11 @@ def main():
             if st.button("Add Event"):
                 add_event(service_calendar, event_date)
 
+        with st.sidebar.expander("Google API"):
+            for line in sidebar_lines(METRICS.snapshot()):
+                st.caption(line)
+            st.caption(f"queue: {SCHEDULER.depth()}, throttled {SCHEDULER.stats['throttled']}, "
+                       f"retries {SCHEDULER.stats['retries']}")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,180 @@
+import asyncio
+import datetime as dt
+import time
+
+import httplib2
+import pytz
+from googleapiclient.errors import HttpError
+
+from api_metrics import METRICS
+from api_scheduler import (BULK, INTERACTIVE, SCHEDULER, WRITE, backoff_delay, error_reason,
+                           is_rate_limited, retry_after)
+from credentials_manager import refresh_lock
+from google_services import credential_key
+from http_pool import AUTH_REQUEST, SHARED_SESSION
+
+
+CALENDAR_URL = "https://www.googleapis.com/calendar/v3"
+TASKS_URL = "https://tasks.googleapis.com/tasks/v1"
+
+
+class AsyncGoogleClient:
+    """
+    asyncio client for the Calendar v3 and Tasks v1 calls the apps use.
+
+    Requests go through the process-wide http_pool.SHARED_SESSION, whose
+    urllib3 pool keeps the keep-alive connections for every client; the
+    blocking send runs in the default thread executor, at most
+    max_concurrency at a time. calendar_url and tasks_url point it
+    elsewhere, e.g. at fake_google.serve(). Every request is a call of
+    metrics (api_metrics.METRICS) under its discovery method id and waits
+    for its turn in scheduler (api_scheduler.SCHEDULER), rate-limit
+    answers are retried like in ScheduledHttp. Credentials are the ones
+    from get_or_create_token() or Flow.credentials and are refreshed under
+    credentials_manager.refresh_lock when they expire.
+
+    Example call:
+
+    client = AsyncGoogleClient(get_or_create_token())
+    events, task_lists = asyncio.run(client.get_calendar_tasks(10))
+    """
+
+    def __init__(self, credentials, max_concurrency: int = 10, session=None,
+                 calendar_url: str = CALENDAR_URL, tasks_url: str = TASKS_URL, metrics=METRICS,
+                 scheduler=SCHEDULER):
+        self.credentials = credentials
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self._user = credential_key(credentials)
+        self.calendar_url = calendar_url
+        self.tasks_url = tasks_url
+        self._session = session or SHARED_SESSION
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _round_trip(self, method: str, url: str, params, body):
+        headers = {}
+        with refresh_lock(self.credentials):
+            self.credentials.before_request(AUTH_REQUEST, method, url, headers)
+        start = time.perf_counter()
+        status = 0
+        content = b""
+        try:
+            response = self._session.request(method, url, params=params, json=body,
+                                             headers=headers, timeout=60)
+            status, content = response.status_code, response.content
+            return response
+        finally:
+            self.metrics.round_trip(url, method, status, len(content), time.perf_counter() - start)
+
+    def _send(self, name: str, method: str, url: str, params=None, body=None, priority=None):
+        if priority is None:
+            priority = INTERACTIVE if method == "GET" else WRITE
+        with self.metrics.call(name):
+            for attempt in range(self.scheduler.max_retries + 1):
+                self.scheduler.acquire(self._user, priority)
+                response = self._round_trip(method, url, params, body)
+                if attempt == self.scheduler.max_retries:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        self.scheduler.count("gave_up")
+                    break
+                pause = max(retry_after(response.headers), backoff_delay(attempt))
+                if is_rate_limited(response.status_code, response.content):
+                    self.scheduler.throttle(self._user, error_reason(response.content), pause)
+                elif response.status_code >= 500 and method == "GET":
+                    time.sleep(pause)
+                else:
+                    break
+                self.scheduler.count("retries")
+        if response.status_code >= 400:
+            # та же ошибка, что и у googleapiclient, чтобы обработчики не различались
+            resp = httplib2.Response({"status": response.status_code, **response.headers})
+            raise HttpError(resp, response.content, uri=response.url)
+        self.scheduler.succeeded(self._user)
+        return response.json() if response.content else {}
+
+    async def _request(self, name: str, method: str, url: str, params=None, body=None,
+                       priority=None):
+        if params:
+            params = {key: value for key, value in params.items() if value is not None}
+        async with self._semaphore:
+            return await asyncio.to_thread(self._send, name, method, url, params, body, priority)
+
+    async def _paged(self, name: str, url: str, params: dict):
+        items = []
+        params = dict(params)
+        while True:
+            result = await self._request(name, "GET", url, params)
+            items.extend(result.get("items", []))
+            if not result.get("nextPageToken"):
+                return items
+            params["pageToken"] = result["nextPageToken"]
+
+    async def get_timezone(self):
+        result = await self._request("calendar.settings.get", "GET",
+                                    f"{self.calendar_url}/users/me/settings/timezone")
+        return result["value"]
+
+    async def get_events(self, time_min=None, time_max=None, max_results=None,
+                         calendar_id: str = "primary", single_events: bool = True):
+        """
+        All events of the window (every page), or the first max_results.
+        """
+        params = {
+            "timeMin": time_min,
+            "timeMax": time_max,
+            "singleEvents": str(single_events).lower(),
+            "orderBy": "startTime" if single_events else None,
+            "maxResults": min(max_results, 2500) if max_results else 250,
+        }
+        url = f"{self.calendar_url}/calendars/{calendar_id}/events"
+        if max_results and max_results <= 2500:
+            result = await self._request("calendar.events.list", "GET", url, params)
+            return result.get("items", [])
+        events = await self._paged("calendar.events.list", url, params)
+        return events[:max_results] if max_results else events
+
+    async def insert_event(self, body: dict, calendar_id: str = "primary", priority=None):
+        return await self._request("calendar.events.insert", "POST",
+                                   f"{self.calendar_url}/calendars/{calendar_id}/events", body=body,
+                                   priority=priority)
+
+    async def insert_events(self, bodies, calendar_id: str = "primary"):
+        """
+        Bulk import: the inserts queue behind interactive reads.
+
+        Returns:
+            list: created event or the raised exception, per body
+        """
+        return await asyncio.gather(
+            *(self.insert_event(body, calendar_id, BULK) for body in bodies),
+            return_exceptions=True)
+
+    async def get_task_lists(self):
+        return await self._paged("tasks.tasklists.list", f"{self.tasks_url}/users/@me/lists",
+                                 {"maxResults": 1000})
+
+    async def get_tasks(self, tasklist_id: str):
+        return await self._paged("tasks.tasks.list", f"{self.tasks_url}/lists/{tasklist_id}/tasks",
+                                 {"maxResults": 100})
+
+    async def get_all_tasks(self):
+        """
+        Same structure as load_task_lists(): every list with its tasks,
+        the lists fetched concurrently.
+        """
+        task_lists = await self.get_task_lists()
+        tasks = await asyncio.gather(*(self.get_tasks(item["id"]) for item in task_lists))
+        return [
+            {"id": item["id"], "title": item["title"], "tasks": items}
+            for item, items in zip(task_lists, tasks)
+        ]
+
+    async def get_calendar_tasks(self, n_events: int = 10):
+        """
+        Async twin of get_calendar_tasks(): upcoming events and all task
+        lists, requested concurrently.
+        """
+        timezone = await self.get_timezone()
+        now = dt.datetime.now(pytz.timezone(timezone)).isoformat()
+        return await asyncio.gather(self.get_events(time_min=now, max_results=n_events),
+                                    self.get_all_tasks())
@@ -1,227 +1,616 @@
+import bisect
+import copy
+import datetime as dt
+import functools
 import json
+import threading
 
+import pytz
 
-class EVENT_IMPRINT:
-    def __init__(self, event_data: dict):
-        # Инициализируем все атрибуты значениями по умолчанию
-        self.kind = "calendar#event"
-        self.etag = ""
-        self.id = ""
-        self.status = ""
-        self.htmlLink = ""
-        self.created = None
-        self.updated = None
-        self.summary = ""
-        self.description = ""
-        self.location = ""
-        self.colorId = ""
-        self.creator = {
-            "id": "",
-            "email": "",
-            "displayName": "",
-            "self": False
-        }
-        self.organizer = {
-            "id": "",
-            "email": "",
-            "displayName": "",
-            "self": False
-        }
-        self.start = {
-            "date": None,
-            "dateTime": None,
-            "timeZone": ""
-        }
-        self.end = {
-            "date": None,
-            "dateTime": None,
-            "timeZone": ""
-        }
-        self.endTimeUnspecified = False
-        self.recurrence = []
-        self.recurringEventId = ""
-        self.originalStartTime = {
-            "date": None,
-            "dateTime": None,
-            "timeZone": ""
-        }
-        self.transparency = ""
-        self.visibility = ""
-        self.iCalUID = ""
-        self.sequence = 0
-        self.attendees = []
-        # 'attendees': [
-        #     {'email': 'lpage@example.com'},
-        #     {'email': 'sbrin@example.com'},
-        # ],
-        self.attendeesOmitted = False
-        self.extendedProperties = {
-            "private": {},
-            "shared": {}
-        }
-        self.hangoutLink = ""
-        self.conferenceData = {
-            "createRequest": {
-                "requestId": "",
-                "conferenceSolutionKey": {
-                    "type": ""
-                },
-                "status": {
-                    "statusCode": ""
-                }
-            },
-            "entryPoints": [],
-            "conferenceSolution": {
-                "key": {
-                    "type": ""
-                },
-                "name": "",
-                "iconUri": ""
-            },
-            "conferenceId": "",
-            "signature": "",
-            "notes": ""
-        }
-        self.gadget = {
-            "type": "",
-            "title": "",
-            "link": "",
-            "iconLink": "",
-            "width": 0,
-            "height": 0,
-            "display": "",
-            "preferences": {}
-        }
-        self.anyoneCanAddSelf = False
-        self.guestsCanInviteOthers = False
-        self.guestsCanModify = False
-        self.guestsCanSeeOtherGuests = False
-        self.privateCopy = False
-        self.locked = False
-        self.reminders = {
-            "useDefault": False,
-            "overrides": []
-        }
-        # 'reminders': {
-        #     'useDefault': False,
-        #     'overrides': [
-        #         {'method': 'email', 'minutes': 24 * 60},
-        #         {'method': 'popup', 'minutes': 10},
-        #     ],
-        # },
-        self.source = {
-            "url": "",
-            "title": ""
-        }
-        self.workingLocationProperties = {
-            "type": "",
-            "homeOffice": None,
-            "customLocation": {
-                "label": ""
+
+# Значения по умолчанию общие для всех объектов и в самих объектах не хранятся:
+# пустой слот читается из таблицы, вложенные dict/list копируются в объект
+# только при первом обращении (см. _IMPRINT.__getattr__)
+_EVENT_DEFAULTS = {
+    "kind": "calendar#event",
+    "etag": "",
+    "id": "",
+    "status": "",
+    "htmlLink": "",
+    "created": None,
+    "updated": None,
+    "summary": "",
+    "description": "",
+    "location": "",
+    "colorId": "",
+    "creator": {
+        "id": "",
+        "email": "",
+        "displayName": "",
+        "self": False
+    },
+    "organizer": {
+        "id": "",
+        "email": "",
+        "displayName": "",
+        "self": False
+    },
+    "start": {
+        "date": None,
+        "dateTime": None,
+        "timeZone": ""
+    },
+    "end": {
+        "date": None,
+        "dateTime": None,
+        "timeZone": ""
+    },
+    "endTimeUnspecified": False,
+    "recurrence": [],
+    "recurringEventId": "",
+    "originalStartTime": {
+        "date": None,
+        "dateTime": None,
+        "timeZone": ""
+    },
+    "transparency": "",
+    "visibility": "",
+    "iCalUID": "",
+    "sequence": 0,
+    "attendees": [],
+    # 'attendees': [
+    #     {'email': 'lpage@example.com'},
+    #     {'email': 'sbrin@example.com'},
+    # ],
+    "attendeesOmitted": False,
+    "extendedProperties": {
+        "private": {},
+        "shared": {}
+    },
+    "hangoutLink": "",
+    "conferenceData": {
+        "createRequest": {
+            "requestId": "",
+            "conferenceSolutionKey": {
+                "type": ""
             },
-            "officeLocation": {
-                "buildingId": "",
-                "floorId": "",
-                "floorSectionId": "",
-                "deskId": "",
-                "label": ""
+            "status": {
+                "statusCode": ""
             }
+        },
+        "entryPoints": [],
+        "conferenceSolution": {
+            "key": {
+                "type": ""
+            },
+            "name": "",
+            "iconUri": ""
+        },
+        "conferenceId": "",
+        "signature": "",
+        "notes": ""
+    },
+    "gadget": {
+        "type": "",
+        "title": "",
+        "link": "",
+        "iconLink": "",
+        "width": 0,
+        "height": 0,
+        "display": "",
+        "preferences": {}
+    },
+    "anyoneCanAddSelf": False,
+    "guestsCanInviteOthers": False,
+    "guestsCanModify": False,
+    "guestsCanSeeOtherGuests": False,
+    "privateCopy": False,
+    "locked": False,
+    "reminders": {
+        "useDefault": False,
+        "overrides": []
+    },
+    # 'reminders': {
+    #     'useDefault': False,
+    #     'overrides': [
+    #         {'method': 'email', 'minutes': 24 * 60},
+    #         {'method': 'popup', 'minutes': 10},
+    #     ],
+    # },
+    "source": {
+        "url": "",
+        "title": ""
+    },
+    "workingLocationProperties": {
+        "type": "",
+        "homeOffice": None,
+        "customLocation": {
+            "label": ""
+        },
+        "officeLocation": {
+            "buildingId": "",
+            "floorId": "",
+            "floorSectionId": "",
+            "deskId": "",
+            "label": ""
         }
-        self.outOfOfficeProperties = {
-            "autoDeclineMode": "",
-            "declineMessage": ""
-        }
-        self.focusTimeProperties = {
-            "autoDeclineMode": "",
-            "declineMessage": "",
-            "chatStatus": ""
-        }
-        self.attachments = []
-        self.eventType = ""
+    },
+    "outOfOfficeProperties": {
+        "autoDeclineMode": "",
+        "declineMessage": ""
+    },
+    "focusTimeProperties": {
+        "autoDeclineMode": "",
+        "declineMessage": "",
+        "chatStatus": ""
+    },
+    "attachments": [],
+    "eventType": "",
+}
+
+_TASK_DEFAULTS = {
+    "kind": "",
+    "id": "",
+    "etag": "",
+    "title": "",
+    "updated": "",
+    "selfLink": "",
+    "parent": "",
+    "position": "",
+    "notes": "",
+    "status": "",
+    "due": "",
+    "completed": "",
+    "deleted": False,
+    "hidden": False,
+    "links": [],
+    "webViewLink": "",
+    "assignmentInfo": None,
+}
+
+
+class _IMPRINT:
+    __slots__ = ("_extra",)
+    _defaults = {}
+
+    def __init__(self, data: dict):
+        # Поля, которых нет в таблице по умолчанию (новые поля API), уходят в _extra
+        self._extra = None
+        defaults = self._defaults
+        for key, value in data.items():
+            if key in defaults:
+                setattr(self, key, value)
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[key] = value
+
+    def __getattr__(self, name):
+        # вызывается только для незаполненных слотов и неизвестных имён
+        defaults = type(self)._defaults
+        if name in defaults:
+            value = defaults[name]
+            if isinstance(value, (dict, list)):
+                value = copy.deepcopy(value)
+                setattr(self, name, value)
+            return value
+        if name != "_extra" and not name.startswith("__"):
+            extra = self._extra
+            if extra and name in extra:
+                return extra[name]
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+    def to_dict(self, include_defaults: bool = True) -> dict:
+        """
+        Fields as a dict; include_defaults=False gives back only the fields
+        that were actually set, i.e. the API payload.
+        """
+        result = {}
+        for name in self._defaults:
+            if include_defaults:
+                result[name] = getattr(self, name)
+            else:
+                try:
+                    result[name] = object.__getattribute__(self, name)
+                except AttributeError:
+                    pass
+        if self._extra:
+            result.update(self._extra)
+        return result
+
+    def __repr__(self):
+        # без materialize: значения по умолчанию только читаются
+        result = {}
+        for name, default in self._defaults.items():
+            try:
+                result[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                result[name] = default
+        if self._extra:
+            result.update(self._extra)
+        return json.dumps(result, default=str, indent=4)
+
+
+class EVENT_IMPRINT(_IMPRINT):
+    __slots__ = tuple(_EVENT_DEFAULTS)
+    _defaults = _EVENT_DEFAULTS
 
-        # Обновляем атрибуты значениями из переданного словаря
-        for key, value in event_data.items():
-            setattr(self, key, value)
-    
-    
     def set_reminder(self, method: str, time):
         if method not in ['email', 'popup']:
             raise ValueError("Invalid reminder method. Must be 'email' or 'popup'.")
         if time is None:
             raise AttributeError("Time must be specified.")
     
-    def __repr__(self):
-        return json.dumps(self.__dict__, default=str, indent=4)
-    
     def __str__(self) -> str:
         return f"Event ID: {self.id}, Summary: {self.summary}, Status: {self.status}, \n{self.start}-{self.end}"
 
-class TASK_IMPRINT:
-    def __init__(self, task_data: dict):
-        # Инициализируем все атрибуты значениями по умолчанию
-        self.kind = ""
-        self.id = ""
-        self.etag = ""
-        self.title = ""
-        self.updated = ""
-        self.selfLink = ""
-        self.parent = ""
-        self.position = ""
-        self.notes = ""
-        self.status = ""
-        self.due = ""
-        self.completed = ""
-        self.deleted = False
-        self.hidden = False
-        self.links = []
-        self.webViewLink = ""
-        self.assignmentInfo = None
-
-        # Обновляем атрибуты значениями из переданного словаря
-        for key, value in task_data.items():
-            setattr(self, key, value)
-
-    def __repr__(self):
-        return json.dumps(self.__dict__, default=str, indent=4)
+class TASK_IMPRINT(_IMPRINT):
+    __slots__ = tuple(_TASK_DEFAULTS)
+    _defaults = _TASK_DEFAULTS
 
     def __str__(self):
         return f"Task ID: {self.id}, Title: {self.title}, Status: {self.status}"
     
     
+def to_epoch(value, timezone: str = "UTC") -> float:
+    """
+    Converts a query bound to epoch seconds.
+
+    Accepts epoch numbers, datetime, date and ISO 8601 strings; naive values
+    and dates are taken in the given timezone.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = dt.datetime.fromisoformat(value) if "T" in value else dt.date.fromisoformat(value)
+    if not isinstance(value, dt.datetime):
+        value = dt.datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = pytz.timezone(timezone).localize(value)
+    return value.timestamp()
+
+
+def event_bounds(event: EVENT_IMPRINT, timezone: str = "UTC"):
+    """
+    Returns (start, end) of an event in epoch seconds, or None if the event
+    has no start (e.g. cancelled). All-day events ("date") span local
+    midnights of the calendar timezone, timed events ("dateTime") keep
+    their own offset or timeZone.
+    """
+    bounds = []
+    for edge in (event.start, event.end):
+        if not edge:
+            return None
+        if edge.get("dateTime"):
+            bounds.append(to_epoch(edge["dateTime"], edge.get("timeZone") or timezone))
+        elif edge.get("date"):
+            bounds.append(to_epoch(edge["date"], timezone))
+        else:
+            return None
+    return bounds[0], max(bounds)
+
+
+class INTERVAL_INDEX:
+    """
+    Events sorted by start time with the longest duration tracked.
+
+    Events overlapping [a, b) can only start in [a - max_duration, b), so a
+    window query is two bisections plus a scan of that slice. Durations are
+    kept sorted too, so removing the longest event narrows the scan again.
+    """
+
+    def __init__(self):
+        self._starts = []
+        # (start, end, seq, event) в том же порядке, что и _starts,
+        # при равном start - в порядке добавления (seq)
+        self._entries = []
+        # длительности по возрастанию: последняя - самая длинная
+        self._durations = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, start: float, end: float, event):
+        entry = (start, end, self._seq, event)
+        self._seq += 1
+        i = bisect.bisect_right(self._starts, start)
+        self._starts.insert(i, start)
+        self._entries.insert(i, entry)
+        bisect.insort(self._durations, end - start)
+        return entry
+
+    def add_many(self, items):
+        """
+        Bulk insert of (start, end, event) tuples: append and re-sort once,
+        Timsort merges the new run with the already sorted entries.
+        """
+        entries = []
+        for start, end, event in items:
+            entries.append((start, end, self._seq, event))
+            self._seq += 1
+        self._durations.extend(end - start for start, end, _, _ in entries)
+        self._durations.sort()
+        self._entries.extend(entries)
+        self._entries.sort(key=lambda e: (e[0], e[2]))
+        self._starts[:] = [e[0] for e in self._entries]
+        return entries
+
+    def remove(self, entry):
+        i = bisect.bisect_left(self._starts, entry[0])
+        while i < len(self._entries) and self._starts[i] == entry[0]:
+            if self._entries[i] is entry:
+                del self._starts[i]
+                del self._entries[i]
+                del self._durations[bisect.bisect_left(self._durations, entry[1] - entry[0])]
+                return
+            i += 1
+
+    def clear(self):
+        self._starts.clear()
+        self._entries.clear()
+        self._durations.clear()
+
+    @property
+    def max_duration(self) -> float:
+        return self._durations[-1] if self._durations else 0.0
+
+    def overlapping_entries(self, start: float, end: float):
+        lo = bisect.bisect_left(self._starts, start - self.max_duration)
+        hi = bisect.bisect_left(self._starts, end)
+        # start >= a - для событий нулевой длины внутри окна
+        return [e for e in self._entries[lo:hi] if e[1] > start or e[0] >= start]
+
+    def overlapping(self, start: float, end: float):
+        return [e[3] for e in self.overlapping_entries(start, end)]
+
+    def next_after(self, moment: float):
+        i = bisect.bisect_left(self._starts, moment)
+        return self._entries[i][3] if i < len(self._entries) else None
+
+    def overlapping_pairs(self):
+        pairs = []
+        active = []
+        for entry_start, entry_end, _, event in self._entries:
+            active = [a for a in active if a[1] > entry_start]
+            pairs.extend((a[3], event) for a in active)
+            active.append((entry_start, entry_end, None, event))
+        return pairs
+
+
+def _is_stale(current, data: dict) -> bool:
+    """
+    True if data is the same version as current (same etag) or older
+    (earlier "updated"), i.e. applying it would change nothing.
+    """
+    if current is None:
+        return False
+    if data.get("etag") and data["etag"] == current.etag:
+        return True
+    updated = data.get("updated")
+    return bool(updated and current.updated and updated < current.updated)
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class CALENDAR_IMPRINT:
-    def __init__(self, current_time=None, calendar_start_time=None, calendar_end_time=None):
-        self._events = []
-        self._tasks = []
+    """
+    Local mirror of a Google calendar and its tasks. Every public method
+    holds self.lock, so a background sync can update the mirror while
+    another thread queries it; code that reads the index directly
+    (free_slots, calendar_snapshot) takes the lock itself.
+    """
+
+    def __init__(self, current_time=None, calendar_start_time=None, calendar_end_time=None,
+                 timezone: str = "UTC"):
+        # id -> объект, порядок словаря = порядок добавления
+        self._events = {}
+        self._tasks = {}
         self.current_time = current_time
         self.calendar_start_time = calendar_start_time
         self.calendar_end_time = calendar_end_time
+        self._timezone = timezone
+        self._index = INTERVAL_INDEX()
+        self._index_entries = {}
+        self.lock = threading.RLock()
 
     @property
+    @_locked
     def events(self):
-        return self._events
+        return list(self._events.values())
 
+    @_locked
+    def get_event(self, event_id: str):
+        return self._events.get(event_id)
+
+    @property
+    def timezone(self):
+        return self._timezone
+
+    @timezone.setter
+    @_locked
+    def timezone(self, value: str):
+        # границы all-day событий зависят от часового пояса календаря
+        self._timezone = value
+        self.rebuild_index()
+
+    def _index_events(self, events: list):
+        items = []
+        for event in events:
+            bounds = event_bounds(event, self._timezone)
+            if bounds is not None:
+                items.append((bounds[0], bounds[1], event))
+        for entry in self._index.add_many(items):
+            self._index_entries[id(entry[3])] = entry
+
+    def _unindex_event(self, event: EVENT_IMPRINT):
+        entry = self._index_entries.pop(id(event), None)
+        if entry is not None:
+            self._index.remove(entry)
+
+    @_locked
+    def rebuild_index(self):
+        self._index.clear()
+        self._index_entries.clear()
+        self._index_events(self._events.values())
+
+    @_locked
     def add_event(self, event: EVENT_IMPRINT):
-        self._events.append(event)
+        # событие без id (создано локально) хранится под собственным ключом
+        key = event.id or f"local-{id(event)}"
+        previous = self._events.get(key)
+        if previous is not None:
+            self._unindex_event(previous)
+        self._events[key] = event
+        bounds = event_bounds(event, self._timezone)
+        if bounds is not None:
+            self._index_entries[id(event)] = self._index.add(bounds[0], bounds[1], event)
+
+    @_locked
+    def _restore_events(self, rows):
+        """
+        Bulk add of (event, start, end) with bounds computed earlier for the
+        same timezone (e.g. by a snapshot); start None means "not indexed".
+        """
+        items = []
+        for event, start, end in rows:
+            self._events[event.id or f"local-{id(event)}"] = event
+            if start is not None:
+                items.append((start, end, event))
+        for entry in self._index.add_many(items):
+            self._index_entries[id(entry[3])] = entry
+
+    @_locked
+    def remove_event(self, event_id: str):
+        event = self._events.pop(event_id, None)
+        if event is not None:
+            self._unindex_event(event)
+        return event
 
+    @_locked
     def load_events(self, events_data: list):
+        """
+        Upserts API event dicts by id.
+
+        Entries with the stored etag or an older "updated" are skipped
+        without building an object; status "cancelled" deletes the event.
+        Returns:
+            dict: {"added": [ids], "updated": [ids], "deleted": [ids], "skipped": int}
+        """
+        report = {"added": [], "updated": [], "deleted": [], "skipped": 0}
+        # ключ хранения -> событие: вторая версия того же id во входе
+        # заменяет первую ещё до индексации
+        fresh = {}
         for event_data in events_data:
+            event_id = event_data.get("id")
+            current = self._events.get(event_id) if event_id else None
+            if event_data.get("status") == "cancelled":
+                fresh.pop(event_id, None)
+                if current is not None:
+                    self.remove_event(event_id)
+                    report["deleted"].append(event_id)
+                else:
+                    report["skipped"] += 1
+                continue
+            if _is_stale(current, event_data):
+                report["skipped"] += 1
+                continue
             event = EVENT_IMPRINT(event_data)
-            self.add_event(event)
+            key = event_id or f"local-{id(event)}"
+            if key not in fresh:
+                if current is not None:
+                    self._unindex_event(current)
+                    report["updated"].append(event_id)
+                elif event_id:
+                    report["added"].append(event_id)
+            self._events[key] = event
+            fresh[key] = event
+        self._index_events(fresh.values())
+        return report
+
+    @_locked
+    def events_between(self, start, end):
+        """
+        Events overlapping [start, end), ordered by start.
+
+        Example call:
+
+        calendar.events_between(dt.date(2024, 7, 9), dt.date(2024, 7, 10))
+        """
+        return self._index.overlapping(to_epoch(start, self._timezone),
+                                       to_epoch(end, self._timezone))
+
+    @_locked
+    def conflicts(self, start=None, end=None):
+        """
+        With start/end: events overlapping that interval (is the slot busy?).
+        Without: every pair of overlapping events in the calendar.
+        """
+        if start is None:
+            return self._index.overlapping_pairs()
+        return self.events_between(start, end)
+
+    @_locked
+    def next_event(self, after=None):
+        if after is None:
+            after = dt.datetime.now(dt.timezone.utc)
+        return self._index.next_after(to_epoch(after, self._timezone))
+
     @property
+    @_locked
     def tasks(self):
-        return self._tasks
+        return list(self._tasks.values())
+
+    @_locked
+    def get_task(self, task_id: str):
+        return self._tasks.get(task_id)
     
+    @_locked
     def add_task(self, task: TASK_IMPRINT):
-        self._tasks.append(task)
+        self._tasks[task.id or f"local-{id(task)}"] = task
+
+    @_locked
+    def remove_task(self, task_id: str):
+        return self._tasks.pop(task_id, None)
         
+    @_locked
     def load_tasks(self, tasks_data: list):
+        """
+        Upserts API task dicts by id, same rules as load_events; tasks with
+        "deleted": true are removed.
+        """
+        report = {"added": [], "updated": [], "deleted": [], "skipped": 0}
         for task_data in tasks_data:
+            task_id = task_data.get("id")
+            current = self._tasks.get(task_id) if task_id else None
+            if task_data.get("deleted"):
+                if current is not None:
+                    self.remove_task(task_id)
+                    report["deleted"].append(task_id)
+                else:
+                    report["skipped"] += 1
+                continue
+            if _is_stale(current, task_data):
+                report["skipped"] += 1
+                continue
             task = TASK_IMPRINT(task_data)
+            if current is not None:
+                report["updated"].append(task_id)
+            elif task_id:
+                report["added"].append(task_id)
             self.add_task(task)
+        return report
     
+    @_locked
     def __repr__(self):
-        events = [event for event in self._events]
-        tasks = [task for task in self._tasks]
+        events = [event for event in self._events.values()]
+        tasks = [task for task in self._tasks.values()]
         return f"CALENDAR_IMPRINT(events={events}) \n TASKS_IMPRINT(tasks={tasks})"
 
     def summary(self):
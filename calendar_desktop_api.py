@@ -2,45 +2,47 @@ import os.path
 import datetime as dt
 import pytz
 import random
+import threading
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from calendar_class import CALENDAR_IMPRINT, EVENT_IMPRINT, TASK_IMPRINT
+from calendar_fetch import load_task_lists
+from calendar_snapshot import CalendarSnapshot
+from calendar_sync import CalendarSync
+from credentials_manager import CREDENTIALS, SCOPES
+from free_slots import first_free_slot
+from google_batch import execute_batch
+from api_metrics import METRICS, sidebar_lines
+from api_scheduler import SCHEDULER
+from google_services import SERVICES
 
 
-SCOPES = ["https://www.googleapis.com/auth/calendar",
-          "https://www.googleapis.com/auth/tasks"]
+def get_or_create_token(user: str = "default"):
+    # токен живёт в памяти и обновляется в фоне до истечения, token.json читается один раз
+    return CREDENTIALS.get(user)
 
 
-def get_or_create_token():
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file("token.json")
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                "credentials.json", SCOPES
-            )
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-    return creds
+def get_calendar_tasks(n_events = 10):
+    """
+    Prints and returns the upcoming events of the primary calendar and
+    the tasks of every task list
 
+    Example call:
 
-def get_calendar_tasks(n_events = 10):
+    get_calendar_tasks(5)
+    Args:
+        n_events (int): how many upcoming events to get
+    Returns:
+        tuple: (events, tasks), empty lists when there are none or the
+            request failed
+    """
 
     creds = get_or_create_token()
 
     try:
-        service_calendar = build("calendar", "v3", credentials=creds)
-        service_tasks = build("tasks", "v1", credentials=creds)
+        service_calendar = SERVICES.calendar(creds)
+        service_tasks = SERVICES.tasks(creds)
 
         # Call the Calendar API
         # original: 2024-07-05T07:50:05.154483Z
@@ -50,8 +52,7 @@ def get_calendar_tasks(n_events = 10):
         # now_local = datetime.now(timezone.utc) + local_timezone_offset
         # now_local_iso = now_local.isoformat()
         # 'Z' indicates UTC time
-        google_timezone = service_calendar.settings().get(setting='timezone').execute()
-        local_tz = pytz.timezone(google_timezone['value'])
+        local_tz = pytz.timezone(SERVICES.timezone(creds))
         now = dt.datetime.now(local_tz).isoformat()
         print(f'timezone: {local_tz}, time iso: {now}')
         
@@ -71,7 +72,6 @@ def get_calendar_tasks(n_events = 10):
 
         if not events:
             print("No upcoming events found.")
-            return
 
         # Prints the start and name of the next 10 events
         for event in events:
@@ -79,21 +79,16 @@ def get_calendar_tasks(n_events = 10):
             print(start, event["summary"])
 
         # Call the Tasks API
-        results = service_tasks.tasklists().list(maxResults=10).execute()
-        items = results.get("items", [])
+        task_lists = load_task_lists(service_tasks)
 
-        if not items:
+        if not task_lists:
             print("No task lists found.")
-            return
+            return events, []
         tasks = []
         print("Task lists:")
-        for item in items:
-            print(f"Task list name: {item['title']} \n (id: {item['id']})")
-
-            result_one_list = service_tasks.tasks().list(
-                tasklist=item['id']).execute()
-            tasks_one_list = result_one_list.get('items', [])
-            for i, task in enumerate(tasks_one_list, 1):
+        for task_list in task_lists:
+            print(f"Task list name: {task_list['title']} \n (id: {task_list['id']})")
+            for i, task in enumerate(task_list["tasks"], 1):
                 tasks.append(task)
                 print(f"    {i}: {task['title']} ({task['id']})")
                 if task.get('notes'):
@@ -104,14 +99,11 @@ def get_calendar_tasks(n_events = 10):
         return events, tasks
     except HttpError as error:
         print(f"An error occurred: {error}")
+        # вызывающий код распаковывает (events, tasks)
+        return [], []
 
 
-def add_event(summary: str='No summary argument passed',
-              description: str='no description argument passed',
-              location: str='home/online',
-              date=None, 
-              duration=60):
-    # 1. ACTUALIZE CALENDAR AND TASKS
+def _event_body(summary, description, location, date, duration, timezone):
     if date is None:
         # Устанавливаем день и время по умолчанию: завтра в 15:00
         now = dt.datetime.now()
@@ -123,11 +115,7 @@ def add_event(summary: str='No summary argument passed',
     start_time = date.isoformat()
     # Длительность события 1 час
     end_time = (date + dt.timedelta(minutes=duration)).isoformat()
-
-    creds = get_or_create_token()
-    service = build("calendar", "v3", credentials=creds)
-    google_timezone = service.settings().get(setting='timezone').execute()
-    event = {
+    return {
         'summary': summary,
         'description': description,
         'location': location,
@@ -135,20 +123,143 @@ def add_event(summary: str='No summary argument passed',
         'start': {
             'dateTime': start_time,
             # 'timeZone': 'Asia/Ho_Chi_Minh',
-            'timeZone': google_timezone['value'],
+            'timeZone': timezone,
             
         },
         'end': {
             'dateTime': end_time,
-            'timeZone': google_timezone['value'],
+            'timeZone': timezone,
         },
     }
+
+
+def default_event_date(calendar: CALENDAR_IMPRINT, duration=60, days=7):
+    """
+    First free slot within working hours from tomorrow on, as naive local
+    time of calendar.timezone (add_event sets it to the API timezone first);
+    None if the week is full or nothing is known yet.
+    """
+    tz = pytz.timezone(calendar.timezone)
+    tomorrow = dt.datetime.now(tz).date() + dt.timedelta(days=1)
+    slot = first_free_slot(calendar, duration, tomorrow,
+                           tomorrow + dt.timedelta(days=days))
+    return slot.replace(tzinfo=None) if slot else None
+
+
+def add_event(summary: str='No summary argument passed',
+              description: str='no description argument passed',
+              location: str='home/online',
+              date=None, 
+              duration=60,
+              calendar: CALENDAR_IMPRINT=None):
+    """
+    Adds an event to the primary Google calendar
+
+    Example call:
+
+    add_event('Meeting with Anna', 'project sync', 'office', '2024-07-06T10:00:00', 30)
+    Args:
+        summary (str): event title
+        description (str): event description
+        location (str): where the event takes place
+        date (datetime or str): local start time, ISO string is accepted;
+            None picks a free slot
+        duration (int): length in minutes
+    Returns:
+        dict: the created event
+    """
+    if isinstance(date, str):
+        date = dt.datetime.fromisoformat(date)
+    creds = get_or_create_token()
+    timezone = SERVICES.timezone(creds)
+    # 1. ACTUALIZE CALENDAR AND TASKS
+    if date is None and calendar is not None and calendar.events:
+        # слот ищется и отправляется в часовом поясе календаря Google
+        if calendar.timezone != timezone:
+            calendar.timezone = timezone
+        date = default_event_date(calendar, duration)
+    service = SERVICES.calendar(creds)
+    event = _event_body(summary, description, location, date, duration, timezone)
     event = service.events().insert(calendarId='primary', body=event).execute()
     print(f'Event created: {event.get("htmlLink")}')
+    return event
+
+
+def add_events(events):
+    """
+    Creates many events with Google batch requests, up to 50 inserts per call.
+
+    Example call:
+
+    add_events([
+        {'summary': 'Math', 'date': dt.datetime(2024, 9, 2, 9, 0), 'duration': 90},
+        {'summary': 'Physics', 'date': dt.datetime(2024, 9, 2, 11, 0)},
+    ])
+    Args:
+        events (iterable): dicts with add_event() arguments
+            (summary, description, location, date, duration);
+            date may be an ISO string, as in add_event()
+    Returns:
+        list: (created event dict or None, HttpError or None) per input item
+    """
+    defaults = {
+        'summary': 'No summary argument passed',
+        'description': 'no description argument passed',
+        'location': 'home/online',
+        'date': None,
+        'duration': 60,
+    }
+    creds = get_or_create_token()
+    service = SERVICES.calendar(creds)
+    timezone = SERVICES.timezone(creds)
+    requests = []
+    for event_args in events:
+        event_args = {**defaults, **event_args}
+        if isinstance(event_args['date'], str):
+            event_args['date'] = dt.datetime.fromisoformat(event_args['date'])
+        requests.append(service.events().insert(
+            calendarId='primary',
+            body=_event_body(timezone=timezone, **event_args)))
+    results = execute_batch(service, requests)
+    failed = sum(1 for _, error in results if error is not None)
+    print(f'Events created: {len(results) - failed}, failed: {failed}')
+    return results
+
+
+def sync_offline_calendar(calendar_sync: CalendarSync = None,
+                          offline_calendar: CALENDAR_IMPRINT = None,
+                          snapshot: CalendarSnapshot = None):
+    if calendar_sync is None:
+        creds = get_or_create_token()
+        service_calendar = SERVICES.calendar(creds)
+        offline_calendar.timezone = SERVICES.timezone(creds)
+        calendar_sync = CalendarSync(service_calendar, offline_calendar)
+    try:
+        result = calendar_sync.sync()
+        print(f"Synced: {result}")
+        if snapshot is not None:
+            snapshot.save(offline_calendar, calendar_sync.sync_token)
+    except HttpError as error:
+        print(f"An error occurred: {error}")
+    return calendar_sync
 
 
 if __name__ == "__main__":
+    snapshot = CalendarSnapshot()
     offline_calendar = CALENDAR_IMPRINT()
+    calendar_sync = None
+    if snapshot.exists():
+        # сначала последнее известное состояние из файла, сверка с сервером - в фоне
+        print('Upcoming (from snapshot):')
+        for e in snapshot.upcoming():
+            print(e)
+        offline_calendar, sync_token = snapshot.load()
+        creds = get_or_create_token()
+        calendar_sync = CalendarSync(SERVICES.calendar(creds), offline_calendar,
+                                     sync_token=sync_token)
+        threading.Thread(target=sync_offline_calendar,
+                         args=(calendar_sync, offline_calendar, snapshot),
+                         daemon=True).start()
     while True:
         print(
             '''
@@ -158,6 +269,8 @@ if __name__ == "__main__":
 4           || print offline tasks
 5           || print full offline calendar objects
 6           || print full offline calendar summary 
+7           || sync offline calendar (only changes after first run)
+8           || print service and settings cache stats, Google API metrics and quota queue
 any         || exit   
             '''
         )
@@ -170,21 +283,31 @@ any         || exit
         match user_action:
             case 1:
                 events, tasks = get_calendar_tasks()
-                offline_calendar.load_events(events)
-                offline_calendar.load_tasks(tasks)
+                events_report = offline_calendar.load_events(events)
+                tasks_report = offline_calendar.load_tasks(tasks)
+                for name, report in (('events', events_report), ('tasks', tasks_report)):
+                    print(f"{name}: +{len(report['added'])} ~{len(report['updated'])} "
+                          f"-{len(report['deleted'])} ={report['skipped']}")
             case 2:
-                add_event()
+                add_event(calendar=offline_calendar)
             case 3:  
                 for e in offline_calendar.events:
                     print(e)
-                print('example of event object:', repr(events[0])) if len(offline_calendar.events)>0  else None
+                print('example of event object:', repr(offline_calendar.events[0])) if len(offline_calendar.events)>0  else None
             case 4:
                 for t in offline_calendar.tasks:
                     print(t)
-                print('example of task object:', repr(tasks[0])) if len(offline_calendar.tasks)>0  else None
+                print('example of task object:', repr(offline_calendar.tasks[0])) if len(offline_calendar.tasks)>0  else None
             case 5:
                 print(offline_calendar)
             case 6:
                 offline_calendar.summary()                
+            case 7:
+                calendar_sync = sync_offline_calendar(calendar_sync, offline_calendar, snapshot)
+            case 8:
+                print(SERVICES.stats, f'hit rate: {SERVICES.hit_rate():.0%}')
+                for line in sidebar_lines(METRICS.snapshot()):
+                    print(line)
+                print('queue:', SCHEDULER.depth(), SCHEDULER.stats)
             case _:
                 break
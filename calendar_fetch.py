@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from calendar_class import EVENT_IMPRINT
+from google_batch import execute_batch
+
+
+def iter_events(service_calendar, time_min=None, time_max=None, stop=None,
+                prefetch=True, page_size=250, calendar_id="primary",
+                single_events=True):
+    """
+    Walks every page of events().list lazily and yields EVENT_IMPRINT objects.
+
+    Only the current page (and the next one, with prefetch) is held in
+    memory. With prefetch=True the next page is requested in a background
+    thread while the caller consumes the current one; the caller should not
+    use the same service object concurrently, httplib2 is not thread-safe.
+
+    Example call:
+
+    for event in iter_events(service_calendar, time_min=now,
+                             stop=lambda e: e.summary == 'Vacation'):
+        print(event)
+    Args:
+        time_min (str): RFC3339 lower bound of event end time
+        time_max (str): RFC3339 upper bound of event start time
+        stop (callable): predicate on EVENT_IMPRINT, iteration ends (without
+            yielding) at the first event it returns True for
+        prefetch (bool): fetch the next page in the background
+        page_size (int): maxResults per page, up to 2500
+    """
+    params = {
+        "calendarId": calendar_id,
+        "maxResults": page_size,
+        "singleEvents": single_events,
+    }
+    if single_events:
+        params["orderBy"] = "startTime"
+    if time_min:
+        params["timeMin"] = time_min
+    if time_max:
+        params["timeMax"] = time_max
+
+    def fetch(page_token):
+        if page_token:
+            return service_calendar.events().list(pageToken=page_token, **params).execute()
+        return service_calendar.events().list(**params).execute()
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        result = fetch(None)
+        while True:
+            page_token = result.get("nextPageToken")
+            next_page = executor.submit(fetch, page_token) if executor and page_token else None
+            for event_data in result.get("items", []):
+                event = EVENT_IMPRINT(event_data)
+                if stop is not None and stop(event):
+                    return
+                yield event
+            if not page_token:
+                return
+            result = next_page.result() if next_page else fetch(page_token)
+    finally:
+        if executor:
+            # не ждём уже запрошенную страницу, если итерацию прервали
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def load_task_lists(service_tasks, page_size=100):
+    """
+    Loads every task list with all its tasks.
+
+    Task lists are paged through first, then the tasks of all lists are
+    requested together in Google batch calls: one batch round per page
+    depth instead of one request per list.
+
+    Example call:
+
+    for task_list in load_task_lists(service_tasks):
+        print(task_list["title"], len(task_list["tasks"]))
+    Args:
+        page_size (int): maxResults for tasks().list, up to 100
+    Returns:
+        list: [{"id": ..., "title": ..., "tasks": [task dict, ...]}, ...]
+              in the order Google returns the lists
+    Raises:
+        HttpError: the first error returned for any list
+    """
+    task_lists = []
+    page_token = None
+    while True:
+        result = service_tasks.tasklists().list(maxResults=1000, pageToken=page_token).execute()
+        for item in result.get("items", []):
+            task_lists.append({"id": item["id"], "title": item["title"], "tasks": []})
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            break
+
+    # списки, у которых ещё остались страницы: индекс -> pageToken
+    pending = {i: None for i in range(len(task_lists))}
+    while pending:
+        order = list(pending)
+        requests = [
+            service_tasks.tasks().list(tasklist=task_lists[i]["id"],
+                                       maxResults=page_size,
+                                       pageToken=pending[i])
+            for i in order
+        ]
+        next_pending = {}
+        for i, (response, error) in zip(order, execute_batch(service_tasks, requests)):
+            if error is not None:
+                raise error
+            task_lists[i]["tasks"].extend(response.get("items", []))
+            if response.get("nextPageToken"):
+                next_pending[i] = response["nextPageToken"]
+        pending = next_pending
+    return task_lists
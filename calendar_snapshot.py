@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import time
+
+from calendar_class import CALENDAR_IMPRINT, EVENT_IMPRINT, TASK_IMPRINT, to_epoch
+
+
+SNAPSHOT_FILE = "calendar_snapshot.db"
+# файл снапшота читается через mmap, а не через read() в буфер sqlite
+MMAP_SIZE = 256 * 2 ** 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    etag TEXT,
+    updated TEXT,
+    start_epoch REAL,
+    end_epoch REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (start_epoch);
+CREATE INDEX IF NOT EXISTS events_end ON events (end_epoch);
+CREATE INDEX IF NOT EXISTS events_updated ON events (updated);
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    etag TEXT,
+    updated TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class CalendarSnapshot:
+    """
+    SQLite copy of a CALENDAR_IMPRINT plus its sync cursor.
+
+    Events keep their epoch bounds in indexed columns: load() rebuilds the
+    interval index without parsing a single date, and upcoming() answers
+    "what's next" straight from the file before anything else is loaded.
+
+    Example call:
+
+    snapshot = CalendarSnapshot()
+    snapshot.save(offline_calendar, calendar_sync.sync_token)
+    offline_calendar, sync_token = snapshot.load()
+    """
+
+    def __init__(self, path: str = SNAPSHOT_FILE):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def save(self, calendar: CALENDAR_IMPRINT, sync_token: str = None):
+        # объекты при обновлении заменяются, а не меняются: под замком
+        # достаточно снять ссылки, сериализация - уже без него
+        with calendar.lock:
+            event_rows = [(key, event, calendar._index_entries.get(id(event)))
+                          for key, event in calendar._events.items()]
+            task_rows = list(calendar._tasks.items())
+        events = []
+        # ключ строки - ключ хранения: у локальных событий без id он "local-..."
+        for key, event, entry in event_rows:
+            # границы уже посчитаны интервальным индексом
+            bounds = entry[:2] if entry else (None, None)
+            events.append((key, event.etag, event.updated, bounds[0], bounds[1],
+                           json.dumps(event.to_dict(include_defaults=False), default=str)))
+        tasks = [
+            (key, task.etag, task.updated,
+             json.dumps(task.to_dict(include_defaults=False), default=str))
+            for key, task in task_rows
+        ]
+        meta = [
+            ("sync_token", sync_token),
+            ("timezone", calendar.timezone),
+            ("saved_at", str(time.time())),
+        ]
+        connection = self._connect()
+        try:
+            # одна транзакция: читатель видит либо старый, либо новый снапшот
+            with connection:
+                connection.execute("DELETE FROM events")
+                connection.execute("DELETE FROM tasks")
+                connection.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)", events)
+                connection.executemany("INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?)", tasks)
+                connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta)
+        finally:
+            connection.close()
+
+    def meta(self):
+        connection = self._connect()
+        try:
+            return dict(connection.execute("SELECT key, value FROM meta"))
+        finally:
+            connection.close()
+
+    def load(self, calendar: CALENDAR_IMPRINT = None):
+        """
+        Returns:
+            (CALENDAR_IMPRINT, sync_token or None)
+        """
+        connection = self._connect()
+        try:
+            meta = dict(connection.execute("SELECT key, value FROM meta"))
+            if calendar is None:
+                calendar = CALENDAR_IMPRINT(timezone=meta.get("timezone") or "UTC")
+            events = [
+                (EVENT_IMPRINT(json.loads(data)), start, end)
+                for data, start, end in connection.execute(
+                    "SELECT data, start_epoch, end_epoch FROM events")
+            ]
+            tasks = [TASK_IMPRINT(json.loads(data))
+                     for (data,) in connection.execute("SELECT data FROM tasks")]
+        finally:
+            connection.close()
+        if calendar.timezone == meta.get("timezone"):
+            calendar._restore_events(events)
+        else:
+            # all-day границы считались в другом часовом поясе
+            for event, _, _ in events:
+                calendar.add_event(event)
+        for task in tasks:
+            calendar.add_task(task)
+        return calendar, meta.get("sync_token")
+
+    def upcoming(self, after=None, limit: int = 10, timezone: str = "UTC"):
+        """
+        Next events straight from the file, by the start_epoch index.
+        """
+        moment = time.time() if after is None else to_epoch(after, timezone)
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT data FROM events WHERE end_epoch > ? ORDER BY start_epoch LIMIT ?",
+                (moment, limit))
+            return [EVENT_IMPRINT(json.loads(data)) for (data,) in rows]
+        finally:
+            connection.close()
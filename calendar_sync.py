@@ -0,0 +1,89 @@
+import threading
+
+from googleapiclient.errors import HttpError
+
+from calendar_class import CALENDAR_IMPRINT
+
+
+class CalendarSync:
+    """
+    Keeps a CALENDAR_IMPRINT mirror of one Google calendar up to date.
+
+    The first sync() pulls every event and stores the nextSyncToken from the
+    last page; every following sync() sends only that token, so Google
+    returns just the events changed or deleted since the previous call.
+    A 410 GONE answer means the token expired - a full sync runs again and
+    events missing from it are removed from the mirror.
+
+    Example call:
+
+    sync = CalendarSync(service_calendar, offline_calendar)
+    sync.sync()
+    """
+
+    def __init__(self, service_calendar, calendar: CALENDAR_IMPRINT,
+                 calendar_id: str = "primary", page_size: int = 250,
+                 sync_token: str = None):
+        self.service_calendar = service_calendar
+        self.calendar = calendar
+        self.calendar_id = calendar_id
+        self.page_size = page_size
+        # курсор можно восстановить из снапшота, тогда первый sync() - дельта
+        self.sync_token = sync_token
+        # фоновая сверка и ручной sync() не должны идти одновременно
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """
+        Returns:
+            dict: {"full": bool, "added": int, "updated": int, "deleted": int}
+        """
+        with self._lock:
+            if self.sync_token is None:
+                return self.full_sync()
+            try:
+                return self._pull(sync_token=self.sync_token)
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+                print("Sync token expired, running full resync")
+                return self.full_sync()
+
+    def full_sync(self):
+        self.sync_token = None
+        return self._pull()
+
+    def _pull(self, sync_token=None):
+        full = sync_token is None
+        totals = {"full": full, "added": 0, "updated": 0, "deleted": 0}
+        seen = set()
+        page_token = None
+        while True:
+            params = {
+                "calendarId": self.calendar_id,
+                "maxResults": self.page_size,
+                "singleEvents": True,
+            }
+            if sync_token:
+                params["syncToken"] = sync_token
+            if page_token:
+                params["pageToken"] = page_token
+            result = self.service_calendar.events().list(**params).execute()
+            items = result.get("items", [])
+            report = self.calendar.load_events(items)
+            for key in ("added", "updated", "deleted"):
+                totals[key] += len(report[key])
+            if full:
+                seen.update(item["id"] for item in items)
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                break
+        if full:
+            # полная выгрузка: всё, чего в ней не было, удалено на сервере
+            for event in self.calendar.events:
+                if event.id and event.id not in seen:
+                    self.calendar.remove_event(event.id)
+                    totals["deleted"] += 1
+        # nextSyncToken приходит только на последней странице
+        self.sync_token = result.get("nextSyncToken")
+        return totals
@@ -0,0 +1,169 @@
+import datetime as dt
+import os
+import tempfile
+import threading
+import weakref
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+
+SCOPES = ["https://www.googleapis.com/auth/calendar",
+          "https://www.googleapis.com/auth/tasks"]
+# за сколько секунд до истечения токен обновляется в фоне
+REFRESH_MARGIN = 5 * 60
+
+_refresh_locks = weakref.WeakKeyDictionary()
+_refresh_locks_guard = threading.Lock()
+
+
+def refresh_lock(creds):
+    """
+    The lock every refresh of this Credentials object goes under, whoever
+    does it: CredentialManager, PooledHttp after a 401 or the async client
+    before a request.
+    """
+    with _refresh_locks_guard:
+        lock = _refresh_locks.get(creds)
+        if lock is None:
+            lock = _refresh_locks[creds] = threading.Lock()
+        return lock
+
+
+def _write_atomic(path: str, text: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as tmp:
+            tmp.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class CredentialManager:
+    """
+    Keeps OAuth credentials in memory per user identity and refreshes them
+    in a background timer REFRESH_MARGIN seconds before they expire.
+
+    token.json is read once per user; refreshed tokens are written back
+    atomically (temp file + os.replace). A per-user lock makes sure only
+    one refresh runs at a time, whether it comes from the timer or from a
+    caller that found the token about to expire; the refresh itself goes
+    under refresh_lock(creds), shared with the HTTP transports.
+
+    Example call:
+
+    creds = CREDENTIALS.get()            # token.json
+    creds = CREDENTIALS.get("alice")     # tokens/alice.json
+    """
+
+    def __init__(self, client_secrets_file: str = "credentials.json",
+                 scopes=SCOPES, token_dir: str = "tokens",
+                 refresh_margin: int = REFRESH_MARGIN):
+        self.client_secrets_file = client_secrets_file
+        self.scopes = scopes
+        self.token_dir = token_dir
+        self.refresh_margin = refresh_margin
+        self._credentials = {}
+        self._locks = {}
+        self._timers = {}
+        self._registry_lock = threading.Lock()
+
+    def token_path(self, user: str):
+        if user == "default":
+            return "token.json"
+        return os.path.join(self.token_dir, f"{user}.json")
+
+    def _lock(self, user: str):
+        with self._registry_lock:
+            return self._locks.setdefault(user, threading.Lock())
+
+    def _expires_soon(self, creds) -> bool:
+        if creds.expiry is None:
+            return False
+        # expiry в google-auth - naive UTC
+        left = creds.expiry - dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+        return left.total_seconds() < self.refresh_margin
+
+    def get(self, user: str = "default") -> Credentials:
+        creds = self._credentials.get(user)
+        if creds is not None and creds.valid and not self._expires_soon(creds):
+            return creds
+        with self._lock(user):
+            creds = self._credentials.get(user)
+            if creds is None:
+                creds = self._load(user)
+            if not creds.valid or self._expires_soon(creds):
+                creds = self._refresh(user, creds)
+            self._credentials[user] = creds
+            self._schedule(user, creds)
+            return creds
+
+    def put(self, user: str, creds: Credentials, save: bool = False):
+        """
+        Registers credentials obtained elsewhere (e.g. the Streamlit Flow).
+        """
+        with self._lock(user):
+            self._credentials[user] = creds
+            if save:
+                _write_atomic(self.token_path(user), creds.to_json())
+            self._schedule(user, creds)
+
+    def _load(self, user: str):
+        path = self.token_path(user)
+        if os.path.exists(path):
+            return Credentials.from_authorized_user_file(path)
+        return self._authorize(user)
+
+    def _authorize(self, user: str):
+        flow = InstalledAppFlow.from_client_secrets_file(self.client_secrets_file, self.scopes)
+        creds = flow.run_local_server(port=0)
+        _write_atomic(self.token_path(user), creds.to_json())
+        return creds
+
+    def _refresh(self, user: str, creds):
+        # вызывается под замком пользователя
+        if creds.refresh_token:
+            with refresh_lock(creds):
+                creds.refresh(Request())
+            _write_atomic(self.token_path(user), creds.to_json())
+            return creds
+        return self._authorize(user)
+
+    def _schedule(self, user: str, creds):
+        timer = self._timers.pop(user, None)
+        if timer is not None:
+            timer.cancel()
+        if creds.expiry is None or not creds.refresh_token:
+            return
+        left = creds.expiry - dt.datetime.now(dt.timezone.utc).replace(tzinfo=None)
+        delay = max(left.total_seconds() - self.refresh_margin, 0)
+        timer = threading.Timer(delay, self._background_refresh, args=(user,))
+        timer.daemon = True
+        self._timers[user] = timer
+        timer.start()
+
+    def _background_refresh(self, user: str):
+        with self._lock(user):
+            creds = self._credentials.get(user)
+            if creds is None or not self._expires_soon(creds):
+                return
+            try:
+                self._refresh(user, creds)
+            except Exception as e:
+                # следующий get() попробует ещё раз синхронно
+                print(f"Background token refresh failed for {user}: {e}")
+                return
+            self._schedule(user, creds)
+
+    def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+
+CREDENTIALS = CredentialManager()
@@ -0,0 +1,408 @@
+import bisect
+import collections
+import datetime as dt
+import email.parser
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import httplib2
+
+
+# длиннее событий в наборе нет: по нему timeMin ищется через bisect
+MAX_EVENT_MINUTES = 180
+DEFAULT_START = dt.datetime(2024, 7, 1, tzinfo=dt.timezone.utc)
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 410: "Gone",
+            429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def _epoch(value: str) -> float:
+    return dt.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _rfc3339(epoch: float) -> str:
+    return dt.datetime.fromtimestamp(epoch, dt.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class FakeGoogleError(Exception):
+    def __init__(self, status: int, reason: str, message: str = ""):
+        super().__init__(message or reason)
+        self.status = status
+        self.reason = reason
+
+
+class FakeGoogleData:
+    """
+    In-memory primary calendar and task lists of one user.
+
+    Events are kept as compact rows and turned into API dicts on output,
+    so 100k events fit in a few tens of MB. Every change bumps a version;
+    sync tokens are versions, and expire_sync_tokens() makes the old ones
+    answer 410 like an expired Google token.
+
+    Example call:
+
+    data = FakeGoogleData(n_events=10_000)
+    data.modify_events(50)   # remote edits for an incremental sync
+    """
+
+    def __init__(self, n_events: int = 1000, n_task_lists: int = 3, tasks_per_list: int = 20,
+                 start: dt.datetime = DEFAULT_START, days: int = 365, seed: int = 0,
+                 timezone: str = "Asia/Novosibirsk"):
+        self.timezone = timezone
+        self.version = 0
+        self.min_sync_version = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # id -> [start, end, version, summary, status, extra]
+        self._events = {}
+        self._starts = []
+        # (version, id) каждого изменения, по возрастанию версии; устаревшие пропускаются
+        self._changes = []
+        first = start.timestamp()
+        for i in range(n_events):
+            event_start = first + self._random.randrange(days * 24 * 4) * 15 * 60
+            minutes = self._random.choice((30, 60, 60, 90, 120, MAX_EVENT_MINUTES))
+            self._add(f"evt{i:08d}", event_start, event_start + minutes * 60, f"Event {i}", {})
+        self._starts.sort()
+        self.task_lists = [
+            {"kind": "tasks#taskList", "id": f"list{i:04d}", "etag": f'"l{i}"',
+             "title": f"List {i}", "updated": "2024-07-01T00:00:00.000Z"}
+            for i in range(n_task_lists)
+        ]
+        self.tasks = {
+            task_list["id"]: [
+                {"kind": "tasks#task", "id": f"{task_list['id']}-t{j:05d}", "etag": f'"t{j}"',
+                 "title": f"Task {j}", "updated": "2024-07-01T00:00:00.000Z",
+                 "status": "needsAction", "position": f"{j:020d}",
+                 **({"due": "2024-07-10T00:00:00.000Z"} if j % 3 == 0 else {})}
+                for j in range(tasks_per_list)
+            ]
+            for task_list in self.task_lists
+        }
+
+    def _add(self, event_id, start, end, summary, extra):
+        self.version += 1
+        self._events[event_id] = [start, end, self.version, summary, "confirmed", extra]
+        self._starts.append((start, event_id))
+        self._changes.append((self.version, event_id))
+
+    def event_dict(self, event_id: str) -> dict:
+        start, end, version, summary, status, extra = self._events[event_id]
+        etag = f'"{version:016d}"'
+        if status == "cancelled":
+            return {"kind": "calendar#event", "etag": etag, "id": event_id, "status": "cancelled"}
+        updated = _rfc3339(DEFAULT_START.timestamp() + version)
+        return {
+            "kind": "calendar#event",
+            "etag": etag,
+            "id": event_id,
+            "status": status,
+            "htmlLink": f"https://www.google.com/calendar/event?eid={event_id}",
+            "created": "2024-06-01T00:00:00.000Z",
+            "updated": updated,
+            "summary": summary,
+            "creator": {"email": "user@example.com", "self": True},
+            "organizer": {"email": "user@example.com", "self": True},
+            "start": {"dateTime": _rfc3339(start), "timeZone": self.timezone},
+            "end": {"dateTime": _rfc3339(end), "timeZone": self.timezone},
+            "iCalUID": f"{event_id}@google.com",
+            "sequence": 0,
+            "reminders": {"useDefault": True},
+            "eventType": "default",
+            **extra,
+        }
+
+    def insert_event(self, body: dict) -> dict:
+        start = _epoch(body["start"].get("dateTime") or body["start"]["date"])
+        end = _epoch(body["end"].get("dateTime") or body["end"]["date"])
+        extra = {key: body[key] for key in ("description", "location", "colorId") if key in body}
+        with self._lock:
+            event_id = uuid.UUID(int=self._random.getrandbits(128)).hex
+            self._add(event_id, start, end, body.get("summary", ""), extra)
+            bisect.insort(self._starts, self._starts.pop())
+            return self.event_dict(event_id)
+
+    def modify_events(self, count: int, delete_share: float = 0.2):
+        """
+        Edits count random events, deleting delete_share of them, as if
+        changed from another device.
+        """
+        with self._lock:
+            active = [event_id for event_id, row in self._events.items() if row[4] != "cancelled"]
+            for event_id in self._random.sample(active, min(count, len(active))):
+                self.version += 1
+                row = self._events[event_id]
+                row[2] = self.version
+                self._changes.append((self.version, event_id))
+                if self._random.random() < delete_share:
+                    row[4] = "cancelled"
+                else:
+                    row[3] += " (edited)"
+
+    def expire_sync_tokens(self):
+        with self._lock:
+            self.min_sync_version = self.version
+
+    def list_events(self, params: dict) -> dict:
+        page_size = min(int(params.get("maxResults", 250)), 2500)
+        sync_token = params.get("syncToken")
+        with self._lock:
+            # pageToken - позиция в индексе, страница не пересматривает весь набор
+            if sync_token:
+                since = int(sync_token)
+                if since < self.min_sync_version:
+                    raise FakeGoogleError(410, "fullSyncRequired", "Sync token is no longer valid")
+                index = self._changes
+                position = bisect.bisect_left(index, (since + 1,))
+                end = len(index)
+
+                def matches(version, event_id):
+                    return self._events[event_id][2] == version
+            else:
+                show_deleted = params.get("showDeleted") == "true"
+                low = _epoch(params["timeMin"]) if params.get("timeMin") else None
+                high = _epoch(params["timeMax"]) if params.get("timeMax") else None
+                index = self._starts
+                position = 0 if low is None else bisect.bisect_left(
+                    index, (low - MAX_EVENT_MINUTES * 60,))
+                end = len(index) if high is None else bisect.bisect_left(index, (high,))
+
+                def matches(start, event_id):
+                    row = self._events[event_id]
+                    return (low is None or row[1] > low) and (show_deleted or row[4] != "cancelled")
+            if params.get("pageToken"):
+                position = int(params["pageToken"])
+            page = []
+            while position < end and len(page) < page_size:
+                if matches(*index[position]):
+                    page.append(self.event_dict(index[position][1]))
+                position += 1
+            while position < end and not matches(*index[position]):
+                position += 1
+            result = {
+                "kind": "calendar#events",
+                "summary": "user@example.com",
+                "timeZone": self.timezone,
+                "items": page,
+            }
+            if position < end:
+                result["nextPageToken"] = str(position)
+            else:
+                result["nextSyncToken"] = str(self.version)
+            return result
+
+    def list_page(self, items: list, params: dict, default_size: int, max_size: int, kind: str):
+        page_size = min(int(params.get("maxResults", default_size)), max_size)
+        offset = int(params.get("pageToken", "0") or 0)
+        result = {"kind": kind, "items": items[offset:offset + page_size]}
+        if offset + page_size < len(items):
+            result["nextPageToken"] = str(offset + page_size)
+        return result
+
+
+class FakeGoogleHttp:
+    """
+    httplib2.Http-compatible transport that answers the Calendar v3 and
+    Tasks v1 calls of the apps from a FakeGoogleData, batch requests
+    included. Pass it where PooledHttp goes:
+
+    service_calendar = build_from_document(document, http=FakeGoogleHttp(data))
+
+    latency is slept once per round trip (a batch is one), error_rate
+    answers that share of round trips with error_status, fail_next()
+    queues exact failures. rate_limit caps API requests per second (batch
+    parts one by one), averaged over quota_window seconds, like the
+    per-user quota per minute: the rest get 403 userRateLimitExceeded.
+    stats counts round trips, API requests inside them and the bytes both
+    ways, per operation too.
+    """
+
+    credentials = None
+
+    def __init__(self, data: FakeGoogleData, latency: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, rate_limit: float = 0, quota_window: float = 10.0,
+                 seed: int = 0):
+        self.data = data
+        self.rate_limit = rate_limit
+        self.quota_window = quota_window
+        self._recent = collections.deque()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._failures = []
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"round_trips": 0, "requests": 0, "bytes_sent": 0, "bytes_received": 0,
+                      "errors": 0, "operations": {}}
+
+    def _over_quota(self) -> bool:
+        # скользящее окно; отклонённые запросы в квоту не входят
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] >= self.quota_window:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit * self.quota_window:
+                return True
+            self._recent.append(now)
+            return False
+
+    def fail_next(self, status: int = 503, count: int = 1):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def _count(self, operation: str):
+        with self._lock:
+            self.stats["requests"] += 1
+            operations = self.stats["operations"]
+            operations[operation] = operations.get(operation, 0) + 1
+
+    def request(self, uri, method="GET", body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        parts = urlsplit(uri)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        status, response_headers, content = self.handle(method, path, body, headers or {})
+        response_headers["status"] = status
+        return httplib2.Response(response_headers), content
+
+    def handle(self, method: str, path: str, body, headers: dict):
+        """
+        One round trip: returns (status, headers, content bytes).
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        body = body or b""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.stats["round_trips"] += 1
+            self.stats["bytes_sent"] += len(body) + len(path)
+            status = self._failures.pop(0) if self._failures else None
+            if status is None and self.error_rate and self._random.random() < self.error_rate:
+                status = self.error_status
+        if status is not None:
+            self._count("injected_error")
+            status, response_headers, content = self._error(status, "backendError", "Injected failure")
+        elif urlsplit(path).path.rstrip("/").split("/")[1:2] == ["batch"]:
+            status, response_headers, content = self._batch(body, headers)
+        else:
+            status, response_headers, content = self._call(method, path, body)
+        with self._lock:
+            self.stats["bytes_received"] += len(content)
+            if status >= 400:
+                self.stats["errors"] += 1
+        return status, response_headers, content
+
+    @staticmethod
+    def _json(status: int, payload: dict):
+        content = json.dumps(payload).encode()
+        return status, {"content-type": "application/json; charset=UTF-8"}, content
+
+    def _error(self, status: int, reason: str, message: str):
+        return self._json(status, {"error": {"code": status, "message": message,
+                                             "errors": [{"reason": reason, "message": message}]}})
+
+    def _call(self, method: str, path: str, body: bytes):
+        parts = urlsplit(path)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        segments = [unquote(segment) for segment in parts.path.strip("/").split("/")]
+        if self._over_quota():
+            self._count("rate_limited")
+            return self._error(403, "userRateLimitExceeded", "Rate Limit Exceeded")
+        try:
+            operation, payload = self._route(method, segments, params, body)
+        except FakeGoogleError as error:
+            self._count("error")
+            return self._error(error.status, error.reason, str(error))
+        self._count(operation)
+        return self._json(200, payload)
+
+    def _route(self, method, segments, params, body):
+        data = self.data
+        if segments[:2] == ["calendar", "v3"]:
+            rest = segments[2:]
+            if rest[:3] == ["users", "me", "settings"] and len(rest) == 4 and method == "GET":
+                if rest[3] != "timezone":
+                    raise FakeGoogleError(404, "notFound", f"Setting {rest[3]} not found")
+                return "settings.get", {"kind": "calendar#setting", "etag": '"1"',
+                                        "id": "timezone", "value": data.timezone}
+            if len(rest) == 3 and rest[0] == "calendars" and rest[2] == "events":
+                if method == "GET":
+                    operation = "events.list(sync)" if params.get("syncToken") else "events.list"
+                    return operation, data.list_events(params)
+                if method == "POST":
+                    return "events.insert", data.insert_event(json.loads(body))
+        if segments[:2] == ["tasks", "v1"]:
+            rest = segments[2:]
+            if rest == ["users", "@me", "lists"] and method == "GET":
+                return "tasklists.list", data.list_page(data.task_lists, params, 20, 1000,
+                                                        "tasks#taskLists")
+            if len(rest) == 3 and rest[0] == "lists" and rest[2] == "tasks" and method == "GET":
+                if rest[1] not in data.tasks:
+                    raise FakeGoogleError(404, "notFound", f"Task list {rest[1]} not found")
+                return "tasks.list", data.list_page(data.tasks[rest[1]], params, 20, 100, "tasks#tasks")
+        raise FakeGoogleError(404, "notFound", f"{method} /{'/'.join(segments)} is not faked")
+
+    def _batch(self, body: bytes, headers: dict):
+        content_type = next(value for key, value in headers.items() if key.lower() == "content-type")
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        boundary = uuid.UUID(int=self._random.getrandbits(128)).hex
+        parts = []
+        for part in message.get_payload():
+            request_text = part.get_payload()
+            head, _, inner_body = request_text.replace("\r\n", "\n").partition("\n\n")
+            method, path = head.split("\n", 1)[0].split(" ")[:2]
+            status, _, content = self._call(method, path, inner_body.encode())
+            content_id = part["Content-ID"].strip("<>")
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{content.decode()}\r\n")
+        content = ("".join(parts) + f"--{boundary}--\r\n").encode()
+        return 200, {"content-type": f"multipart/mixed; boundary={boundary}"}, content
+
+
+def serve(http: FakeGoogleHttp, host: str = "127.0.0.1", port: int = 0):
+    """
+    Serves the same fake over real HTTP for clients that don't take an
+    httplib2 transport (AsyncGoogleClient). Returns the running server;
+    its base URL is f"http://{host}:{server.server_port}".
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # заголовки и тело уходят отдельными write, без этого ждём delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _handle(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, headers, content = http.handle(self.command, self.path, body, dict(self.headers))
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,132 @@
+import datetime as dt
+
+import numpy as np
+import pytz
+
+from calendar_class import CALENDAR_IMPRINT, to_epoch
+
+
+def busy_intervals(calendar: CALENDAR_IMPRINT, start: float, end: float,
+                   buffer_minutes: int = 0):
+    """
+    Start/end epoch arrays of events that block time in [start, end).
+
+    Cancelled events and events marked "transparent" (show as available)
+    are skipped; every blocking event is widened by buffer_minutes on both
+    sides.
+    """
+    with calendar.lock:
+        entries = calendar._index.overlapping_entries(start, end)
+    entries = [
+        entry for entry in entries
+        if entry[3].transparency != "transparent" and entry[3].status != "cancelled"
+    ]
+    buffer = buffer_minutes * 60
+    starts = np.fromiter((entry[0] for entry in entries), dtype=np.float64, count=len(entries))
+    ends = np.fromiter((entry[1] for entry in entries), dtype=np.float64, count=len(entries))
+    return starts - buffer, ends + buffer
+
+
+def off_hours(start: float, end: float, timezone: str, work_hours=(9, 18), workdays=None):
+    """
+    Start/end epoch arrays of the time outside working hours in [start, end).
+
+    Day boundaries are computed in the calendar timezone, so DST shifts
+    move working hours with the wall clock.
+    Args:
+        work_hours (tuple): (first hour, last hour) of the working day, local time
+        workdays (iterable): weekday numbers (0 = Monday) that have working
+            hours at all, None means every day
+    """
+    tz = pytz.timezone(timezone)
+    first_day = dt.datetime.fromtimestamp(start, tz).date() - dt.timedelta(days=1)
+    last_day = dt.datetime.fromtimestamp(end, tz).date() + dt.timedelta(days=1)
+    workdays = None if workdays is None else set(workdays)
+    # выходной день целиком + [полночь, начало) и [конец, полночь) рабочих дней
+    starts, ends = [], []
+    day = first_day
+    while day <= last_day:
+        midnight = tz.localize(dt.datetime.combine(day, dt.time())).timestamp()
+        next_midnight = tz.localize(dt.datetime.combine(day + dt.timedelta(days=1), dt.time())).timestamp()
+        if workdays is not None and day.weekday() not in workdays:
+            starts.append(midnight)
+            ends.append(next_midnight)
+        else:
+            work_start = tz.localize(dt.datetime.combine(day, dt.time(work_hours[0]))).timestamp()
+            if work_hours[1] < 24:
+                work_end = tz.localize(dt.datetime.combine(day, dt.time(work_hours[1]))).timestamp()
+            else:
+                work_end = next_midnight
+            starts += [midnight, work_end]
+            ends += [work_start, next_midnight]
+        day += dt.timedelta(days=1)
+    return np.array(starts, dtype=np.float64), np.array(ends, dtype=np.float64)
+
+
+def free_gaps(busy_starts, busy_ends, start: float, end: float):
+    """
+    Complement of the union of busy intervals inside [start, end).
+
+    Intervals are sorted by start once; the running maximum of ends marks
+    how far the merged busy block reaches, and every place where the next
+    start lies beyond it is a free gap.
+    Returns:
+        (gap_starts, gap_ends): epoch arrays
+    """
+    # сторожевые интервалы на границах окна дают крайние промежутки
+    starts = np.concatenate(([start - 1.0], busy_starts, [end]))
+    ends = np.concatenate(([start], busy_ends, [end + 1.0]))
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    gap_starts = np.maximum(reach[:-1], start)
+    gap_ends = np.minimum(starts[1:], end)
+    mask = gap_ends > gap_starts
+    return gap_starts[mask], gap_ends[mask]
+
+
+def find_free_slots(calendar: CALENDAR_IMPRINT, duration_minutes: int,
+                    window_start, window_end, work_hours=(9, 18), workdays=None,
+                    buffer_minutes: int = 0):
+    """
+    Free gaps of at least duration_minutes between window_start and window_end.
+
+    Example call:
+
+    find_free_slots(calendar, 90, dt.date(2024, 7, 8), dt.date(2024, 7, 15))
+    Args:
+        calendar (CALENDAR_IMPRINT): local calendar, its timezone is used
+            for working hours and naive window bounds
+        duration_minutes (int): minimal length of a slot
+        window_start, window_end: datetime, date, ISO string or epoch
+        work_hours (tuple): (first hour, last hour) local time, None for
+            the whole day
+        workdays (iterable): weekdays with working hours, None for every day
+        buffer_minutes (int): free time kept around every busy event
+    Returns:
+        list: (start, end) aware datetimes in the calendar timezone
+    """
+    start = to_epoch(window_start, calendar.timezone)
+    end = to_epoch(window_end, calendar.timezone)
+    busy_starts, busy_ends = busy_intervals(calendar, start, end, buffer_minutes)
+    if work_hours is not None or workdays is not None:
+        off_starts, off_ends = off_hours(start, end, calendar.timezone,
+                                         work_hours or (0, 24), workdays)
+        busy_starts = np.concatenate((busy_starts, off_starts))
+        busy_ends = np.concatenate((busy_ends, off_ends))
+    gap_starts, gap_ends = free_gaps(busy_starts, busy_ends, start, end)
+    mask = gap_ends - gap_starts >= duration_minutes * 60
+    tz = pytz.timezone(calendar.timezone)
+    return [
+        (dt.datetime.fromtimestamp(s, tz), dt.datetime.fromtimestamp(e, tz))
+        for s, e in zip(gap_starts[mask].tolist(), gap_ends[mask].tolist())
+    ]
+
+
+def first_free_slot(calendar: CALENDAR_IMPRINT, duration_minutes: int,
+                    window_start, window_end, **kwargs):
+    """
+    Start of the earliest free slot, or None. Same arguments as find_free_slots.
+    """
+    slots = find_free_slots(calendar, duration_minutes, window_start, window_end, **kwargs)
+    return slots[0][0] if slots else None
@@ -0,0 +1,53 @@
+import time
+
+from api_scheduler import MAX_RETRIES, backoff_delay, is_rate_limited
+
+
+# Google принимает до 50 запросов Calendar в одном batch-вызове
+BATCH_LIMIT = 50
+
+
+def _rate_limited(error) -> bool:
+    resp = getattr(error, "resp", None)
+    return resp is not None and is_rate_limited(resp.status, getattr(error, "content", b""))
+
+
+def execute_batch(service, requests: list, chunk_size: int = BATCH_LIMIT,
+                  max_retries: int = MAX_RETRIES):
+    """
+    Sends HttpRequest objects as Google batch HTTP requests, chunk_size per call.
+
+    Parts answered with a rate-limit error (429, 403 rateLimitExceeded)
+    are sent again in later batches after a jittered exponential
+    backoff, at most max_retries times; other errors are returned as is.
+
+    Example call:
+
+    execute_batch(service_tasks, [service_tasks.tasks().list(tasklist=i) for i in ids])
+    Args:
+        service: googleapiclient resource that owns the requests
+        requests (list): HttpRequest objects, not executed yet
+        chunk_size (int): requests per batch call, at most 50
+        max_retries (int): resends of rate-limited parts
+    Returns:
+        list: (response, error) tuple per request, in input order;
+              error is an HttpError or None
+    """
+    results = [None] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    pending = list(range(len(requests)))
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1))
+        for chunk_start in range(0, len(pending), chunk_size):
+            batch = service.new_batch_http_request(callback=callback)
+            for i in pending[chunk_start:chunk_start + chunk_size]:
+                batch.add(requests[i], request_id=str(i))
+            batch.execute()
+        pending = [i for i in pending if _rate_limited(results[i][1])]
+        if not pending:
+            break
+    return results
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import threading
+
+from cachetools import TTLCache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+
+from api_metrics import METRICS, InstrumentedHttp, InstrumentedHttpRequest
+from api_scheduler import SCHEDULER, ScheduledHttp
+from http_pool import PooledHttp
+
+
+SETTINGS_TTL = 60 * 60
+
+
+def credential_key(credentials):
+    """
+    Identity of a credential set: the same user authorized by the same
+    OAuth client maps to the same key even after a token refresh. The key
+    is a hash, so the refresh token never shows up in cache keys, scheduler
+    rates or logs.
+    """
+    client_id = getattr(credentials, "client_id", None)
+    refresh_token = getattr(credentials, "refresh_token", None)
+    if client_id and refresh_token:
+        return hashlib.sha256(f"{client_id}\n{refresh_token}".encode()).hexdigest()[:16]
+    return id(credentials)
+
+
+class ServiceRegistry:
+    """
+    Process-wide cache of built Google API services and calendar settings.
+
+    Discovery documents are read from the copies bundled with
+    google-api-python-client and parsed once per process. Each service is
+    built once per credential set on top of the shared connection pool
+    (http_pool.PooledHttp), so it can be used from several threads;
+    settings (timezone, ...) are kept for settings_ttl seconds or until
+    invalidate(). http_factory(credentials) makes the transport, e.g.
+    fake_google.FakeGoogleHttp for offline runs.
+    Every call is reported to metrics (api_metrics.METRICS) and every
+    round trip waits for its turn in scheduler (api_scheduler.SCHEDULER,
+    quota per user and project) unless they are None.
+
+    Example call:
+
+    service_calendar = SERVICES.calendar(creds)
+    timezone = SERVICES.timezone(creds)
+    """
+
+    def __init__(self, settings_ttl=SETTINGS_TTL, maxsize=256, http_factory=PooledHttp,
+                 metrics=METRICS, scheduler=SCHEDULER):
+        self._http_factory = http_factory
+        self.metrics = metrics
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._services = {}
+        self._settings = TTLCache(maxsize=maxsize, ttl=settings_ttl)
+        self.stats = {
+            "service_hits": 0,
+            "service_misses": 0,
+            "settings_hits": 0,
+            "settings_misses": 0,
+        }
+
+    def _document(self, name, version):
+        document = self._documents.get((name, version))
+        if document is None:
+            document = json.loads(get_static_doc(name, version))
+            self._documents[(name, version)] = document
+        return document
+
+    def service(self, name, version, credentials):
+        key = (name, version, credential_key(credentials))
+        with self._lock:
+            service = self._services.get(key)
+            if service is not None:
+                self.stats["service_hits"] += 1
+                return service
+            self.stats["service_misses"] += 1
+            document = self._document(name, version)
+        http = self._http_factory(credentials)
+        request_builder = HttpRequest
+        if self.metrics is not None:
+            http = InstrumentedHttp(http, self.metrics)
+            request_builder = InstrumentedHttpRequest
+        if self.scheduler is not None:
+            # планировщик снаружи: повторы после 429 видны в метриках как retries
+            http = ScheduledHttp(http, self.scheduler, user=credential_key(credentials))
+        service = build_from_document(document, http=http, requestBuilder=request_builder)
+        with self._lock:
+            return self._services.setdefault(key, service)
+
+    def calendar(self, credentials):
+        return self.service("calendar", "v3", credentials)
+
+    def tasks(self, credentials):
+        return self.service("tasks", "v1", credentials)
+
+    def setting(self, credentials, setting):
+        key = (credential_key(credentials), setting)
+        with self._lock:
+            value = self._settings.get(key)
+            if value is not None:
+                self.stats["settings_hits"] += 1
+                return value
+            self.stats["settings_misses"] += 1
+        result = self.calendar(credentials).settings().get(setting=setting).execute()
+        with self._lock:
+            self._settings[key] = result["value"]
+        return result["value"]
+
+    def timezone(self, credentials):
+        return self.setting(credentials, "timezone")
+
+    def invalidate(self, credentials=None, setting=None):
+        """
+        Drops cached settings: one setting, all settings of one credential
+        set, or everything. Services stay, they don't go stale.
+        """
+        with self._lock:
+            if credentials is None:
+                self._settings.clear()
+                return
+            user = credential_key(credentials)
+            for key in list(self._settings.keys()):
+                if key[0] == user and setting in (None, key[1]):
+                    del self._settings[key]
+
+    def hit_rate(self):
+        hits = self.stats["service_hits"] + self.stats["settings_hits"]
+        total = hits + self.stats["service_misses"] + self.stats["settings_misses"]
+        return hits / total if total else 0.0
+
+
+SERVICES = ServiceRegistry()
+METRICS.watch_cache("google_services", SERVICES)
@@ -0,0 +1,82 @@
+import os
+
+import httplib2
+import requests
+from google.auth.transport.requests import Request
+from requests.adapters import HTTPAdapter
+
+from credentials_manager import refresh_lock
+
+
+# сколько keep-alive соединений держится на один хост
+POOL_SIZE = int(os.getenv("GOOGLE_HTTP_POOL_SIZE", "20"))
+HTTP_TIMEOUT = 60
+
+
+def create_session(pool_size: int = POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Один пул на процесс: все пользователи и сессии Streamlit переиспользуют
+# TLS-соединения с googleapis.com, учётные данные добавляются к каждому запросу
+SHARED_SESSION = create_session()
+# google.auth Request закрывает свою сессию в __del__: обновления токенов
+# (oauth2.googleapis.com) идут через один долгоживущий объект и свою сессию
+AUTH_REQUEST = Request(create_session(pool_size=2))
+
+
+class PooledHttp:
+    """
+    httplib2.Http-compatible transport over a shared requests/urllib3 pool.
+
+    googleapiclient only calls http.request(...) and reads http.credentials,
+    so an instance can be passed as build(..., http=PooledHttp(creds)).
+    Unlike httplib2.Http it is safe to share between threads; the
+    credentials of this instance are attached to every request, and a 401
+    answer triggers one refresh and retry. Refreshes go under
+    credentials_manager.refresh_lock(credentials), so transports and
+    CredentialManager never refresh the same credentials at once.
+
+    Example call:
+
+    service_calendar = build("calendar", "v3", http=PooledHttp(creds))
+    """
+
+    def __init__(self, credentials=None, session: requests.Session = None,
+                 timeout: int = HTTP_TIMEOUT):
+        self.credentials = credentials
+        self.session = session or SHARED_SESSION
+        self.timeout = timeout
+
+    def _send(self, uri, method, body, headers):
+        if self.credentials is not None:
+            with refresh_lock(self.credentials):
+                self.credentials.before_request(AUTH_REQUEST, method, uri, headers)
+        return self.session.request(method, uri, data=body, headers=headers,
+                                    timeout=self.timeout, allow_redirects=False)
+
+    def request(self, uri, method="GET", body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        headers = dict(headers or {})
+        response = self._send(uri, method, body, headers)
+        if (response.status_code == 401 and self.credentials is not None
+                and getattr(self.credentials, "refresh_token", None)):
+            sent_token = self.credentials.token
+            with refresh_lock(self.credentials):
+                # пока ждали замок, токен мог обновить другой поток или CredentialManager
+                if self.credentials.token == sent_token:
+                    self.credentials.refresh(AUTH_REQUEST)
+            response = self._send(uri, method, body, dict(headers))
+        # requests уже распаковал gzip, заголовки должны описывать то, что отдаём
+        info = {key: value for key, value in response.headers.items()
+                if key.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+        info["status"] = response.status_code
+        return httplib2.Response(info), response.content
+
+    def close(self):
+        # пул общий, закрывать его здесь нельзя
+        pass
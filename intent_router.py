@@ -0,0 +1,444 @@
+import datetime as dt
+import re
+import statistics
+import threading
+import time
+
+
+# ниже этого порога сообщение уходит в LLM
+CONFIDENCE_THRESHOLD = 0.8
+DEFAULT_DURATION = 60
+DEFAULT_EVENTS = 10
+
+_CYRILLIC = re.compile(r"[а-яё]", re.I)
+
+_ADD_VERB = (r"\b(?:add|create|schedule|book|set up|put|plan)\b"
+             r"|\b(?:добавь|добавить|создай|создать|запланируй|запланировать|назначь|назначить"
+             r"|поставь|поставить|запиши|записать)\b")
+_ADDS = re.compile(_ADD_VERB, re.I)
+# команда только в начале сообщения: "add ...", "please add ...", "добавь ..."
+_ADD = re.compile(r"^(?:(?:please|пожалуйста),? )?(?:" + _ADD_VERB + ")", re.I)
+_NEGATION = re.compile(r"\b(?:don'?t|do not|never|not|no|nothing|не|ни|ничего|нельзя)\b", re.I)
+_QUESTION = re.compile(r"\?|^(?:can|could|would|will|should|shall|do|does|how|why|when|where|who|which"
+                       r"|можешь|можно|сможешь|как|зачем|почему|когда|где|кто|какой)\b", re.I)
+_RECURRENCE = re.compile(r"\b(?:every|each|daily|weekly|monthly|yearly|annually|weekdays"
+                         r"|кажд\w*|ежедневно|еженедельно|ежемесячно|ежегодно|по будням)\b", re.I)
+# первое слово названия - что-то похожее на событие, а не "the kettle"
+_EVENT_WORD = re.compile(
+    r"^(?:meeting|call|standup|stand-up|sync|lunch|dinner|breakfast|coffee|appointment|interview"
+    r"|review|demo|workshop|training|workout|gym|class|lesson|lecture|presentation|session|event"
+    r"|reminder|doctor|dentist|one-on-one|1:1|party|birthday|webinar|conference|consultation"
+    r"|retro|planning|seminar|deadline|match|game|concert|trip"
+    r"|встреч|созвон|звонок|планёрк|планерк|обед|ужин|завтрак|кофе|тренировк|лекци|урок|заняти"
+    r"|презентаци|консультаци|собеседовани|совещани|врач|стоматолог|событи|напоминани|вебинар"
+    r"|конференци|семинар|день рождения|дедлайн|поездк|концерт)", re.I)
+
+# список - только если вопрос целиком о календаре: "what's next?", а не "what is next year ..."
+_LIST_TAIL = (r"(?: (?:today|tonight|tomorrow|this week|next week|on my calendar|in my calendar"
+              r"|for today|for tomorrow|planned|coming up|please))*")
+_RU_LIST_TAIL = r"(?: (?:сегодня|завтра|на сегодня|на завтра|на неделе|на этой неделе|в календаре|пожалуйста))*"
+_LIST = [re.compile(r"^" + pattern + r"[?.!]*$", re.I) for pattern in (
+    r"what(?:'s| is| are)\s+(?:next|coming up|on my (?:calendar|schedule|agenda)|planned|my plans)" + _LIST_TAIL,
+    r"what do i have" + _LIST_TAIL,
+    r"(?:please )?(?:list|show|get)(?: me)?(?: all)?(?: my)?(?: upcoming| next)?(?: \d+)?"
+    r" (?:events|tasks|meetings|schedule|calendar|agenda|plans)" + _LIST_TAIL,
+    r"my (?:upcoming |next )?(?:events|tasks|meetings|schedule|agenda)" + _LIST_TAIL,
+    r"что (?:дальше|у меня|запланировано|по планам)" + _RU_LIST_TAIL,
+    r"что (?:сегодня|на сегодня|завтра|на завтра)",
+    r"(?:пожалуйста,? )?(?:покажи|выведи|список|перечисли)(?: мне)?(?: все)?(?: мои)?(?: ближайшие| следующие)?"
+    r"(?: \d+)? (?:задач|событи|встреч|дел|план)\w*" + _RU_LIST_TAIL,
+    r"(?:мои|ближайшие) (?:задачи|события|встречи|дела|планы)" + _RU_LIST_TAIL,
+    r"какие (?:у меня )?(?:планы|задачи|встречи|дела)" + _RU_LIST_TAIL,
+)]
+
+_WEEKDAYS = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4,
+    "saturday": 5, "sunday": 6,
+    "понедельник": 0, "вторник": 1, "среду": 2, "среда": 2, "четверг": 3,
+    "пятницу": 4, "пятница": 4, "субботу": 5, "суббота": 5, "воскресенье": 6,
+}
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+    "январ": 1, "феврал": 2, "март": 3, "апрел": 4, "ма": 5, "июн": 6,
+    "июл": 7, "август": 8, "сентябр": 9, "октябр": 10, "ноябр": 11, "декабр": 12,
+}
+_EN_MONTH = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_RU_MONTH = r"(январ|феврал|март|апрел|ма|июн|июл|август|сентябр|октябр|ноябр|декабр)[а-я]*"
+
+_RELATIVE_DAYS = [
+    (re.compile(r"\b(?:the )?day after tomorrow\b|\b(?:на )?послезавтра\b", re.I), 2),
+    (re.compile(r"\btomorrow\b|\b(?:на )?завтра\b", re.I), 1),
+    (re.compile(r"\btoday\b|\b(?:на )?сегодня\b", re.I), 0),
+]
+_WEEKDAY = re.compile(r"\b(?:on |next |в |во |на )?(" + "|".join(_WEEKDAYS) + r")\b", re.I)
+_ISO_DATE = re.compile(r"\b(?:on )?(\d{4})-(\d{2})-(\d{2})\b", re.I)
+_NUMERIC_DATE = re.compile(r"\b(?:on )?(\d{1,2})[./](\d{1,2})(?:[./](\d{2,4}))?\b", re.I)
+_DAY_MONTH = re.compile(r"\b(?:on )?(?:the )?(\d{1,2})(?:st|nd|rd|th)?(?: of)? (?:" + _EN_MONTH + "|" + _RU_MONTH + r")\b", re.I)
+_MONTH_DAY = re.compile(r"\b(?:on )?" + _EN_MONTH + r" (\d{1,2})(?:st|nd|rd|th)?\b", re.I)
+
+_TIME_EN = re.compile(r"\b(?:at )?(\d{1,2})(?::(\d{2}))?\s*(am|pm)\b|\bat (\d{1,2})(?::(\d{2}))?\b"
+                      r"|\b(?:at )?(noon|midday|midnight)\b", re.I)
+_TIME_RU = re.compile(r"\bв (\d{1,2})(?::(\d{2}))?(?: час(?:а|ов)?)?(?: (утра|дня|вечера|ночи))?(?!\S)"
+                      r"|\b(?:в )?(полдень|полночь)\b", re.I)
+_CLOCK = re.compile(r"\b(\d{1,2}):(\d{2})\b")
+
+_DURATION_EN = re.compile(r"\bfor (?:(half an|an?|one|\d+(?:[.,]\d+)?) ?(hours?|hrs?|h|minutes?|mins?|m)"
+                          r"|an hour and a half)\b", re.I)
+_DURATION_RU = re.compile(r"\bна (?:(полчаса)|(полтора часа)|(час)|(\d+(?:[.,]\d+)?) ?(час\w*|мин\w*))(?!\S)", re.I)
+
+_LOCATION = re.compile(r"\b(?:in|at) (?:the )?(office|home|zoom|google meet|teams)\b"
+                       r"|\b(?:в|во) (офисе|зуме|zoom|teams)\b|\b(дома|онлайн|online)\b", re.I)
+# "добавь встречу" -> "Встреча"
+_NOMINATIVE = {"встречу": "встреча", "планёрку": "планёрка", "планерку": "планерка",
+               "тренировку": "тренировка", "консультацию": "консультация",
+               "лекцию": "лекция", "презентацию": "презентация"}
+_PLACES = {"офисе": "офис", "зуме": "zoom", "дома": "дом"}
+# слова о дате и времени, которые остались после разбора: "next week",
+# "at 10 in the evening", "tomorrow or friday", "в мае", "через неделю" -
+# дату понял бы только LLM, без него событие встанет не туда
+_UNPARSED_WHEN = re.compile(
+    r"\b(?:weeks?|weekend|months?|years?|days?|hours?|minutes?|mins?|morning|afternoon|evening|night|tonight"
+    r"|o'clock|am|pm|or|next|this|last|coming|following|after|before|until|till|later|earlier"
+    r"|today|tomorrow|yesterday|january|february|march|april|may|june|july|august|september"
+    r"|october|november|december|jan|feb|mar|apr|jun|jul|aug|sep|sept|oct|nov|dec"
+    r"|monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+    r"|недел\w*|выходн\w*|месяц\w*|год\w*|дн(?:ём|ем|я)|час\w*|минут\w*|утр\w*|вечер\w*|ноч\w*"
+    r"|или|через|следующ\w*|эт(?:у|от|ом|ой)|после|позже|раньше|сегодня|завтра|послезавтра|вчера"
+    r"|январ\w*|феврал\w*|март\w*|апрел\w*|ма[йяе]|июн\w*|июл\w*|август\w*|сентябр\w*|октябр\w*"
+    r"|ноябр\w*|декабр\w*|понедельник\w*|вторник\w*|сред[уа]|четверг\w*|пятниц\w*|суббот\w*"
+    r"|воскресень\w*)\b", re.I)
+_FILLER = re.compile(r"\b(?:to|in|into|on) (?:my |the )?calendar\b|\bв (?:мой )?календарь\b"
+                     r"|\b(?:a|an|the|please|me|мне|пожалуйста|новую|новое|новый)\b", re.I)
+
+
+class Intent:
+    """
+    A message understood without the model: the tool calls and how sure
+    the router is about them.
+    """
+
+    def __init__(self, name: str, tool_calls: list, confidence: float, russian: bool):
+        self.name = name
+        self.tool_calls = tool_calls
+        self.confidence = confidence
+        self.russian = russian
+
+    def __repr__(self):
+        return f"Intent({self.name!r}, {self.tool_calls!r}, confidence={self.confidence})"
+
+
+def _cut(text: str, span):
+    return text[:span[0]] + " " + text[span[1]:]
+
+
+def _hour(hour: int, minute: int, suffix: str):
+    suffix = (suffix or "").lower()
+    if suffix in ("pm", "дня", "вечера") and hour < 12:
+        hour += 12
+    if suffix in ("am", "ночи", "утра") and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return dt.time(hour, minute)
+
+
+def parse_time(text: str):
+    """
+    Returns:
+        (datetime.time or None, span of the match)
+    """
+    match = _TIME_EN.search(text)
+    if match:
+        if match.group(6):
+            word = match.group(6).lower()
+            return (dt.time(0, 0) if word == "midnight" else dt.time(12, 0)), match.span()
+        if match.group(1):
+            return _hour(int(match.group(1)), int(match.group(2) or 0), match.group(3)), match.span()
+        return _hour(int(match.group(4)), int(match.group(5) or 0), None), match.span()
+    match = _TIME_RU.search(text)
+    if match:
+        if match.group(4):
+            word = match.group(4).lower()
+            return (dt.time(0, 0) if word == "полночь" else dt.time(12, 0)), match.span()
+        return _hour(int(match.group(1)), int(match.group(2) or 0), match.group(3)), match.span()
+    match = _CLOCK.search(text)
+    if match:
+        return _hour(int(match.group(1)), int(match.group(2)), None), match.span()
+    return None, None
+
+
+def _future_date(today: dt.date, month: int, day: int, year: int = None):
+    try:
+        date = dt.date(year or today.year, month, day)
+    except ValueError:
+        return None
+    if year is None and date < today:
+        date = date.replace(year=today.year + 1)
+    return date
+
+
+def parse_date(text: str, today: dt.date):
+    """
+    Returns:
+        (datetime.date or None, span of the match)
+    """
+    for pattern, days in _RELATIVE_DAYS:
+        match = pattern.search(text)
+        if match:
+            return today + dt.timedelta(days=days), match.span()
+    match = _WEEKDAY.search(text)
+    if match:
+        weekday = _WEEKDAYS[match.group(1).lower()]
+        # "в пятницу" в пятницу - это следующая пятница
+        ahead = (weekday - today.weekday()) % 7 or 7
+        return today + dt.timedelta(days=ahead), match.span()
+    match = _ISO_DATE.search(text)
+    if match:
+        year, month, day = (int(group) for group in match.groups())
+        return _future_date(today, month, day, year), match.span()
+    match = _DAY_MONTH.search(text)
+    if match:
+        month = _MONTHS[(match.group(2) or match.group(3)).lower()]
+        return _future_date(today, month, int(match.group(1))), match.span()
+    match = _MONTH_DAY.search(text)
+    if match:
+        return _future_date(today, _MONTHS[match.group(1).lower()], int(match.group(2))), match.span()
+    match = _NUMERIC_DATE.search(text)
+    if match:
+        year = match.group(3)
+        if year:
+            year = int(year) + (2000 if len(year) == 2 else 0)
+        return _future_date(today, int(match.group(2)), int(match.group(1)), year), match.span()
+    return None, None
+
+
+def parse_duration(text: str):
+    """
+    Returns:
+        (minutes or None, span of the match)
+    """
+    match = _DURATION_EN.search(text)
+    if match:
+        amount, unit = match.group(1), match.group(2)
+        if amount is None:
+            return 90, match.span()
+        amount = amount.lower()
+        value = 0.5 if amount == "half an" else 1 if amount in ("a", "an", "one") else float(amount.replace(",", "."))
+        minutes = value if unit.lower().startswith("m") else value * 60
+        return int(round(minutes)), match.span()
+    match = _DURATION_RU.search(text)
+    if match:
+        if match.group(1):
+            return 30, match.span()
+        if match.group(2):
+            return 90, match.span()
+        if match.group(3):
+            return 60, match.span()
+        value = float(match.group(4).replace(",", "."))
+        minutes = value if match.group(5).lower().startswith("мин") else value * 60
+        return int(round(minutes)), match.span()
+    return None, None
+
+
+class IntentRouter:
+    """
+    Rule-based router for the formulaic messages: "add meeting tomorrow at
+    15 for an hour", "what's next", "покажи мои задачи".
+
+    route() returns an Intent with add_event / get_calendar_tasks calls
+    whose args are the ones those functions take (date is a naive local
+    datetime), or None when the message has to go to the LLM: nothing
+    matched, several commands in one message, a negation, a question, a
+    recurring event, or a confidence below the threshold (an event without
+    a time, a title that doesn't look like an event, leftover numbers or
+    date/time words such as "next week", "in the evening", "в мае").
+
+    Example call:
+
+    intent = ROUTER.route("Добавь встречу с Анной завтра в 10 на полчаса")
+    # add_event(summary="Встреча с Анной", date=<tomorrow 10:00>, duration=30, ...)
+    """
+
+    def __init__(self, threshold: float = CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+
+    def route(self, text: str, now: dt.datetime = None):
+        intent = self.parse(text, now)
+        if intent is None or intent.confidence < self.threshold:
+            return None
+        return intent
+
+    def parse(self, text: str, now: dt.datetime = None):
+        now = now or dt.datetime.now()
+        text = " ".join(text.split())
+        russian = bool(_CYRILLIC.search(text))
+        adds = list(_ADDS.finditer(text))
+        command = _ADD.match(text)
+        lists = [pattern for pattern in _LIST if pattern.search(text)]
+        if _NEGATION.search(text):
+            return None
+        if command and not lists:
+            if _QUESTION.search(text) or _RECURRENCE.search(text):
+                return None
+            return self._add_event(text, command, len(adds), now, russian)
+        if lists and not adds:
+            numbers = re.findall(r"\b(\d{1,3})\b", text)
+            n_events = int(numbers[0]) if len(numbers) == 1 else DEFAULT_EVENTS
+            confidence = 0.95 if len(numbers) <= 1 else 0.5
+            call = {"name": "get_calendar_tasks", "args": {"n_events": n_events}}
+            return Intent("get_calendar_tasks", [call], confidence, russian)
+        return None
+
+    def _add_event(self, text: str, command, commands: int, now: dt.datetime, russian: bool):
+        confidence = 0.95
+        if commands > 1 or re.search(r"\b(?:and then|then|а потом|потом)\b", text, re.I):
+            # несколько команд в одном сообщении
+            confidence = 0.3
+        rest = text[command.end():]
+
+        duration, span = parse_duration(rest)
+        if span:
+            rest = _cut(rest, span)
+        date, span = parse_date(rest, now.date())
+        if span:
+            rest = _cut(rest, span)
+        event_time, span = parse_time(rest)
+        if span:
+            rest = _cut(rest, span)
+        location, span = None, None
+        match = _LOCATION.search(rest)
+        if match:
+            location = next(group for group in match.groups() if group).lower()
+            location = _PLACES.get(location, location)
+            rest = _cut(rest, match.span())
+
+        if event_time is None:
+            # без времени дату и слот лучше выбрать модели
+            confidence = min(confidence, 0.6)
+            event_time = dt.time(15, 0)
+        if date is None:
+            date = now.date()
+            if dt.datetime.combine(date, event_time) <= now:
+                date += dt.timedelta(days=1)
+        if re.search(r"\d", rest) or _UNPARSED_WHEN.search(rest):
+            # остались числа или слова о времени, которые не удалось разобрать
+            confidence = min(confidence, 0.5)
+
+        summary = _FILLER.sub(" ", rest)
+        summary = " ".join(summary.split()).strip(" ,.;:!?-")
+        if not summary:
+            summary = "Встреча" if russian else "Meeting"
+            confidence = min(confidence, 0.85)
+        first, _, tail = summary.partition(" ")
+        first = _NOMINATIVE.get(first.lower(), first)
+        summary = " ".join(filter(None, (first[0].upper() + first[1:], tail)))
+        if not _EVENT_WORD.match(summary):
+            # "put the kettle on at 7am", "book a flight to Paris" - не событие календаря
+            confidence = min(confidence, 0.4)
+
+        args = {
+            "summary": summary,
+            "description": text,
+            "location": location or "home/online",
+            "date": dt.datetime.combine(date, event_time),
+            "duration": duration or DEFAULT_DURATION,
+        }
+        return Intent("add_event", [{"name": "add_event", "args": args}], confidence, russian)
+
+
+def describe(intent: Intent, outputs) -> str:
+    """
+    Chat reply for the tool outputs of a routed intent, in the language of
+    the message. An add_event output that is not the created event is an
+    error text and is reported as a failure.
+    """
+    lines = []
+    for call, output in zip(intent.tool_calls, outputs):
+        args = call["args"]
+        if call["name"] == "add_event":
+            when = args["date"].strftime("%d.%m.%Y %H:%M")
+            if not isinstance(output, dict):
+                # ошибка API или таймаут: output - текст ошибки
+                lines.append(f"Не удалось добавить «{args['summary']}»: {output}" if intent.russian
+                             else f"Couldn't add \"{args['summary']}\": {output}")
+            elif intent.russian:
+                lines.append(f"Добавил «{args['summary']}» на {when} ({args['duration']} мин).")
+            else:
+                lines.append(f"Added \"{args['summary']}\" on {when} ({args['duration']} min).")
+            continue
+        if not output or isinstance(output, str):
+            lines.append("Не удалось получить календарь." if intent.russian
+                         else "Couldn't load the calendar.")
+            continue
+        events, tasks = output
+        lines.append("Ближайшие события:" if intent.russian else "Upcoming events:")
+        for event in events:
+            start = event["start"].get("dateTime", event["start"].get("date"))
+            lines.append(f"- {start[:16].replace('T', ' ')} {event.get('summary', '')}")
+        lines.append("Задачи:" if intent.russian else "Tasks:")
+        for task in tasks:
+            due = f" ({task['due'][:10]})" if task.get("due") else ""
+            lines.append(f"- {task['title']}{due}")
+    return "\n".join(lines)
+
+
+class RouteMetrics:
+    """
+    How many messages each path answered and how long it took.
+    """
+
+    def __init__(self, keep: int = 1000):
+        self.keep = keep
+        self._lock = threading.Lock()
+        self.latencies = {"router": [], "llm": []}
+        self.counts = {"router": 0, "llm": 0}
+
+    def record(self, path: str, seconds: float):
+        with self._lock:
+            self.counts[path] += 1
+            latencies = self.latencies[path]
+            latencies.append(seconds)
+            if len(latencies) > self.keep:
+                del latencies[0]
+
+    def hit_rate(self):
+        total = self.counts["router"] + self.counts["llm"]
+        return self.counts["router"] / total if total else 0.0
+
+    def summary(self):
+        """
+        Returns:
+            dict: path -> {"count", "mean_ms", "p95_ms"}
+        """
+        result = {}
+        with self._lock:
+            for path, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                result[path] = {
+                    "count": self.counts[path],
+                    "mean_ms": statistics.mean(ordered) * 1e3 if ordered else None,
+                    "p95_ms": ordered[max(int(len(ordered) * 0.95) - 1, 0)] * 1e3 if ordered else None,
+                }
+        return result
+
+
+class timed:
+    """
+    with timed(metrics, "router"): ...
+    """
+
+    def __init__(self, metrics: RouteMetrics, path: str):
+        self.metrics = metrics
+        self.path = path
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.path, time.perf_counter() - self.start)
+        return False
+
+
+ROUTER = IntentRouter()
@@ -0,0 +1,364 @@
+import copy
+import re
+
+import torch
+from transformers import LogitsProcessor
+
+
+_HEX = set("0123456789abcdefABCDEF")
+_ESCAPES = set('"\\/bfnrt')
+_DIGITS = set("0123456789")
+# литералы true/false/null начинаются с первой буквы
+_KEYWORDS = {"t": "true", "f": "false", "n": "null"}
+_END = ("end",)
+
+
+def _lit(text: str):
+    return ("lit", text, 0)
+
+
+class ToolCallGrammar:
+    """
+    Character-level pushdown automaton for the compact JSON of
+    ToolCallOrResponse:
+
+    {"tool_calls":[{"name":"<tool>","args":{...}},...],"content":"..."}
+
+    "name" can only be one of tool_names, "args" is any JSON object. A
+    state is a tuple used as a stack (top is the last element), so states
+    are hashable and the allowed-token sets can be cached per state.
+
+    Example call:
+
+    grammar = ToolCallGrammar(["test_func"])
+    state = grammar.initial()
+    state = grammar.advance(state, "{")   # None if the char is not allowed
+    """
+
+    def __init__(self, tool_names):
+        self.tool_names = tuple(tool_names)
+        # со стороны вершины: {"name":" ИМЯ ,"args":{ ОБЪЕКТ }
+        self._item = (_lit("}"), ("object",), _lit(',"args":{'),
+                      ("enum", ""), _lit('"name":"'))
+
+    def initial(self):
+        return (_END, _lit("}"), ("string", 0), _lit(',"content":"'),
+                ("items",), _lit('{"tool_calls":['))
+
+    def accepts_end(self, state) -> bool:
+        return state is not None and state[-1] == _END
+
+    def advance(self, state, char: str):
+        while True:
+            top = state[-1]
+            rest = state[:-1]
+            kind = top[0]
+            if kind == "lit":
+                text, position = top[1], top[2]
+                if char != text[position]:
+                    return None
+                if position + 1 == len(text):
+                    return rest
+                return rest + (("lit", text, position + 1),)
+            if kind == "string":
+                return self._string(rest, top[1], char)
+            if kind == "enum":
+                prefix = top[1]
+                if char == '"':
+                    return rest if prefix in self.tool_names else None
+                prefix += char
+                if any(name.startswith(prefix) for name in self.tool_names):
+                    return rest + (("enum", prefix),)
+                return None
+            if kind == "value":
+                return self._value(rest, char)
+            if kind == "object":
+                # сразу после "{"
+                if char == "}":
+                    return rest
+                if char == '"':
+                    return rest + (("members",), ("value",), _lit(":"), ("string", 0))
+                return None
+            if kind == "members":
+                if char == "}":
+                    return rest
+                if char == ",":
+                    return rest + (("members",), ("value",), _lit(":"), ("string", 0), _lit('"'))
+                return None
+            if kind == "array":
+                if char == "]":
+                    return rest
+                state = rest + (("elements",), ("value",))
+                continue
+            if kind == "elements":
+                if char == "]":
+                    return rest
+                if char == ",":
+                    return rest + (("elements",), ("value",))
+                return None
+            if kind == "items":
+                if char == "]":
+                    return rest
+                if char == "{":
+                    return rest + (("more_items",),) + self._item
+                return None
+            if kind == "more_items":
+                if char == "]":
+                    return rest
+                if char == ",":
+                    return rest + (("more_items",),) + self._item + (_lit("{"),)
+                return None
+            if kind == "number":
+                phase = self._number(top[1], char)
+                if phase is not None:
+                    return rest + (("number", phase),)
+                if top[1] not in ("int", "zero", "frac", "exp"):
+                    return None
+                # число кончилось, символ относится к следующему элементу
+                state = rest
+                continue
+            return None
+
+    @staticmethod
+    def _string(rest, mode: int, char: str):
+        if mode == 0:
+            if char == '"':
+                return rest
+            if char == "\\":
+                return rest + (("string", 1),)
+            if ord(char) < 0x20:
+                return None
+            return rest + (("string", 0),)
+        if mode == 1:
+            if char == "u":
+                return rest + (("string", 2),)
+            return rest + (("string", 0),) if char in _ESCAPES else None
+        # 2..5: цифры \uXXXX
+        if char not in _HEX:
+            return None
+        return rest + (("string", 0 if mode == 5 else mode + 1),)
+
+    def _value(self, rest, char: str):
+        if char == '"':
+            return rest + (("string", 0),)
+        if char == "{":
+            return rest + (("object",),)
+        if char == "[":
+            return rest + (("array",),)
+        if char == "-":
+            return rest + (("number", "sign"),)
+        if char == "0":
+            return rest + (("number", "zero"),)
+        if char in _DIGITS:
+            return rest + (("number", "int"),)
+        if char in _KEYWORDS:
+            return rest + (("lit", _KEYWORDS[char], 1),)
+        return None
+
+    @staticmethod
+    def _number(phase: str, char: str):
+        digit = char in _DIGITS
+        if phase == "sign":
+            return ("zero" if char == "0" else "int") if digit else None
+        if phase in ("int", "zero"):
+            if digit and phase == "int":
+                return "int"
+            if char == ".":
+                return "dot"
+            return "e" if char in "eE" else None
+        if phase in ("dot", "frac"):
+            if digit:
+                return "frac"
+            return "e" if phase == "frac" and char in "eE" else None
+        if phase == "e":
+            if char in "+-":
+                return "e_sign"
+            return "exp" if digit else None
+        if phase in ("e_sign", "exp"):
+            return "exp" if digit else None
+        return None
+
+    def closing(self, state) -> str:
+        """
+        Shortest text that completes the JSON from this state.
+        """
+        parts = []
+        for symbol in reversed(state):
+            kind = symbol[0]
+            if kind == "lit":
+                parts.append(symbol[1][symbol[2]:])
+            elif kind == "string":
+                mode = symbol[1]
+                parts.append("n\"" if mode == 1 else "0" * (6 - mode) + '"' if mode else '"')
+            elif kind == "enum":
+                names = [name for name in self.tool_names if name.startswith(symbol[1])]
+                parts.append(min(names, key=len)[len(symbol[1]):] + '"')
+            elif kind == "value":
+                parts.append("0")
+            elif kind in ("object", "members"):
+                parts.append("}")
+            elif kind in ("array", "elements", "items", "more_items"):
+                parts.append("]")
+            elif kind == "number" and symbol[1] not in ("int", "zero", "frac", "exp"):
+                parts.append("0")
+        return "".join(parts)
+
+    def advance_text(self, state, text: str):
+        for char in text:
+            state = self.advance(state, char)
+            if state is None:
+                return None
+        return state
+
+
+def token_strings(tokenizer):
+    """
+    Text each token adds to the output; None for special and byte-fallback
+    tokens, which the constrained mode never emits.
+    """
+    tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    special = set(tokenizer.all_special_ids)
+    sentencepiece = any(token.startswith("▁") for token in tokens if token)
+    byte_token = re.compile(r"<0x[0-9A-Fa-f]{2}>")
+    strings = []
+    for token_id, token in enumerate(tokens):
+        if token is None or token_id in special or byte_token.fullmatch(token):
+            strings.append(None)
+        elif sentencepiece:
+            strings.append(token.replace("▁", " "))
+        else:
+            strings.append(tokenizer.convert_tokens_to_string([token]))
+    return strings
+
+
+class _TrieNode:
+    __slots__ = ("children", "token_ids")
+
+    def __init__(self):
+        self.children = {}
+        self.token_ids = []
+
+
+class ToolCallLogitsProcessor(LogitsProcessor):
+    """
+    Masks every token that would take the output out of ToolCallGrammar,
+    so the reply of the local pipeline always parses as ToolCallOrResponse.
+
+    Allowed tokens are found by walking a character trie of the vocabulary
+    together with the automaton, pruning a branch at the first rejected
+    character. The result is cached per automaton state: inside a string
+    the state repeats from token to token, so most steps are a dict lookup.
+    A processor holds the automaton state of one generation: use fresh()
+    for every generate call, it shares the trie and the cache.
+
+    With max_new_tokens the processor also makes sure the JSON is finished
+    in time: once the remaining tokens are only enough to close every open
+    string, array and object, the closing characters are forced.
+
+    Example call:
+
+    processor = ToolCallLogitsProcessor(tokenizer, available_tools, max_new_tokens=1024)
+    model.generate(**inputs, logits_processor=LogitsProcessorList([processor.fresh()]))
+    """
+
+    def __init__(self, tokenizer, tool_names, max_new_tokens: int = None,
+                 grammar: ToolCallGrammar = None):
+        self.grammar = grammar or ToolCallGrammar(tool_names)
+        self.max_new_tokens = max_new_tokens
+        self.eos_token_id = tokenizer.eos_token_id
+        self.strings = token_strings(tokenizer)
+        self.root = _TrieNode()
+        for token_id, text in enumerate(self.strings):
+            if not text:
+                continue
+            node = self.root
+            for char in text:
+                node = node.children.setdefault(char, _TrieNode())
+            node.token_ids.append(token_id)
+        self._allowed = {}
+        self._states = None
+        self._prompt_length = None
+
+    def fresh(self):
+        """
+        A processor for a new generation, sharing the vocabulary trie and
+        the allowed tokens cache with this one.
+        """
+        processor = copy.copy(self)
+        processor._states = None
+        processor._prompt_length = None
+        return processor
+
+    def allowed_tokens(self, state):
+        """
+        Returns:
+            (tensor of allowed token ids, the most any of them lengthens
+            grammar.closing())
+        """
+        allowed = self._allowed.get(state)
+        if allowed is None:
+            token_ids = []
+            closing = len(self.grammar.closing(state))
+            growth = 0
+            stack = [(self.root, state)]
+            while stack:
+                node, node_state = stack.pop()
+                for char, child in node.children.items():
+                    child_state = self.grammar.advance(node_state, char)
+                    if child_state is None:
+                        continue
+                    if child.token_ids:
+                        token_ids.extend(child.token_ids)
+                        growth = max(growth, len(self.grammar.closing(child_state)) - closing)
+                    stack.append((child, child_state))
+            if self.grammar.accepts_end(state) and self.eos_token_id is not None:
+                token_ids.append(self.eos_token_id)
+            allowed = (torch.tensor(token_ids, dtype=torch.long), growth)
+            self._allowed[state] = allowed
+        return allowed
+
+    def closing_tokens(self, state):
+        """
+        Tokens that spell the start of grammar.closing(state), EOS if
+        nothing is left to close.
+        """
+        closing = self.grammar.closing(state)
+        if not closing:
+            return torch.tensor([self.eos_token_id], dtype=torch.long)
+        token_ids = []
+        node = self.root
+        for char in closing:
+            node = node.children.get(char)
+            if node is None:
+                break
+            token_ids.extend(node.token_ids)
+        return torch.tensor(token_ids, dtype=torch.long)
+
+    def __call__(self, input_ids, scores):
+        length = input_ids.shape[1]
+        if self._states is None:
+            # первый шаг генерации: всё, что есть сейчас, - промпт
+            self._states = [self.grammar.initial() for _ in range(input_ids.shape[0])]
+            self._prompt_length = length
+        else:
+            for row, token_id in enumerate(input_ids[:, -1].tolist()):
+                state = self._states[row]
+                if state is not None and not self.grammar.accepts_end(state):
+                    state = self.grammar.advance_text(state, self.strings[token_id] or "")
+                self._states[row] = state
+
+        mask = torch.full_like(scores, float("-inf"))
+        for row, state in enumerate(self._states):
+            if state is None:
+                # сюда не попасть: запрещённые токены не выбираются
+                mask[row] = 0
+                continue
+            allowed, growth = self.allowed_tokens(state)
+            if self.max_new_tokens is not None:
+                left = self.max_new_tokens - (length - self._prompt_length)
+                # после любого свободного токена должно хватить места закрыть JSON:
+                # по токену на символ закрытия и ещё один на EOS
+                if left < len(self.grammar.closing(state)) + growth + 2:
+                    allowed = self.closing_tokens(state)
+            mask[row, allowed.to(scores.device)] = 0
+        return scores + mask
@@ -0,0 +1,157 @@
+import abc
+import datetime as dt
+import json
+import re
+import threading
+import time
+
+from intent_router import IntentRouter
+
+
+# фиксированное "сейчас" заглушки: ответы не зависят от дня запуска
+STUB_NOW = dt.datetime(2024, 7, 5, 12, 0)
+_PIECES = re.compile(r"\s*[\w]+|\s*[^\w\s]|\s+")
+
+
+class Backend(abc.ABC):
+    """
+    A chat model the benchmark can drive: stream() yields the reply in
+    the pieces the backend produces (tokens, for the real ones).
+
+    messages are dicts {"role": "system" | "user" | "assistant", "content": str}.
+    picks_tools is False for a backend whose tool choice is not its own,
+    its right-tool rate is not reported.
+    """
+
+    name = "backend"
+    picks_tools = True
+
+    @abc.abstractmethod
+    def stream(self, messages):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubBackend(Backend):
+    """
+    Deterministic offline model: answers with the ToolCallOrResponse JSON
+    of the rule-based intent router, split into word-sized tokens, with a
+    fixed time to first token and token rate. Every failure_every-th reply
+    is wrapped in prose and left unclosed, so the parse-failure path is
+    exercised too. The tools are the router's, so its right-tool rate would
+    only compare the router with itself; bench_llm prints n/a for it.
+
+    Example call:
+
+    backend = StubBackend(ttft=0.2, tokens_per_second=30)
+    reply = "".join(backend.stream([{"role": "user", "content": "what's next"}]))
+    """
+
+    name = "stub"
+    picks_tools = False
+
+    def __init__(self, ttft: float = 0.05, tokens_per_second: float = 200.0,
+                 failure_every: int = 0, now: dt.datetime = STUB_NOW):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.failure_every = failure_every
+        self.now = now
+        self.router = IntentRouter(threshold=0.0)
+        self.calls = 0
+
+    def reply(self, text: str) -> str:
+        intent = self.router.parse(text, self.now)
+        if intent is None:
+            return json.dumps({"tool_calls": [], "content": "Sorry, I can only manage your calendar."})
+        tool_calls = [
+            {"name": call["name"],
+             "args": {key: value.isoformat() if isinstance(value, dt.datetime) else value
+                      for key, value in call["args"].items()}}
+            for call in intent.tool_calls
+        ]
+        return json.dumps({"tool_calls": tool_calls, "content": ""}, ensure_ascii=False)
+
+    def stream(self, messages):
+        self.calls += 1
+        text = next(message["content"] for message in reversed(messages) if message["role"] == "user")
+        reply = self.reply(text)
+        if self.failure_every and self.calls % self.failure_every == 0:
+            reply = "Here is the JSON response: " + reply[:-2]
+        time.sleep(self.ttft)
+        for piece in _PIECES.findall(reply):
+            yield piece
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+
+
+def _langchain_messages(messages):
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+    kinds = {"system": SystemMessage, "user": HumanMessage, "assistant": AIMessage}
+    return [kinds[message["role"]](content=message["content"]) for message in messages]
+
+
+class LangChainBackend(Backend):
+    """
+    Any LangChain chat model that supports .stream(): ChatHuggingFace over
+    an endpoint (LLM_test_zephyr-7b-beta.py), ChatAnthropic
+    (LLM_test_langchain.py), ...
+    """
+
+    def __init__(self, chat_model, name: str):
+        self.chat_model = chat_model
+        self.name = name
+
+    def stream(self, messages):
+        for chunk in self.chat_model.stream(_langchain_messages(messages)):
+            if chunk.content:
+                yield chunk.content
+
+
+class TransformersBackend(Backend):
+    """
+    Local transformers model, streamed token by token with TextIteratorStreamer.
+    """
+
+    def __init__(self, model_id: str, max_new_tokens: int = 512):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        self.name = f"local:{model_id}"
+        self.max_new_tokens = max_new_tokens
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype="auto",
+                                                          device_map="auto")
+
+    def stream(self, messages):
+        from transformers import TextIteratorStreamer
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        inputs = self.tokenizer(text, return_tensors="pt").to(self.model.device)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        thread = threading.Thread(target=self.model.generate, kwargs=dict(
+            **inputs, streamer=streamer, max_new_tokens=self.max_new_tokens, do_sample=False))
+        thread.start()
+        for piece in streamer:
+            if piece:
+                yield piece
+        thread.join()
+
+
+def make_backend(spec: str) -> Backend:
+    """
+    "stub", "stub:<failure_every>", "hf-endpoint:<repo_id>",
+    "anthropic:<model>" or "local:<model_id>".
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "stub":
+        return StubBackend(failure_every=int(arg) if arg else 0)
+    if kind == "hf-endpoint":
+        from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
+        llm = HuggingFaceEndpoint(repo_id=arg or "HuggingFaceH4/zephyr-7b-beta",
+                                  task="text-generation", max_new_tokens=1024, do_sample=False)
+        return LangChainBackend(ChatHuggingFace(llm=llm), spec)
+    if kind == "anthropic":
+        from langchain_anthropic import ChatAnthropic
+        return LangChainBackend(ChatAnthropic(model=arg), spec)
+    if kind == "local":
+        return TransformersBackend(arg)
+    raise ValueError(f"Unknown backend {spec!r}")
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from cachetools import TTLCache
+
+
+CACHE_TTL = 60 * 60
+CACHE_SIZE = 512
+# сколько последних сообщений (кроме системных) входит в ключ
+HISTORY_WINDOW = 4
+# LLM_CACHE_PATH=llm_cache.db включает копию кэша на диске
+CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text) -> str:
+    """
+    "  Add  event\nTomorrow " and "add event tomorrow" give the same text.
+    """
+    return _SPACES.sub(" ", str(text)).strip().casefold()
+
+
+def _message_parts(message):
+    if isinstance(message, dict):
+        return message.get("type") or message.get("role"), message.get("content", "")
+    return message.type, message.content
+
+
+def cache_key(messages, tool_schema: str = "", model: str = "",
+              window: int = HISTORY_WINDOW) -> str:
+    """
+    sha256 of the model name, the tool schema, every system message and
+    the last `window` other messages, all with normalized text.
+    """
+    parts = [_message_parts(message) for message in messages]
+    system = [content for kind, content in parts if kind == "system"]
+    recent = [(kind, content) for kind, content in parts if kind != "system"][-window:]
+    payload = {
+        "model": model,
+        "tools": normalize_text(tool_schema),
+        "system": [normalize_text(content) for content in system],
+        "messages": [(kind, normalize_text(content)) for kind, content in recent],
+    }
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class _DiskStore:
+    """
+    SQLite table key -> (response JSON, creation time); survives restarts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._execute("CREATE TABLE IF NOT EXISTS responses "
+                      "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            connection = sqlite3.connect(self.path)
+            try:
+                with connection:
+                    return connection.execute(sql, params).fetchone()
+            finally:
+                connection.close()
+
+    def get(self, key: str, ttl: float):
+        row = self._execute("SELECT value, created FROM responses WHERE key = ?", (key,))
+        if row is None or time.time() - row[1] > ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key: str, value):
+        self._execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                      (key, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def clear(self):
+        self._execute("DELETE FROM responses")
+
+
+class LLMResponseCache:
+    """
+    Cache of parsed ToolCallOrResponse replies for prompt_ai().
+
+    The key is cache_key() of the conversation: repeating a command in
+    the same context skips the model entirely. Entries live ttl seconds
+    and the least recently used ones are evicted past maxsize; with a path
+    they are also kept in SQLite and read back after a restart.
+
+    A reply is stored only if every tool it calls is in idempotent_tools:
+    a cached reply that calls a tool with side effects (adding an event)
+    would repeat that action instead of the model deciding again.
+
+    Example call:
+
+    cache = LLMResponseCache(path="llm_cache.db", idempotent_tools=["get_calendar_tasks"])
+    key = cache.key(messages, tool_text, model)
+    ai_response = cache.get(key)
+    if ai_response is None:
+        ai_response = chatbot.invoke(messages)
+        cache.put(key, ai_response)
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL, path: str = None,
+                 idempotent_tools=(), window: int = HISTORY_WINDOW):
+        self.ttl = ttl
+        self.window = window
+        self.idempotent_tools = {name.lower() for name in idempotent_tools}
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._disk = _DiskStore(path) if path else None
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "skipped": 0,
+        }
+
+    def key(self, messages, tool_schema: str = "", model: str = ""):
+        return cache_key(messages, tool_schema, model, self.window)
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self.stats["hits"] += 1
+                return json.loads(value)
+        if self._disk is not None:
+            value = self._disk.get(key, self.ttl)
+            if value is not None:
+                with self._lock:
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    self._memory[key] = json.dumps(value)
+                return value
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def cacheable(self, response) -> bool:
+        tool_calls = response.get("tool_calls") or []
+        return all(str(call.get("name", "")).lower() in self.idempotent_tools
+                   for call in tool_calls)
+
+    def put(self, key: str, response) -> bool:
+        """
+        Returns:
+            bool: False if the reply has side effects and was not stored
+        """
+        if not isinstance(response, dict) or not self.cacheable(response):
+            with self._lock:
+                self.stats["skipped"] += 1
+            return False
+        # храним JSON-строку: вызывающий код может менять полученный dict
+        value = json.dumps(response, ensure_ascii=False)
+        with self._lock:
+            self._memory[key] = value
+            self.stats["stores"] += 1
+        if self._disk is not None:
+            self._disk.put(key, response)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
@@ -0,0 +1,122 @@
+import os
+from functools import lru_cache
+
+from langchain_core.messages import AIMessage, SystemMessage
+
+
+PROMPT_BUDGET = int(os.getenv("LLM_PROMPT_BUDGET", "3072"))
+# служебные токены роли на каждое сообщение в шаблоне чата
+MESSAGE_OVERHEAD = 4
+THOUGHT_CHARS = 240
+
+
+def is_thought(message) -> bool:
+    return message.type == "ai" and message.content.startswith("Thought:")
+
+
+class TokenCounter:
+    """
+    Counts prompt tokens with the model's own tokenizer; counts of message
+    texts are memoized, the history is recounted on every call.
+
+    Example call:
+
+    count_tokens = TokenCounter.from_pretrained("HuggingFaceH4/zephyr-7b-beta")
+    count_tokens(HumanMessage(content="hi"))
+    """
+
+    def __init__(self, tokenizer, overhead: int = MESSAGE_OVERHEAD):
+        self.tokenizer = tokenizer
+        self.overhead = overhead
+        self._encode = lru_cache(maxsize=4096)(self._count)
+
+    @classmethod
+    def from_pretrained(cls, model: str, **kwargs):
+        from transformers import AutoTokenizer
+        return cls(AutoTokenizer.from_pretrained(model), **kwargs)
+
+    def _count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def __call__(self, message) -> int:
+        return self._encode(message.content) + self.overhead
+
+
+def _turns(messages):
+    """
+    Splits non-system messages into turns, each starting at a human message.
+    """
+    turns = []
+    for message in messages:
+        if message.type == "human" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class HistoryManager:
+    """
+    Builds the prompt for one model call from the whole chat history
+    within a token budget.
+
+    System messages (and the tool schema, added as a system message) are
+    always sent. Tool outputs ("Thought: - I called ...") of earlier turns
+    are cut to thought_chars characters; if the prompt is still over the
+    budget, the oldest turns are dropped. The current turn is always sent
+    whole. report holds the token count of the last prompt.
+
+    Example call:
+
+    history = HistoryManager(TokenCounter.from_pretrained(model))
+    prompt = history.compact(st.session_state.messages, tool_text)
+    print(history.report)
+    """
+
+    def __init__(self, count_tokens, budget: int = PROMPT_BUDGET,
+                 thought_chars: int = THOUGHT_CHARS):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.thought_chars = thought_chars
+        self.report = {}
+
+    def _collapse(self, message):
+        if not is_thought(message) or len(message.content) <= self.thought_chars:
+            return message
+        return AIMessage(content=message.content[:self.thought_chars] + " ...")
+
+    def compact(self, messages, tool_schema: str = None):
+        """
+        Returns:
+            list: messages to send; the history itself is not changed
+        """
+        system = [message for message in messages if message.type == "system"]
+        if tool_schema and not any(message.content == tool_schema for message in system):
+            system.append(SystemMessage(content=tool_schema))
+        turns = _turns([message for message in messages if message.type != "system"])
+        total_in = sum(len(turn) for turn in turns)
+        collapsed = [0] * len(turns)
+        for number, turn in enumerate(turns[:-1]):
+            for index, message in enumerate(turn):
+                short = self._collapse(message)
+                if short is not message:
+                    turn[index] = short
+                    collapsed[number] += 1
+
+        tokens = sum(self.count_tokens(message) for message in system)
+        turn_tokens = [sum(self.count_tokens(message) for message in turn) for turn in turns]
+        tokens += sum(turn_tokens)
+        dropped = 0
+        # самые старые реплики уходят первыми, текущая остаётся всегда
+        while dropped < len(turns) - 1 and tokens > self.budget:
+            tokens -= turn_tokens[dropped]
+            dropped += 1
+        kept = [message for turn in turns[dropped:] for message in turn]
+
+        self.report = {
+            "prompt_tokens": tokens,
+            "messages": len(system) + len(kept),
+            "dropped": total_in - len(kept),
+            "collapsed": sum(collapsed[dropped:]),
+            "over_budget": tokens > self.budget,
+        }
+        return system + kept
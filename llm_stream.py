@@ -0,0 +1,171 @@
+import json
+import time
+
+
+def _escape_complete(escape: str) -> bool:
+    if len(escape) < 2:
+        return False
+    if escape[1] != "u":
+        return True
+    if len(escape) < 6:
+        return False
+    # старший суррогат ждёт парный \uXXXX
+    if 0xD800 <= int(escape[2:6], 16) <= 0xDBFF:
+        return len(escape) >= 12
+    return True
+
+
+class ToolCallOrResponseParser:
+    """
+    Incremental parser of the {"tool_calls": [...], "content": "..."}
+    object the model writes, fed chunk by chunk.
+
+    feed() returns what became known with this chunk:
+    ("content", text) for the next decoded piece of the content string and
+    ("tool_call", dict) as soon as an object of tool_calls is closed.
+    Anything before the first "{" (```json fences, "Here is...") is skipped.
+
+    Example call:
+
+    parser = ToolCallOrResponseParser()
+    for chunk in chunks:
+        for kind, value in parser.feed(chunk):
+            ...
+    ai_response = parser.result()
+    """
+
+    def __init__(self):
+        self._text = []
+        self._length = 0
+        self._start = None
+        self._end = None
+        self._stack = []
+        self._in_string = False
+        self._escape = ""
+        self._reading_key = False
+        self._key_chars = []
+        self._expect_key = False
+        self._key = None
+        self._streaming_content = False
+        self._item_start = None
+
+    def _string_char(self, char: str, events: list):
+        if self._reading_key:
+            self._key_chars.append(char)
+        elif self._streaming_content:
+            if events and events[-1][0] == "content":
+                events[-1] = ("content", events[-1][1] + char)
+            else:
+                events.append(("content", char))
+
+    def feed(self, chunk: str):
+        events = []
+        offset = self._length
+        self._text.append(chunk)
+        self._length += len(chunk)
+        for position, char in enumerate(chunk, offset):
+            if self._end is not None:
+                break
+            if not self._stack:
+                if char == "{":
+                    self._stack.append(char)
+                    self._start = position
+                    self._expect_key = True
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape += char
+                    if _escape_complete(self._escape):
+                        if self._reading_key or self._streaming_content:
+                            self._string_char(json.loads(f'"{self._escape}"'), events)
+                        self._escape = ""
+                elif char == "\\":
+                    self._escape = char
+                elif char == '"':
+                    self._in_string = False
+                    if self._reading_key:
+                        self._key = "".join(self._key_chars)
+                        self._reading_key = False
+                    self._streaming_content = False
+                else:
+                    self._string_char(char, events)
+                continue
+            depth = len(self._stack)
+            if char == '"':
+                self._in_string = True
+                if depth == 1 and self._expect_key:
+                    self._reading_key = True
+                    self._key_chars = []
+                    self._expect_key = False
+                elif depth == 1 and self._key == "content":
+                    self._streaming_content = True
+            elif char in "{[":
+                if char == "{" and depth == 2 and self._key == "tool_calls":
+                    self._item_start = position
+                self._stack.append(char)
+            elif char in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    self._end = position
+                elif len(self._stack) == 2 and self._item_start is not None:
+                    text = self.text()
+                    events.append(("tool_call", json.loads(text[self._item_start:position + 1])))
+                    self._item_start = None
+            elif char == "," and depth == 1:
+                self._expect_key = True
+        return events
+
+    def text(self) -> str:
+        if len(self._text) > 1:
+            self._text = ["".join(self._text)]
+        return self._text[0] if self._text else ""
+
+    def done(self) -> bool:
+        return self._end is not None
+
+    def result(self) -> dict:
+        if self._end is None:
+            raise ValueError(f"Incomplete JSON in model output: {self.text()!r}")
+        response = json.loads(self.text()[self._start:self._end + 1])
+        response.setdefault("tool_calls", [])
+        response.setdefault("content", "")
+        return response
+
+
+class StreamedResponse:
+    """
+    Iterates over the content text of a streamed ToolCallOrResponse while
+    handing every closed tool call to on_tool_call right away; the parsed
+    reply is in .response once the iteration is over.
+
+    ttft is the time to the first visible piece of content, the number a
+    user waiting in the chat actually feels.
+
+    Example call:
+
+    streamed = StreamedResponse((chunk.content for chunk in chat.stream(messages)), run_tool)
+    st.write_stream(streamed)
+    ai_response = streamed.response
+    """
+
+    def __init__(self, chunks, on_tool_call=None):
+        self.chunks = chunks
+        self.on_tool_call = on_tool_call
+        self.parser = ToolCallOrResponseParser()
+        self.response = None
+        self.ttft = None
+        self.elapsed = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        for chunk in self.chunks:
+            for kind, value in self.parser.feed(chunk):
+                if kind == "tool_call":
+                    if self.on_tool_call is not None:
+                        self.on_tool_call(value)
+                    continue
+                if self.ttft is None:
+                    self.ttft = time.perf_counter() - start
+                yield value
+        self.elapsed = time.perf_counter() - start
+        self.response = self.parser.result()
@@ -0,0 +1,276 @@
+import datetime as dt
+import heapq
+import re
+import threading
+
+from cachetools import LRUCache
+from dateutil import tz
+from dateutil.rrule import DAILY, HOURLY, MINUTELY, SECONDLY, WEEKLY, rrulestr, rruleset
+
+from calendar_class import EVENT_IMPRINT, event_bounds, to_epoch
+from calendar_fetch import iter_events
+
+
+# развёрток (серия, окно) в памяти, старые вытесняются
+EXPANSION_CACHE_SIZE = 128
+
+
+def _parse_value(value: str, tzinfo, all_day: bool):
+    # 20240401 | 20240401T090000 | 20240401T090000Z
+    if "T" not in value:
+        day = dt.datetime.strptime(value, "%Y%m%d")
+        return day if all_day else day.replace(tzinfo=tzinfo)
+    moment = dt.datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        moment = moment.replace(tzinfo=tz.UTC)
+    elif not all_day:
+        moment = moment.replace(tzinfo=tzinfo)
+    if all_day:
+        return moment.replace(tzinfo=None, hour=0, minute=0, second=0)
+    return moment.astimezone(tzinfo)
+
+
+def _fix_until(rule: str, all_day: bool):
+    # dateutil требует UNTIL в UTC для aware dtstart и naive - для naive
+    def repl(match):
+        value = match.group(1)
+        if all_day:
+            return "UNTIL=" + value[:8]
+        if "T" not in value:
+            return f"UNTIL={value}T235959Z"
+        return "UNTIL=" + value
+    return re.sub(r"UNTIL=([0-9TZ]+)", repl, rule)
+
+
+# длина периода в "настенном" времени для частот с периодом постоянной длины
+_PERIODS = {
+    WEEKLY: dt.timedelta(weeks=1),
+    DAILY: dt.timedelta(days=1),
+    HOURLY: dt.timedelta(hours=1),
+    MINUTELY: dt.timedelta(minutes=1),
+    SECONDLY: dt.timedelta(seconds=1),
+}
+
+
+def _fast_forward(rule, after: dt.datetime):
+    """
+    The same rule with dtstart moved forward by whole intervals to just
+    before after (wall-clock time of the series), so iterating it does not
+    walk every occurrence since the original DTSTART. dateutil's
+    xafter()/between() still iterate from DTSTART.
+
+    Only rules whose period has a fixed length (WEEKLY and shorter) and no
+    COUNT are moved: weekday, hour, minute and second defaults taken from
+    DTSTART stay the same after a whole number of such periods, and COUNT
+    counts from DTSTART.
+    """
+    period = _PERIODS.get(rule._freq)
+    if period is None or rule._count is not None:
+        return rule
+    dtstart = rule._dtstart
+    step = period * rule._interval
+    # на шаг раньше: запас на переход на летнее/зимнее время
+    steps = (after.replace(tzinfo=None) - dtstart.replace(tzinfo=None)) // step - 1
+    if steps <= 0:
+        return rule
+    return rule.replace(dtstart=dtstart + steps * step)
+
+
+def build_ruleset(master: EVENT_IMPRINT, timezone: str = "UTC", after=None):
+    """
+    dateutil rruleset for a recurring event: RRULE lines, RDATE and EXDATE
+    (with TZID or VALUE=DATE parameters) from master.recurrence.
+
+    Timed series are expanded in the series timeZone, so instances keep
+    their wall-clock time across DST changes; all-day series use naive
+    dates. With after (epoch) the rules skip the occurrences that start
+    before it, see _fast_forward.
+    Returns:
+        (ruleset, dtstart, duration, all_day, tzname)
+    """
+    all_day = bool(master.start.get("date"))
+    tzname = master.start.get("timeZone") or timezone
+    tzinfo = tz.gettz(tzname)
+    if all_day:
+        dtstart = dt.datetime.strptime(master.start["date"], "%Y-%m-%d")
+        dtend = dt.datetime.strptime(master.end["date"], "%Y-%m-%d")
+    else:
+        dtstart = _parse_iso(master.start["dateTime"], tzinfo)
+        dtend = _parse_iso(master.end["dateTime"], tzinfo)
+
+    if after is not None:
+        after = dt.datetime.fromtimestamp(after, tz.gettz(timezone) if all_day else tzinfo)
+    rules = rruleset()
+    for line in master.recurrence:
+        name, _, values = line.partition(":")
+        name, *params = name.split(";")
+        params = dict(param.split("=", 1) for param in params)
+        if name == "RRULE":
+            rule = rrulestr(_fix_until(values, all_day), dtstart=dtstart)
+            rules.rrule(_fast_forward(rule, after) if after is not None else rule)
+            continue
+        value_tz = tz.gettz(params["TZID"]) if "TZID" in params else tzinfo
+        for value in values.split(","):
+            moment = _parse_value(value, value_tz, all_day)
+            if name == "RDATE":
+                rules.rdate(moment)
+            elif name == "EXDATE":
+                rules.exdate(moment)
+    return rules, dtstart, dtend - dtstart, all_day, tzname
+
+
+def _parse_iso(value: str, tzinfo):
+    moment = dt.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=tzinfo)
+    return moment.astimezone(tzinfo)
+
+
+def _instance(master: EVENT_IMPRINT, data: dict, start, duration, all_day, tzname):
+    end = start + duration
+    if all_day:
+        stamp = start.strftime("%Y%m%d")
+        start_field = {"date": start.date().isoformat()}
+        end_field = {"date": end.date().isoformat()}
+    else:
+        stamp = start.astimezone(tz.UTC).strftime("%Y%m%dT%H%M%SZ")
+        start_field = {"dateTime": start.isoformat(), "timeZone": tzname}
+        end_field = {"dateTime": end.isoformat(), "timeZone": tzname}
+    instance = dict(data)
+    instance.pop("recurrence", None)
+    instance.update({
+        "id": f"{master.id}_{stamp}",
+        "recurringEventId": master.id,
+        "originalStartTime": dict(start_field),
+        "start": start_field,
+        "end": end_field,
+    })
+    return EVENT_IMPRINT(instance)
+
+
+def expand_series(master: EVENT_IMPRINT, window_start, window_end,
+                  exceptions=(), timezone: str = "UTC"):
+    """
+    Lazily yields the instances of a recurring event that overlap
+    [window_start, window_end), ordered by start.
+
+    exceptions are the modified/cancelled instances Google returns next to
+    the master with singleEvents=False (recurringEventId == master.id):
+    cancelled ones remove their occurrence, modified ones replace it at
+    their new time.
+
+    Example call:
+
+    for event in expand_series(master, dt.date(2024, 7, 1), dt.date(2024, 8, 1)):
+        print(event)
+    """
+    start = to_epoch(window_start, timezone)
+    end = to_epoch(window_end, timezone)
+    # вхождения, закончившиеся до окна, не перебираются с самого DTSTART
+    bounds = event_bounds(master, timezone)
+    after = start - (bounds[1] - bounds[0]) if bounds else None
+    rules, _, duration, all_day, tzname = build_ruleset(master, timezone, after=after)
+
+    overridden = set()
+    replacements = []
+    for exception in exceptions:
+        original = exception.originalStartTime
+        if original.get("dateTime") or original.get("date"):
+            overridden.add(event_bounds(EVENT_IMPRINT({"start": original, "end": original}), timezone)[0])
+        if exception.status == "cancelled":
+            continue
+        bounds = event_bounds(exception, timezone)
+        if bounds and bounds[1] > start and bounds[0] < end:
+            replacements.append((bounds[0], exception))
+    replacements.sort(key=lambda item: item[0])
+
+    def occurrences():
+        data = master.to_dict(include_defaults=False)
+        duration_seconds = duration.total_seconds()
+        for moment in rules:
+            moment_start = to_epoch(moment, timezone)
+            if moment_start >= end:
+                return
+            if moment_start + duration_seconds <= start or moment_start in overridden:
+                continue
+            yield moment_start, _instance(master, data, moment, duration, all_day, tzname)
+
+    for _, event in heapq.merge(occurrences(), replacements, key=lambda item: item[0]):
+        yield event
+
+
+class RecurrenceCache:
+    """
+    Expansions per (series id, window), reused while the series etag and
+    the etags of its exceptions stay the same.
+
+    A cached expansion is stored only after the generator has been
+    consumed to the end, partial iterations are not cached. At most
+    maxsize expansions are kept, the least recently used go first.
+    """
+
+    def __init__(self, maxsize: int = EXPANSION_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._expansions = LRUCache(maxsize=maxsize)
+        self.stats = {"hits": 0, "misses": 0}
+
+    def expand(self, master: EVENT_IMPRINT, window_start, window_end,
+               exceptions=(), timezone: str = "UTC"):
+        key = (master.id, str(window_start), str(window_end), timezone)
+        version = (master.etag, tuple(sorted(e.etag for e in exceptions)))
+        with self._lock:
+            cached = self._expansions.get(key)
+            if cached is not None and cached[0] == version:
+                self.stats["hits"] += 1
+                hit = cached[1]
+            else:
+                self.stats["misses"] += 1
+                hit = None
+        if hit is not None:
+            yield from hit
+            return
+        instances = []
+        for event in expand_series(master, window_start, window_end, exceptions, timezone):
+            instances.append(event)
+            yield event
+        with self._lock:
+            self._expansions[key] = (version, instances)
+
+    def invalidate(self, series_id=None):
+        with self._lock:
+            if series_id is None:
+                self._expansions.clear()
+                return
+            for key in [key for key in self._expansions if key[0] == series_id]:
+                del self._expansions[key]
+
+
+RECURRENCE_CACHE = RecurrenceCache()
+
+
+def iter_expanded_events(service_calendar, time_min, time_max, timezone: str = "UTC",
+                         cache: RecurrenceCache = RECURRENCE_CACHE, **kwargs):
+    """
+    Like iter_events(singleEvents=True), but recurring series come from the
+    server once (master + exceptions) and are expanded locally.
+
+    Single events are yielded as their pages arrive; series are expanded
+    after the last page, since an exception may come after its master.
+    Args:
+        time_min, time_max: RFC3339 strings bounding the window
+        timezone (str): calendar timezone, used for all-day events
+        kwargs: passed to iter_events (page_size, prefetch, calendar_id)
+    """
+    masters = []
+    exceptions = {}
+    for event in iter_events(service_calendar, time_min=time_min, time_max=time_max,
+                             single_events=False, **kwargs):
+        if event.recurrence:
+            masters.append(event)
+        elif event.recurringEventId:
+            exceptions.setdefault(event.recurringEventId, []).append(event)
+        elif event.status != "cancelled":
+            yield event
+    for master in masters:
+        yield from cache.expand(master, time_min, time_max,
+                                exceptions.get(master.id, ()), timezone)
@@ -0,0 +1,48 @@
+import datetime as dt
+
+import pytest
+
+from intent_router import ROUTER
+
+
+NOW = dt.datetime(2026, 10, 18, 12)
+
+
+@pytest.mark.parametrize("text", [
+    "add meeting next week at 10",
+    "add meeting at 10 next month",
+    "add meeting in december at 10",
+    "add meeting tomorrow or friday at 10",
+    "add meeting at 10 in the evening",
+    "add meeting at 10 tomorrow morning",
+    "add dinner tonight at 8",
+    "добавь встречу в мае в 10",
+    "добавь встречу в декабре в 10",
+    "добавь встречу через неделю в 10",
+    "добавь встречу на следующей неделе в 10",
+    "add standup every monday at 10",
+    "не добавляй встречу завтра в 10",
+    "Can you book a flight to Paris at 10am?",
+])
+def test_unclear_commands_go_to_llm(text):
+    assert ROUTER.route(text, NOW) is None
+
+
+@pytest.mark.parametrize("text, summary, start", [
+    ("add meeting tomorrow at 15 for an hour", "Meeting", dt.datetime(2026, 10, 19, 15)),
+    ("Please add lunch with Bob on Friday at noon", "Lunch with Bob", dt.datetime(2026, 10, 23, 12)),
+    ("Добавь встречу с Анной завтра в 10 на полчаса", "Встреча с Анной", dt.datetime(2026, 10, 19, 10)),
+    ("Запланируй тренировку в субботу в 8 утра", "Тренировка", dt.datetime(2026, 10, 24, 8)),
+])
+def test_add_event(text, summary, start):
+    intent = ROUTER.route(text, NOW)
+    assert intent is not None and intent.name == "add_event"
+    args = intent.tool_calls[0]["args"]
+    assert args["summary"] == summary
+    assert args["date"] == start
+
+
+@pytest.mark.parametrize("text", ["what do I have today?", "покажи мои задачи", "show me my next 5 events"])
+def test_list_tasks(text):
+    intent = ROUTER.route(text, NOW)
+    assert intent is not None and intent.name == "get_calendar_tasks"
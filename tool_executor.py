@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+TOOL_TIMEOUT = 30
+MAX_WORKERS = 4
+
+
+class PendingToolCall:
+    def __init__(self, tool_call: dict, future, deadline: float, timeout: float):
+        self.tool_call = tool_call
+        self.future = future
+        self.deadline = deadline
+        self.timeout = timeout
+
+    @property
+    def started(self) -> bool:
+        # отменить можно только вызов, который ещё стоял в очереди пула
+        return not self.future.cancelled()
+
+
+class ToolExecutor:
+    """
+    Runs the tool calls of one model reply in a bounded thread pool.
+
+    Calendar tools spend their time waiting on the network, so
+    "add these three meetings and list my tasks" takes as long as the
+    slowest call instead of the sum. Results are collected in the order of
+    the calls, whatever order they finish in. A call that runs past its
+    timeout is reported as such; its thread cannot be stopped and finishes
+    in the background.
+
+    Example call:
+
+    executor = ToolExecutor(available_tools, timeouts={"add_event": 60})
+    outputs = executor.run(ai_response["tool_calls"])
+    """
+
+    def __init__(self, tools: dict, max_workers: int = MAX_WORKERS,
+                 timeout: float = TOOL_TIMEOUT, timeouts: dict = None):
+        self.tools = tools
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def submit(self, tool_call: dict) -> PendingToolCall:
+        tool_name = tool_call["name"].lower()
+        tool = self.tools[tool_name]
+        timeout = self.timeouts.get(tool_name, self.timeout)
+        # таймаут отсчитывается от запуска, а не от момента, когда до вызова дошла очередь
+        future = self._pool.submit(tool, **tool_call["args"])
+        return PendingToolCall(tool_call, future, time.monotonic() + timeout, timeout)
+
+    def result(self, pending: PendingToolCall):
+        """
+        Output of the tool; exceptions of the tool are raised here.
+        """
+        try:
+            return pending.future.result(timeout=max(pending.deadline - time.monotonic(), 0))
+        except TimeoutError:
+            if pending.future.cancel():
+                return f"Tool {pending.tool_call['name']} was not started in {pending.timeout} s"
+            return f"Tool {pending.tool_call['name']} did not finish in {pending.timeout} s"
+
+    def run(self, tool_calls):
+        """
+        Returns:
+            list: tool outputs, in the order of tool_calls
+        """
+        pending = [self.submit(tool_call) for tool_call in tool_calls]
+        return [self.result(item) for item in pending]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)